@@ -15,14 +15,23 @@ print('GeoDT_3.8.3')
 # ****************************************************************************
 #### libraries
 # ****************************************************************************
+import atexit
 import numpy as np
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from scipy.linalg import solve
 # from scipy.stats import lognorm
-import pylab
+# (pylab is imported where figures are drawn so batch runs do not load matplotlib)
 import math
 from iapws import IAPWS97 as therm
 import SimpleGeometry as sg
 from scipy import stats
+from scipy.interpolate import CubicSpline, RectBivariateSpline
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 # import sys
 # import matplotlib.pyplot as plt
@@ -68,6 +77,15 @@ def HF(r, x0, strikeRad, dipRad, h=0.5):
     disk = sg.transObj(disk, x0)
     return disk
 
+
+def HFs(faces, h=0.5):
+    """
+    Place radial hydraulic fractures for a list of faces, instanced from one disk template
+    """
+    return sg.instanceObjs(*sg.HFs(r=[0.5 * f.dia for f in faces], x0=[f.c0 for f in faces],
+                                   strikeRad=[f.str for f in faces], dipRad=[f.dip for f in faces], h=h))
+
+
 def typ(key):
     """
     definitions and cross-referencing for pipe types
@@ -121,14 +139,962 @@ def azn_dip(x0, x1):
     return azn, dip
 
 
+class PropCache:
+    """
+    least-recently-used memo of water property evaluations
+    - keys are rounded to T_dec decimals in K and P_dec decimals in MPa, and values are computed at the rounded inputs
+    - optional persistence to a pickle file (fname) that is loaded on creation and written by save() (also called
+      at interpreter exit if there are new entries); an unreadable file is treated as an empty cache
+    """
+
+    def __init__(self, size=256, fname='', T_dec=2, P_dec=3):
+        self.size = size
+        self.fname = fname
+        self.T_dec = T_dec
+        self.P_dec = P_dec
+        self.memo = OrderedDict()
+        self.hits = 0
+        self.miss = 0
+        self.dirty = False  # entries not yet saved
+        if fname:
+            self.load(fname)
+            atexit.register(self.close)
+
+    def get(self, key, func):
+        """
+        memoized value for key, calling func() when missing
+        """
+        if key in self.memo:
+            self.hits += 1
+            self.memo.move_to_end(key)
+            return self.memo[key]
+        self.miss += 1
+        val = func()
+        self.memo[key] = val
+        while len(self.memo) > self.size:
+            self.memo.popitem(last=False)
+        self.dirty = True
+        return val
+
+    def clear(self):
+        self.memo = OrderedDict()
+        self.hits = 0
+        self.miss = 0
+
+    def close(self):
+        """
+        save new entries to fname (registered to run at exit)
+        """
+        if self.fname and self.dirty:
+            self.save()
+
+    def save(self, fname=''):
+        """
+        write the memo to a temporary file and rename it over fname, so readers never see a partial file
+        """
+        if not fname:
+            fname = self.fname
+        folder = os.path.dirname(os.path.abspath(fname))
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(list(self.memo.items()), f)
+            os.replace(tmp, fname)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.dirty = False
+
+    def load(self, fname=''):
+        if not fname:
+            fname = self.fname
+        if os.path.exists(fname):
+            try:
+                with open(fname, 'rb') as f:
+                    items = pickle.load(f)
+            except Exception as e:
+                print('warning: property cache %s could not be read (%s), starting empty' % (fname, e))
+                items = []
+            for key, val in items:
+                self.memo[key] = val
+            while len(self.memo) > self.size:
+                self.memo.popitem(last=False)
+
+
+# shared property memo (replace with PropCache(fname=...) to persist across sessions)
+prop_cache = PropCache()
+
+
+def therm_TP(T, P):
+    """
+    memoized water state at temperature T (K) and pressure P (MPa)
+    - returns h (kJ/kg), s (kJ/kg-K), x (steam quality), v (m3/kg)
+    """
+    key = ('TP', round(T, prop_cache.T_dec), round(P, prop_cache.P_dec))
+
+    def state():
+        s = therm(T=key[1], P=key[2])
+        return s.h, s.s, s.x, s.v
+
+    return prop_cache.get(key, state)
+
+
+def enthalpy_fit(T_lo, T_hi, P, num=100):
+    """
+    memoized cubic fits of enthalpy vs temperature (hTP) and temperature vs enthalpy (ThP)
+    between T_lo and T_hi (K) at pressure P (MPa)
+    """
+    key = ('fit', round(T_lo, prop_cache.T_dec), round(T_hi, prop_cache.T_dec), round(P, prop_cache.P_dec), num)
+
+    def fit():
+        x = np.linspace(key[1], key[2], num, dtype=float)
+        y = np.zeros(num, dtype=float)
+        for i in range(0, num):
+            y[i] = therm(T=x[i], P=key[3]).h  # kJ/kg
+        return np.polyfit(x, y, 3), np.polyfit(y, x, 3)
+
+    return prop_cache.get(key, fit)
+
+
+class ThermState:
+    """
+    water state from the property table (attributes match IAPWS97; values may be arrays)
+    """
+
+    def __init__(self, T, P, h, s, x, v):
+        self.T = T  # K
+        self.P = P  # MPa
+        self.h = h  # kJ/kg
+        self.s = s  # kJ/kg-K
+        self.x = x  # steam quality
+        self.v = v  # m3/kg
+
+
+class ThermTable:
+    """
+    tabulated IAPWS97 water properties with bicubic interpolation over the GeoDT operating envelope
+    - compressed liquid from T_lim[0] to saturation for P_lim[0] to Psat(T_lim[1]) = 16.53 MPa
+    - compressed liquid from T_lim[0] to T_lim[1] for 16.53 MPa to P_lim[1]
+    - liquid-vapor mixtures for P_lim[0] to 16.53 MPa (lever rule on tabulated saturation lines)
+    - (P, T), (P, h), (P, s), and (P, x) inputs; states outside the envelope (e.g., superheated steam) are nan
+    - maximum error vs iapws with the default grids (check(), 4000 random states per input pair):
+      T 0.007 K, h 0.03 kJ/kg, s 4e-5 kJ/kg-K, x 3e-5, v 0.01 %
+    """
+
+    def __init__(self, nP=64, nU=48, P_lim=[0.005, 100.0], T_lim=[273.16, 623.15], fname=''):
+        self.nP = nP
+        self.nU = nU
+        self.P_lim = P_lim
+        self.T_lim = T_lim
+        self.fname = fname
+        self.Pmid = -1.0
+        self.sat = {}
+        self.lo = {}
+        self.hi = {}
+        self.built = False
+
+    def build(self):
+        """
+        evaluate iapws on the grids (or reload the grids from fname)
+        """
+        if self.fname and os.path.exists(self.fname):
+            with open(self.fname, 'rb') as f:
+                self.__dict__.update(pickle.load(f))
+            return
+        print('-> building water property tables')
+        # pressure where saturation meets the top of the table
+        self.Pmid = therm(T=self.T_lim[1], x=0).P
+        # saturation lines
+        lP = np.linspace(np.log(self.P_lim[0]), np.log(self.Pmid), 4 * self.nP - 3)
+        sat = np.zeros((7, len(lP)), dtype=float)
+        for i in range(0, len(lP)):
+            l = therm(P=np.exp(lP[i]), x=0)
+            v = therm(P=np.exp(lP[i]), x=1)
+            sat[:, i] = [l.T, l.h, v.h, l.s, v.s, l.v, v.v]
+        self.sat = {'lP': lP}
+        for i, k in enumerate(['T', 'hl', 'hv', 'sl', 'sv', 'vl', 'vv']):
+            self.sat[k] = CubicSpline(lP, sat[i])
+        # liquid tables below and above the saturation limit
+        self.lo = self.build_patch(lP[::4], sat[0][::4])
+        lP = np.linspace(np.log(self.Pmid), np.log(self.P_lim[1]), self.nP)
+        self.hi = self.build_patch(lP, np.zeros(self.nP) + self.T_lim[1])
+        self.built = True
+        if self.fname:
+            with open(self.fname, 'wb') as f:
+                pickle.dump(self.__dict__, f)
+
+    def build_patch(self, lP, Ttop):
+        """
+        liquid property splines on log-pressure and normalized temperature, enthalpy, and entropy
+        """
+        # Chebyshev-Lobatto spacing resolves the ends of each row
+        u = 0.5 - 0.5 * np.cos(np.linspace(0.0, pi, self.nU))
+        T = self.T_lim[0] + u[None, :] * (Ttop[:, None] - self.T_lim[0])
+        h = np.zeros(T.shape, dtype=float)
+        s = np.zeros(T.shape, dtype=float)
+        v = np.zeros(T.shape, dtype=float)
+        for i in range(0, self.nP):
+            for j in range(0, self.nU):
+                state = therm(T=T[i, j], P=np.exp(lP[i]))
+                h[i, j], s[i, j], v[i, j] = state.h, state.s, state.v
+        patch = {'lP': lP, 'Ttop': CubicSpline(lP, Ttop), 'fit': {}}
+        # forward, (P, T) input
+        patch['fit']['T'] = [RectBivariateSpline(lP, u, h), RectBivariateSpline(lP, u, s),
+                             RectBivariateSpline(lP, u, v)]
+        # inverse, (P, h) and (P, s) inputs
+        for k, X in [['h', h], ['s', s]]:
+            patch[k] = [CubicSpline(lP, X[:, 0]), CubicSpline(lP, X[:, -1])]
+            Y = np.zeros((4, self.nP, self.nU), dtype=float)
+            for i in range(0, self.nP):
+                ui = (X[i] - X[i, 0]) / (X[i, -1] - X[i, 0])
+                for n, Z in enumerate([T, h, s, v]):
+                    Y[n, i] = CubicSpline(ui, Z[i])(u)
+            patch['fit'][k] = [RectBivariateSpline(lP, u, Y[n]) for n in range(0, 4)]
+        return patch
+
+    def state(self, T=None, P=None, h=None, s=None, x=None):
+        """
+        water state for (P, T), (P, h), (P, s), or (P, x) inputs (scalars or arrays)
+        """
+        if not self.built:
+            self.build()
+        P = np.asarray(P, dtype=float)
+        if T is not None:
+            key, val = 'T', np.asarray(T, dtype=float)
+        elif h is not None:
+            key, val = 'h', np.asarray(h, dtype=float)
+        elif s is not None:
+            key, val = 's', np.asarray(s, dtype=float)
+        else:
+            key, val = 'x', np.asarray(x, dtype=float)
+        P, val = np.broadcast_arrays(P, val)
+        scalar = (P.ndim == 0)
+        P = np.atleast_1d(P)
+        val = np.atleast_1d(val)
+        lP = np.log(np.clip(P, 1.0e-12, None))
+        out = np.full((6,) + P.shape, np.nan)
+        out[1] = P
+
+        # liquid-vapor mixtures
+        wet = (lP >= self.sat['lP'][0]) & (lP <= self.sat['lP'][-1])
+        sat = {}
+        for k in ['T', 'hl', 'hv', 'sl', 'sv', 'vl', 'vv']:
+            sat[k] = self.sat[k](np.where(wet, lP, self.sat['lP'][0]))
+        if key == 'x':
+            q = np.where(wet & (val >= 0.0) & (val <= 1.0), val, np.nan)
+        elif key == 'T':
+            q = np.full(P.shape, np.nan)
+        else:
+            q = (val - sat[key + 'l']) / (sat[key + 'v'] - sat[key + 'l'])
+            q = np.where(wet & (q > 0.0) & (q <= 1.0), q, np.nan)
+        mix = np.isfinite(q)
+        out[0] = np.where(mix, sat['T'], out[0])
+        out[2] = np.where(mix, sat['hl'] + q * (sat['hv'] - sat['hl']), out[2])
+        out[3] = np.where(mix, sat['sl'] + q * (sat['sv'] - sat['sl']), out[3])
+        out[4] = np.where(mix, q, out[4])
+        out[5] = np.where(mix, sat['vl'] + q * (sat['vv'] - sat['vl']), out[5])
+
+        # compressed liquid
+        if key != 'x':
+            for patch in [self.lo, self.hi]:
+                inp = (lP >= patch['lP'][0]) & (lP <= patch['lP'][-1]) & np.invert(mix)
+                lp = np.where(inp, lP, patch['lP'][0])
+                if key == 'T':
+                    u = (val - self.T_lim[0]) / (patch['Ttop'](lp) - self.T_lim[0])
+                else:
+                    X0 = patch[key][0](lp)
+                    u = (val - X0) / (patch[key][1](lp) - X0)
+                inp = inp & (u >= -1.0e-9) & (u <= 1.0 + 1.0e-9)
+                if not np.any(inp):
+                    continue
+                fit = [f.ev(lp[inp], u[inp]) for f in patch['fit'][key]]
+                if key == 'T':
+                    out[0][inp], out[2][inp], out[3][inp], out[5][inp] = val[inp], fit[0], fit[1], fit[2]
+                else:
+                    out[0][inp], out[2][inp], out[3][inp], out[5][inp] = fit[0], fit[1], fit[2], fit[3]
+                out[4][inp] = 0.0
+
+        if scalar:
+            out = [float(o[0]) for o in out]
+        return ThermState(*out)
+
+    def check(self, num=4000, seed=0):
+        """
+        maximum absolute errors (relative for v) vs iapws for random states in the envelope
+        """
+        rng = np.random.default_rng(seed)
+        errs = {}
+        for key in ['T', 'h', 's', 'x']:
+            err = np.zeros(5, dtype=float)
+            for n in range(0, num):
+                P = np.exp(rng.uniform(np.log(self.P_lim[0]), np.log(self.P_lim[1])))
+                if key == 'x':
+                    P = np.exp(rng.uniform(np.log(self.P_lim[0]), np.log(16.5)))
+                    ref = therm(P=P, x=rng.uniform(0.0, 1.0))
+                else:
+                    if P < 16.5:
+                        Tt = therm(P=P, x=0).T
+                    else:
+                        Tt = self.T_lim[1]
+                    ref = therm(T=rng.uniform(self.T_lim[0], Tt), P=P)
+                    if (key != 'T') and (P < 16.5) and (rng.uniform() < 0.5):
+                        ref = therm(P=P, x=rng.uniform(0.0, 1.0))
+                tab = self.state(P=P, **{key: getattr(ref, key)})
+                err = np.maximum(err, np.abs([tab.T - ref.T, tab.h - ref.h, tab.s - ref.s, tab.x - ref.x,
+                                              (tab.v - ref.v) / ref.v]))
+            errs[key] = dict(zip(['T', 'h', 's', 'x', 'v'], err))
+        return errs
+
+
+# property backend for cycle calculations: 'exact' (iapws) or 'table' (ThermTable with iapws fallback)
+prop_backend = 'exact'
+prop_table = ThermTable()
+
+
+def set_prop_backend(backend='exact', table=None):
+    """
+    select the water property backend ('exact' or 'table') and optionally replace the table
+    """
+    global prop_backend, prop_table
+    if backend not in ['exact', 'table']:
+        print('error: property backend %s not recognized' % (backend))
+        return
+    prop_backend = backend
+    if table is not None:
+        prop_table = table
+
+
+def prop(T=None, P=None, h=None, s=None, x=None):
+    """
+    water state from the selected property backend (states outside the table are evaluated exactly)
+    """
+    kw = {}
+    for k, v in [['T', T], ['P', P], ['h', h], ['s', s], ['x', x]]:
+        if v is not None:
+            kw[k] = v
+    if prop_backend == 'table':
+        state = prop_table.state(**kw)
+        if np.isfinite(state.h):
+            return state
+    return therm(**kw)
+
+
+def prop_array(T=None, P=None, h=None, s=None, x=None, backend=None):
+    """
+    water states for arrays of inputs from the selected property backend (returns a ThermState of arrays)
+    - backend: 'exact' or 'table' to override the module setting for this call
+    """
+    kw = {}
+    for k, v in [['T', T], ['P', P], ['h', h], ['s', s], ['x', x]]:
+        if v is not None:
+            kw[k] = np.asarray(v, dtype=float)
+    keys = list(kw.keys())
+    vals = np.broadcast_arrays(*[kw[k] for k in keys])
+    shape = vals[0].shape
+    # tabulated states
+    if backend is None:
+        backend = prop_backend
+    if backend == 'table':
+        state = prop_table.state(**dict(zip(keys, vals)))
+        out = np.asarray([np.broadcast_to(getattr(state, k), shape) for k in ['T', 'P', 'h', 's', 'x', 'v']])
+    else:
+        out = np.full((6,) + shape, np.nan)
+    # exact states for the rest (once per unique input)
+    miss = np.invert(np.isfinite(out[2]))
+    if np.any(miss):
+        pts = np.stack([v[miss] for v in vals], axis=-1)
+        uni, inv = np.unique(pts, axis=0, return_inverse=True)
+        res = np.zeros((len(uni), 6), dtype=float)
+        for i in range(0, len(uni)):
+            state = therm(**dict(zip(keys, uni[i])))
+            res[i] = [state.T, state.P, state.h, state.s, state.x, state.v]
+        for k in range(0, 6):
+            out[k, miss] = res[inv.ravel(), k]
+    return ThermState(*out)
+
+
+def flash_binary_power(h_pro,
+                       m_pro,
+                       m_inj,
+                       T_inj,
+                       P_inj,
+                       P_whp,
+                       P_exh,
+                       effic=0.85,
+                       detail=False,
+                       backend=None):
+    """
+    energy generation - single flash rankine + simplified binary (Frash, 2020; Heberle and Bruggemann, 2010)
+    - h_pro: production enthalpy (kJ/kg); m_pro: production mass flow (kg/s, positive); m_inj: injection mass flow (kg/s)
+    - T_inj: injection temperature (K); P_inj, P_whp, P_exh: injection, flash, and turbine exhaust pressures (MPa)
+    - inputs may be arrays that broadcast together (e.g., time series or runs x times)
+    - invariant states are evaluated on the shape of their own inputs and the production states as arrays
+    - backend: property backend for this call ('exact', 'table', or None for the module setting)
+    - returns flash, binary, pump, and net power (kW)
+    """
+    # truncate pressures when supercritical
+    pmax = 100.0
+    P_inj = np.minimum(np.asarray(P_inj, dtype=float), pmax)
+    P_whp = np.minimum(np.asarray(P_whp, dtype=float), pmax)
+    P_exh = np.minimum(np.asarray(P_exh, dtype=float), pmax)
+    h_pro = np.asarray(h_pro, dtype=float)
+    T_inj = np.asarray(T_inj, dtype=float)
+    shape = np.broadcast_shapes(np.shape(h_pro), np.shape(m_pro), np.shape(m_inj), np.shape(T_inj),
+                                np.shape(P_inj), np.shape(P_whp), np.shape(P_exh), np.shape(effic))
+
+    # Surface Injection Well (5)
+    T5 = T_inj  # K
+    P5 = P_inj  # MPa
+    st5 = prop_array(T=T5, P=P5, backend=backend)
+    v5 = st5.v  # m3/kg
+
+    # Brine Flow Stream (2l)
+    P2 = P_whp  # MPa
+    st2l = prop_array(P=P2, x=0.0, backend=backend)
+    P2l = st2l.P  # MPa
+    h2l = st2l.h  # kJ/kg
+    T2l = st2l.T  # K
+
+    # Turbine Flow Stream (2s)
+    st2s = prop_array(P=P2, x=1.0, backend=backend)
+    h2s = st2s.h  # kJ/kg
+
+    # Surface Production Well (2)
+    h2 = np.broadcast_to(h_pro, shape)  # kJ/kg
+    x2 = np.clip((h2 - h2l) / (h2s - h2l), 0.0, 1.0)  # steam quality
+    T2 = np.array(np.broadcast_to(T2l, shape), dtype=float)  # K
+    sub = h2 < np.broadcast_to(h2l, shape)
+    if np.any(sub):
+        T2[sub] = prop_array(P=np.broadcast_to(P2, shape)[sub], h=h2[sub], backend=backend).T
+
+    # Turbine Outflow (3s)
+    # exhaust below the IAPWS range: the outflow keeps the turbine inlet state (2s), so no turbine work is counted
+    low = P_exh < iapws.iapws97.Pmin
+    skip = np.broadcast_to(low, shape) & (x2 > 0.0)
+    if np.any(skip):
+        print('warning: turbine exhaust pressure (%.2e MPa) is below the IAPWS minimum (%.2e MPa); '
+              % (np.min(np.broadcast_to(P_exh, shape)[skip]), iapws.iapws97.Pmin)
+              + 'turbine work is zero for %i of %i entries' % (np.sum(skip), skip.size))
+    st3s = prop_array(P=np.where(low, P2, P_exh), s=st2s.s, backend=backend)
+    st3s = ThermState(*[np.where(low, getattr(st2s, k), getattr(st3s, k)) for k in ['T', 'P', 'h', 's', 'x', 'v']])
+
+    # Condenser Outflow (4s)
+    st4s = prop_array(T=T5, P=st3s.P, backend=backend)
+    st4l = prop_array(T=T5, P=P2l, backend=backend)
+
+    # Outlet thermal state
+    TBo = np.maximum(T5, 51.85 + 273.15)
+    stBs = prop_array(T=TBo, P=np.minimum(st3s.P, P2), backend=backend)
+    stBl = prop_array(T=TBo, P=np.minimum(P2l, P2), backend=backend)
+
+    # turbine streams take the brine state when there is no steam
+    flash = x2 > 0.0
+    h2s = np.where(flash, h2s, h2l)  # kJ/kg
+    P3s = np.where(flash, st3s.P, P2l)  # MPa
+    h3s = np.where(flash, st3s.h, h2l)  # kJ/kg
+    T3s = np.where(flash, st3s.T, T2l)  # K
+    P4s = np.where(flash, st4s.P, st4l.P)  # MPa
+    PBo = np.where(flash, stBs.P, stBl.P)  # MPa
+    hBo = np.where(flash, stBs.h, stBl.h)  # kJ/kg
+    TBo = np.where(flash, stBs.T, stBl.T)  # K
+
+    # Turbine Work
+    w3s = h2s - h3s  # kJ/kg
+
+    # Pump Work
+    w5s = v5 * (P5 - P4s) * 10 ** 3  # kJ/kg
+    w5l = v5 * (P5 - P2l) * 10 ** 3  # kJ/kg
+
+    # Mass flow rates
+    mt = np.broadcast_to(m_pro, shape)
+    ms = mt * x2
+    ml = mt * (1.0 - x2)
+    mi = np.broadcast_to(m_inj, shape)
+    Vt = (v5 * mt) * (1000 * 60)  # L/min
+
+    # Pumping power
+    Pump = np.where(mi > mt, -1.0 * (ms * w5s + ml * w5l) / effic + -1.0 * (mi - mt) * w5s / effic,
+                    np.where(mi < ml, -1.0 * (mi * w5l) / effic,
+                             -1.0 * ((mi - ml) * w5s + ml * w5l) / effic))  # kW
+
+    # Flash cycle power
+    Flash = ms * np.maximum(0.0, w3s) * effic  # kW
+
+    # Binary Cycle Inlet from Turbine
+    TBis = T3s
+    PBis = P3s
+    hBis = h3s
+
+    # Binary Cycle Inlet from Brine
+    TBil = np.minimum(T2l, T2)
+    PBil = np.broadcast_to(P2l, shape)
+    hBil = np.minimum(h2l, h2)
+
+    # Binary thermal-electric efficiency
+    # (estimated from Heberle and Bruggermann, 2010 - Fig. 4 - doi:10.1016/j.applthermaleng.2010.02.012)
+    nBs = np.maximum(0.0, 0.0899 * TBis - 25.95) / 100.0
+    nBl = np.maximum(0.0, 0.0899 * TBil - 25.95) / 100.0
+    Binary = (ms * nBs * np.maximum(0.0, hBis - hBo) + ml * nBl * np.maximum(
+        0.0, hBil - hBo)) * effic  # kW, power produced from binary cycle
+
+    # Net power
+    Net = Flash + Binary + Pump
+
+    # print details (last state)
+    if detail and (np.size(Net) > 0):
+        i = np.unravel_index(np.size(Net) - 1, shape)
+
+        def last(a):
+            return np.broadcast_to(a, shape)[i]
+
+        keys = ['T', 'P', 'h', 's', 'x', 'v']
+        st2 = prop_array(P=last(P2), h=last(h2), backend=backend)
+        sts = [st5, st2, st2s, st2l, st3s, st4s]
+        if not flash[i]:
+            sts = [st5, st2, st2l, st2l, st2l, st4l]
+        print('\n*** Rankine Cycle Thermal State Values ***')
+        for lab, st in zip(['Inject (5)', 'Produc (2)', 'Turbi (2s)', 'Brine (2l)', 'Exhau (3s)', 'Conde (4s)'], sts):
+            print(("%s: T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f"
+                   % tuple([lab] + [last(getattr(st, k)) for k in keys])))
+        print('*** Binary Cycle Thermal State Values ***')
+        print(("Steam: Ti= %.2f; Pi= %.2f; hi= %.2f -> To= %.2f, Po= %.2f, ho= %.2f, n =%.3f" % (
+            last(TBis), last(PBis), last(hBis), last(TBo), last(PBo), last(hBo), last(nBs))))
+        print(("Brine: Ti= %.2f; Pi= %.2f; hi= %.2f -> To= %.2f, Po= %.2f, ho= %.2f, n =%.3f" % (
+            last(TBil), last(PBil), last(hBil), last(TBo), last(PBo), last(hBo), last(nBl))))
+        print('*** Power Output Estimation ***')
+        print("Turbine Flow Rate = %.2f kg/s" % (last(ms)))
+        print("Bypass Flow Rate = %.2f kg/s" % (last(ml)))
+        print("Well Flow Rate = %.2f kg/s = %.2f L/min" % (last(mt), last(Vt)))
+        print("Flash Power at %.2f kW" % (last(Flash)))
+        print("Binary Power at %.2f kW" % (last(Binary)))
+        print("Pumping Power at %.2f kW" % (last(Pump)))
+        print("Net Power at %.2f kW" % (last(Net)))
+
+    return Flash, Binary, Pump, Net
+
+
+def economics(Net_Power,
+              dt,
+              life,
+              depth,
+              drill_len,
+              Max_Quake,
+              interest=0.04,  # standard inflation rate, 4% rule
+              sales_kWh=0.1372,  # $/kWh - customer electricity retail price
+              drill_m=2763.06,  # $/m - Lowry et al, 2017 large diameter well baseline
+              pad_fixed=590e3,  # $ Lowry et al, 2017 large diameter well baseline
+              plant_kWe=2025.65,  # $/kWe simplified from GETEM model
+              explore_m=2683.41,  # $/m simplified from GETEM model
+              oper_kWh=0.03648,  # $/kWh simplified from GETEM model
+              quake_coef=2e-4,
+              # $/Mw for $300M Mw 5.5 quake Pohang (Westaway, 2021) & $17.2B Mw 6.3 quake Christchurch (Swiss Re)
+              quake_exp=5.0):
+    # $/Mw for $300M Mw 5.5 quake Pohang (Westaway, 2021) & $17.2B Mw 6.3 quake Christchurch (Swiss Re)
+    """
+    optimization objective function (with $!!!), to be normalized to 2021 studies
+    - Net_Power: net power (kW) with times along the last axis (e.g., runs x times)
+    - dt, life: time step and life span (yr); depth, drill_len: resource depth and drilled length (m)
+    - per-run values broadcast over the leading axes of Net_Power
+    - returns NPV, P, C, Q ($)
+    """
+    # eliminate periods of negative net power production
+    Pout_NN = np.asarray(Net_Power, dtype=float) + 0.0
+    Pout_NN[Pout_NN < 0.0] = 0.0
+    NPsum = np.sum(Pout_NN, axis=-1)
+    # power profit
+    P = (sales_kWh - oper_kWh) * NPsum * dt * 24.0 * 365.2425
+    # capital costs
+    C = 0.0
+    C += drill_m * drill_len
+    C += pad_fixed
+    C += plant_kWe * NPsum * dt / life
+    C += explore_m * depth
+    # quake cost
+    Q = quake_coef * np.exp(Max_Quake * quake_exp)
+    # net present value
+    NPV = P - C - Q
+    return NPV, P, C, Q
+
+
+def load_results(fname):
+    """
+    read an inputs_results file written by Mesh.save
+    - returns the structured data (one record per run) and the time-series columns as runs x times arrays
+    """
+    data = np.genfromtxt(fname, delimiter=',', names=True, filling_values=np.nan, deletechars='()',
+                         case_sensitive=True)
+    data = np.atleast_1d(data)
+    names = data.dtype.names
+    # collect time series by column prefix (hpro:0.000, Pout:0.000, dhout:0.000)
+    series = {}
+    for k in ['hpro', 'Pout', 'dhout']:
+        cols = [n for n in names if n.split(':')[0] == k]
+        series[k] = np.full((len(data), len(cols)), np.nan)
+        for j in range(0, len(cols)):
+            series[k][:, j] = data[cols[j]]
+        if k == 'hpro':
+            series['ts'] = np.asarray([float(n.split(':')[1]) for n in cols])  # yr
+    return data, series
+
+
+def reprice_results(data,
+                    series=None,
+                    GenEfficiency=None,
+                    p_whp=None,
+                    AmbPres=None,
+                    backend='table',
+                    detail=False,
+                    **econ):
+    """
+    batch re-evaluation of power and economics from saved results (runs x times as matrix operations)
+    - data, series: output from load_results (or data as a file name)
+    - GenEfficiency, p_whp (Pa), AmbPres (Pa): plant parameters to replace the saved values (None keeps saved)
+    - backend: property backend for the cycle ('table' for speed, 'exact' for IAPWS97 at every state)
+    - econ: economic parameters passed to economics (sales_kWh, drill_m, quake_coef, etc.)
+    - returns Pout (runs x times, kW) and NPV, P, C, Q (runs, $)
+    """
+    if series is None:
+        data, series = load_results(data)
+    hpro = series['hpro']
+    ts = series['ts']
+
+    # plant parameters
+    if GenEfficiency is None:
+        GenEfficiency = data['GenEfficiency']
+    if p_whp is None:
+        p_whp = data['p_whp']
+    if AmbPres is None:
+        AmbPres = data['AmbPres']
+
+    # power for all runs and times
+    # (per-run values as columns so they broadcast over times)
+    cols = []
+    for v in [-data['mpro'], data['minj'], data['Tinj'] + 273.15, data['pinj'], p_whp / MPa, AmbPres / MPa,
+              GenEfficiency]:
+        cols += [np.reshape(np.asarray(v, dtype=float), (-1, 1))]
+    Fout, Bout, Qout, Pout = flash_binary_power(hpro, *cols, backend=backend)
+
+    # economics for all runs
+    dt = ts[1] - ts[0]
+    life = data['LifeSpan'] / yr
+    lateral = (data['w_length'] * data['w_count']) + (data['w_proportion'] * data['w_length'])
+    drill_len = data['ResDepth'] * (data['w_count'] + 1) + lateral
+    NPV, P, C, Q = economics(Pout, dt, life, data['ResDepth'], drill_len, data['max_quake'], **econ)
+
+    if detail:
+        print('\n*** repriced %i runs x %i times ***' % (np.shape(Pout)[0], np.shape(Pout)[1]))
+        print('   NPV: $%.0f mean, $%.0f max' % (np.nanmean(NPV), np.nanmax(NPV)))
+        print('   positive NPV: %i runs' % (np.sum(NPV > 0.0)))
+
+    return Pout, NPV, P, C, Q
+
+
+def load_heat_stream(fname):
+    """
+    read per-step heat solver records written by get_heat(stream=fname)
+    - returns a dict of arrays stacked over solver steps (t, dt, ht, Tt, Rt, Et, Qt, conv)
+    """
+    recs = []
+    with open(fname, 'rb') as f:
+        while 1:
+            try:
+                recs += [pickle.load(f)]
+            except EOFError:
+                break
+    out = {}
+    if not recs:
+        print('warning: no heat solver records in %s' % (fname))
+        return out
+    for k in recs[0].keys():
+        vals = []
+        for r in recs:
+            vals += [r[k]]
+        out[k] = np.asarray(vals)
+    return out
+
+
+def plot_heat(data, fname=''):
+    """
+    four-panel heat and power summary (production enthalpy, power, production temperature, thermal extraction)
+    - data: plot data recorded by get_heat (Mesh.h_plot)
+    - fname: png file to save and close the figure (otherwise the figure is left open)
+    """
+    import pylab
+    ts = data['ts']
+    fig = pylab.figure(figsize=(11.0, 8.5), dpi=96, facecolor='w', edgecolor='k',
+                       tight_layout=True)  # Medium resolution
+    font = {'family': 'serif', 'size': 16}
+    pylab.rc('font', serif='Arial')
+    pylab.rc('font', **font)
+    ax1 = fig.add_subplot(221)
+    for w_h in data['w_h']:
+        ax1.plot(ts[:-1] / yr, w_h[:-1], linewidth=1.5)
+    ax1.set_xlabel('Time (yr)')
+    ax1.set_ylabel('Production Enthalpy (kJ/kg)')
+    # ax1.set_ylim(bottom=0.0)
+    ax2 = fig.add_subplot(222)
+    ax2.plot(ts[:-1] / yr, data['Fout'][:], linewidth=1.0, color='red')
+    ax2.plot(ts[:-1] / yr, data['Bout'][:], linewidth=1.0, color='blue')
+    ax2.plot(ts[:-1] / yr, data['Qout'][:], linewidth=1.0, color='cyan')
+    ax2.plot(ts[:-1] / yr, data['Pout'][:], linewidth=1.5, color='black')
+    ax2.set_xlabel('Time (yr)')
+    ax2.set_ylabel('Fla-R, Bin-B, Pum-C, Net-K (kWe)')
+    # ax2.set_ylim(bottom=0.0)
+    ax3 = fig.add_subplot(223)
+    for w_T in data['w_T']:
+        ax3.plot(ts[:-1] / yr, w_T[:-1], linewidth=1.5)
+    ax3.set_xlabel('Time (yr)')
+    ax3.set_ylabel('Production Temperature (K)')
+    # ax3.set_ylim(bottom=273.0)
+    ax4 = fig.add_subplot(224)
+    ax4.plot(ts[:-1] / yr, data['dht'][:-1], linewidth=1.5, color='green')
+    ax4.set_xlabel('Time (yr)')
+    ax4.set_ylabel('Thermal Extraction (kJ/s)')
+    # ax4.set_ylim(bottom=0.0)
+    if fname:
+        pylab.savefig(fname, format='png')
+        pylab.close(fig)
+    return fig
+
+
+def plot_heat_batch(datas, fnames):
+    """
+    render deferred heat and power summaries (e.g., collected from Mesh.h_plot over a batch of runs) to png files
+    """
+    for i in range(0, len(datas)):
+        plot_heat(datas[i], fnames[i])
+
+
+def response_kernels(ts, Lp, Wp, rad, ResSv, ResKt, CemKt, H, Ris, Ric, Rir, ERm, ERb):
+    """
+    conduction limited rock heat extraction after a unit (1 K) step in rock-fluid temperature difference
+    - follows the thermal radius model of get_heat (plate for fractures, radial with ERm, ERb fit for wells)
+    - ts: times since the step (s)
+    - returns extracted energy (kJ/K) and thermal radius (m) for each pipe (rows) at each time (columns)
+    """
+    kr = ResKt * 10 ** -3  # kW/m-K
+    ts = np.asarray(ts, dtype=float)
+    # plate: dR0/dt = 2/(Sv*(1/H + R0/k)) integrates to R0/H + R0**2/(2k) = 2t/Sv
+    Rpla = kr * (-1.0 / H + (1.0 / H ** 2.0 + 4.0 * ts / (ResSv * kr)) ** 0.5)
+    # radial: energy per unit length (e) with time from t(e) = integral of the thermal resistance over e
+    e = np.concatenate(([0.0], np.geomspace(1.0e-6, 1.0e14, 6000)))
+    Re = np.exp(ERm * np.log(np.maximum(e, 1.0e-6)) + ERb) + Rir
+    Re[0] = Rir
+    rt = 1.0 / (2.0 * pi * Ris * H) + np.log(Re / Rir) / (2.0 * pi * kr) + np.log(Rir / Ric) / (
+            2.0 * pi * CemKt * 10 ** -3)
+    te = np.concatenate(([0.0], np.cumsum(0.5 * (rt[1:] + rt[:-1]) * np.diff(e))))
+    if np.max(ts) > te[-1]:
+        print('warning: radial response kernel truncated at %.3e s' % (te[-1]))
+    erad = np.interp(ts, te, e)
+    Rrad = np.interp(erad, e, Re)
+    # per pipe
+    Lp = np.asarray(Lp, dtype=float)[:, None]
+    Wp = np.asarray(Wp, dtype=float)[:, None]
+    rad = np.asarray(rad, dtype=bool)[:, None]
+    Ek = np.where(rad, Lp * erad[None, :], ResSv * Wp * Lp * Rpla[None, :])
+    Rk = np.where(rad, Rrad[None, :], Rpla[None, :])
+    return Ek, Rk
+
+
+class HeatSteps:
+    """
+    heat solver time step controller
+    - tstep: 'uniform' steps of t_f/t_n, 'geometric' steps growing by dt_grow from dt_min (default t_f/t_n/100),
+      or 'adaptive' steps with error control on the produced enthalpy (see accept)
+    - steps never exceed dt_max (default and at most t_f/t_n, the reporting interval)
+    - ts: uniform reporting grid of t_n steps, ta: solver times so far, dt: size of the next step
+    """
+
+    def __init__(self, tstep, t_f, t_n, dt_min=-1.0, dt_grow=1.25, h_tol=20.0, dt_max=-1.0):
+        if tstep not in ['uniform', 'geometric', 'adaptive']:
+            print('error: heat solver time stepping %s not recognized' % (tstep))
+            tstep = 'uniform'
+        if dt_min < 0:
+            dt_min = t_f / t_n / 100.0
+        if (dt_max < 0) or (dt_max > t_f / t_n):
+            dt_max = t_f / t_n
+        self.tstep = tstep
+        self.t_f = t_f
+        self.t_n = t_n
+        self.dt_min = np.min([dt_min, dt_max])
+        self.dt_max = dt_max
+        self.dt_grow = dt_grow
+        self.h_tol = h_tol
+        self.ts = np.linspace(0.0, t_f, t_n + 1)
+        self.ta = [0.0]
+        self.dt = self.ts[1] - self.ts[0]
+        if tstep != 'uniform':
+            self.dt = self.dt_min
+        # error estimate of the last accepted step (None before there are two prior steps) and rejected steps
+        self.err = None
+        self.rejects = 0
+
+    def done(self, t):
+        """
+        True once step t reaches the end time, otherwise land the step on the end time when close
+        """
+        if self.tstep == 'uniform':
+            return t >= self.t_n
+        if self.ta[-1] >= self.t_f * (1.0 - 1.0e-9):
+            return True
+        # (absorbing a short remainder)
+        rem = self.t_f - self.ta[-1]
+        if (rem < 1.25 * self.dt) and (rem <= self.dt_max * (1.0 + 1.0e-9)):
+            self.dt = rem
+        return False
+
+    def accept(self, h, h_pro):
+        """
+        error control for 'adaptive' steps, True to keep the step just solved
+        - the error is the largest departure of the produced enthalpies h (kJ/kg) from their linear extrapolation
+          through the two prior steps (h_pro, at step midpoints), i.e., the curvature the step size misses
+        - steps with an error above h_tol are rejected and shrunk (down to dt_min) for another try
+        """
+        self.err = None
+        if (self.tstep != 'adaptive') or (len(h_pro) < 2):
+            return True
+        m0 = 0.5 * (self.ta[-3] + self.ta[-2])
+        m1 = 0.5 * (self.ta[-2] + self.ta[-1])
+        m = self.ta[-1] + 0.5 * self.dt
+        hp = h_pro[-1] + (h_pro[-1] - h_pro[-2]) * (m - m1) / (m1 - m0)
+        self.err = np.max(np.abs(np.asarray(h) - hp))
+        if (self.err <= self.h_tol) or (self.dt <= self.dt_min * (1.0 + 1.0e-9)):
+            return True
+        self.dt = np.max([self.dt * np.max([0.2, 0.9 * (self.h_tol / self.err) ** 0.5]), self.dt_min])
+        self.rejects += 1
+        return False
+
+    def advance(self):
+        """
+        close the current step and size the next one
+        """
+        self.ta += [self.ta[-1] + self.dt]
+        if self.tstep == 'geometric':
+            self.dt = self.dt * self.dt_grow
+        elif self.tstep == 'adaptive':
+            # scale the step to its error estimate (second order in dt)
+            if self.err is None:
+                self.dt = self.dt * self.dt_grow
+            else:
+                self.dt = self.dt * np.clip(0.9 * (self.h_tol / (self.err + 1.0e-12)) ** 0.5, 0.2, self.dt_grow)
+        if self.tstep != 'uniform':
+            self.dt = np.clip(self.dt, self.dt_min, self.dt_max)
+
+
+def step_mean(A, tA, tB):
+    """
+    mean of the rows of A over each interval of times tB, for rows held over the solver steps between times tA
+    """
+    tA = np.asarray(tA, dtype=float)
+    tB = np.asarray(tB, dtype=float)
+    A = np.asarray(A, dtype=float)
+    # running integral at the step times, then within steps
+    C = np.concatenate((np.zeros((1, A.shape[1])), np.cumsum(A * np.diff(tA)[:, None], axis=0)), axis=0)
+    j = np.clip(np.searchsorted(tA, tB, side='right') - 1, 0, len(A) - 1)
+    I = C[j] + (tB - tA[j])[:, None] * A[j]
+    return np.diff(I, axis=0) / np.diff(tB)[:, None]
+
+
+class HeatStream:
+    """
+    per-step heat solver records pickled to a file (read back with load_heat_stream)
+    - resume: append to the records of an earlier run instead of starting over
+    """
+
+    def __init__(self, fname, resume=False):
+        mode = 'wb'
+        if resume:
+            mode = 'ab'
+        self.f = open(fname, mode)
+
+    def add(self, **rec):
+        pickle.dump(rec, self.f)
+
+    def close(self):
+        self.f.close()
+
+
+class ResponseHistory:
+    """
+    superposition of conduction responses over the history of rock-fluid temperature differences (uniform steps)
+    - Gk: step-averaged heating rates (kJ/K-s) for a unit temperature difference at lags of 0..t_n-1 steps, by pipe
+    - convolve: 'direct' sums of the history each step, or 'fft' to add completed blocks of the history to all
+      later steps by FFT convolution (same result, fewer operations for long series)
+    - Dp: temperature difference history of the steps already solved (restarts)
+    """
+
+    def __init__(self, Gk, t_n, convolve='direct', Dp=None):
+        self.t_n = t_n
+        self.dGk = np.zeros((len(Gk), t_n), dtype=float)
+        self.dGk[:, 1:] = np.diff(Gk, axis=1)
+        # temperature difference history and history heating from completed blocks
+        self.Dt = np.zeros((len(Gk), t_n), dtype=float)
+        self.Ht = np.zeros((len(Gk), t_n), dtype=float)
+        if Dp is not None:
+            self.Dt[:, :Dp.shape[1]] = Dp
+        self.b0 = 0
+        self.blk = t_n + 1
+        if convolve == 'fft':
+            self.blk = int(np.max([4, np.sqrt(t_n)]))
+        elif convolve != 'direct':
+            print('error: heat solver convolution %s not recognized' % (convolve))
+
+    def heating(self, t):
+        """
+        heating (kJ/s) carried over from the history into step t
+        """
+        b0 = self.b0
+        return self.Ht[:, t] + np.sum(self.Dt[:, b0:t] * self.dGk[:, t - b0:0:-1], axis=1)
+
+    def add(self, t, dE, Qc):
+        """
+        record the effective temperature difference of the realized heating (dE) with conductance Qc at step t
+        """
+        np.divide(dE, Qc, out=self.Dt[:, t], where=Qc > 0)
+        # add a completed block of the history to all later steps
+        b0 = self.b0
+        t_n = self.t_n
+        if (t + 1 - b0 >= self.blk) and (t + 1 < t_n):
+            nf = int(2 ** np.ceil(np.log2(t + 1 - b0 + t_n)))
+            c = np.fft.irfft(np.fft.rfft(self.Dt[:, b0:t + 1], nf, axis=1) * np.fft.rfft(self.dGk, nf, axis=1), nf,
+                             axis=1)
+            self.Ht[:, t + 1:] += c[:, t + 1 - b0:t_n - b0]
+            self.b0 = t + 1
+
+
+def stim_group(job):
+    """
+    process pool worker for Mesh.par_stim
+    - job: (pickled model, seed, dyn_stim keyword arguments)
+    - returns the pickled stimulation state (Mesh.s_state) after the group's last iteration
+    """
+    blob, seed, kwargs = job
+    geom = pickle.loads(blob)
+    geom.reseed(seed)
+    geom.dyn_stim(**kwargs)
+    # stopped before finishing an iteration (e.g., full flow at the first pressure)
+    if not (geom.s_state):
+        i_div = np.sum([int(w.typ) in [typ('injector')] for w in geom.wells])
+        geom.s_state = {'bound': geom.bound, 'fracs': geom.fracs, 'hydfs': geom.hydfs, 'wells': geom.wells,
+                        'iters': 1, 'probes': 0, 'dpi': np.ones(i_div, dtype=float) * -geom.rock.dPi,
+                        'tip': np.ones(i_div, dtype=float) * geom.rock.BH_P,
+                        'vol_rem': np.ones(i_div, dtype=float) * kwargs['Vinj']}
+    return pickle.dumps(geom.s_state)
+
+
 def exponential_trunc(nsam,
                       bval=1.0,
                       Mmax=5.0,
                       Mwin=1.0,
-                      prob=0.1):
+                      prob=0.1,
+                      rng=None):
     """
     random samples from a truncated exponential distribution
     """
+    # random number source
+    if rng is None:
+        rng = np.random
 
     # zero-centered Mcap
     lamba = np.log(10) * bval
@@ -137,19 +1103,9 @@ def exponential_trunc(nsam,
     # calculated Mmin
     Mmin = Mmax - Mcap
 
-    # sample sets with resamples out-of-range values
-    s0 = np.random.exponential(1.0 / (np.log(10) * bval), nsam) + Mmin
-    iters = 0
-    while 1:
-        iters += 1
-        r_pl = s0 > Mmax
-        if np.sum(r_pl) > 0:
-            r_dr = np.random.exponential(1.0 / (np.log(10) * bval), nsam) + Mmin
-            s0 = s0 * (1 - r_pl) + r_dr * (r_pl)
-        else:
-            break
-        if iters > 100:
-            break
+    # inverse-cdf samples within [Mmin, Mmax]
+    u = rng.random(nsam)
+    s0 = Mmin + stats.truncexpon.ppf(u, lamba * Mcap) / lamba
     return s0
 
 
@@ -160,65 +1116,42 @@ def contact_trunc(nsam,
                   exp_B=0.5,
                   exp_C=0.5 / np.pi,
                   bd_min=0.0001,
-                  bd_max=3.0 * 0.002):
+                  bd_max=3.0 * 0.002,
+                  rng=None):
     """
     get random samples from a 'contact' distribution
     """
+    # random number source
+    if rng is None:
+        rng = np.random
 
     # binomial samples
-    n1 = np.random.binomial(nsam, weight, (1))
+    n1 = int(rng.binomial(nsam, weight))
     n2 = nsam - n1
 
-    # exponential samples
-    s1 = np.random.exponential(exp_B, n1) * exp_C * bd_nom + bd_min
-    iters = 0
-    while 1:
-        iters += 1
-        r_pl = s1 > bd_max
-        if np.sum(r_pl) > 0:
-            r_dr = np.random.exponential(exp_B, n1) * exp_C * bd_nom + bd_min
-            s1 = s1 * (1 - r_pl) + r_dr * (r_pl)
-        else:
-            break
-        if iters > 100:
-            break
-
-    # normal samples
-    s2 = np.random.normal(bd_nom, stddev, n2)
-    iters = 0
-    while 1:
-        iters += 1
-        r_pl = (s2 > bd_max) + (s2 < bd_min)
-        if np.sum(r_pl) > 0:
-            r_dr = np.random.normal(bd_nom, stddev, n2)
-            s2 = s2 * (1 - r_pl) + r_dr * (r_pl)
-        else:
-            break
-        if iters > 100:
-            break
+    # exponential samples within [bd_min, bd_max]
+    scale = exp_B * exp_C * bd_nom
+    u = rng.random(n1)
+    if (scale > 0.0) and (bd_max > bd_min):
+        s1 = stats.truncexpon.ppf(u, (bd_max - bd_min) / scale) * scale + bd_min
+    else:
+        s1 = np.zeros(n1) + bd_min
+
+    # normal samples within [bd_min, bd_max]
+    s2 = norm_trunc(n2, bd_nom, stddev, bd_min, bd_max, rng=rng)
+
     s0 = np.concatenate((s1, s2), axis=0)
     return s0
 
 
 def lognorm_trunc(nsam, logmu=0.0, logdev=1.0,
-                  loglo=-2.0, loghi=2.0):
+                  loglo=-2.0, loghi=2.0, rng=None):
     """
     get random samples from a log normal distribution
     """
 
-    # normal samples
-    s0 = np.random.normal(logmu, logdev, nsam)
-    iters = 0
-    while 1:
-        iters += 1
-        r_pl = (s0 > loghi) + (s0 < loglo)
-        if np.sum(r_pl) > 0:
-            r_dr = np.random.normal(logmu, logdev, nsam)
-            s0 = s0 * (1 - r_pl) + r_dr * (r_pl)
-        else:
-            break
-        if iters > 100:
-            break
+    # truncated normal samples of the exponent
+    s0 = norm_trunc(nsam, logmu, logdev, loglo, loghi, rng=rng)
 
     return 10.0 ** s0
 
@@ -227,27 +1160,36 @@ def norm_trunc(nsam,
                mu=0.0,
                dev=1.0,
                lo=-2.0,
-               hi=2.0):
+               hi=2.0,
+               rng=None):
     """
-    get random samples from a log normal distribution
+    get random samples from a truncated normal distribution
     """
-
-    # normal samples
-    s0 = np.random.normal(mu, dev, nsam)
-    iters = 0
-    while 1:
-        iters += 1
-        r_pl = (s0 > hi) + (s0 < lo)
-        if np.sum(r_pl) > 0:
-            r_dr = np.random.normal(mu, dev, nsam)
-            s0 = s0 * (1 - r_pl) + r_dr * (r_pl)
-        else:
-            break
-        if iters > 100:
-            break
+    # random number source
+    if rng is None:
+        rng = np.random
+
+    # inverse-cdf samples within [lo, hi]
+    u = rng.random(nsam)
+    if (dev > 0.0) and (hi > lo):
+        s0 = stats.truncnorm.ppf(u, (lo - mu) / dev, (hi - mu) / dev, loc=mu, scale=dev)
+    else:
+        # degenerate distribution or window
+        s0 = np.zeros(nsam) + np.clip(mu, lo, max(lo, hi))
     return s0
 
 
+def uniform_samp(nsam=None, lo=0.0, hi=1.0, rng=None):
+    """
+    get random samples from a uniform distribution (lo > hi is allowed, as in np.random.uniform)
+    """
+    # random number source
+    if rng is None:
+        rng = np.random
+
+    return lo + (hi - lo) * rng.random(nsam)
+
+
 class Cauchy:
     """
     functions modified from JPM
@@ -380,6 +1322,7 @@ class Cauchy:
                 nrmx, nrmy, nrmz = nrmG[0], nrmG[1], nrmG[2]
                 criticalDelPpG[i, j], h1, h2 = self.Pc(np.asarray([nrmx, nrmy, nrmz]), phi, mcc)
         # Plot critical slip pressure (lower hemisphere projection)
+        import pylab
         fig = pylab.figure(figsize=(6, 4.75), dpi=png_dpi, tight_layout=True, facecolor='w', edgecolor='k')
         ax = fig.add_subplot(111, projection='polar')
         ax.set_theta_zero_location("N")
@@ -554,7 +1497,11 @@ class Surface:
 
     def __init__(self, x0=0.0, y0=0.0, z0=0.0, dia=1.0, stk=0.0 * deg, dip=90.0 * deg,
                  ty='fracture', rock=Reservoir(),
-                 mcc=-1, phi=-1):
+                 mcc=-1, phi=-1, rng=None):
+        # random number source
+        if rng is None:
+            rng = np.random
+
         # *** base parameters ***
 
         # node number of center point
@@ -586,10 +1533,10 @@ class Surface:
         self.arup = 1.0  # rupture area available for seismicity
         self.hydroprop = False
         self.prop_load = 0.0  # m3 #absolute proppant volume
-        self.prop_alpha = norm_trunc(1, rock.prop_alpha[1], rock.prop_alpha[1], rock.prop_alpha[0], rock.prop_alpha[2])[
-            0]  # proppant compressibility modulus
+        self.prop_alpha = norm_trunc(1, rock.prop_alpha[1], rock.prop_alpha[1], rock.prop_alpha[0], rock.prop_alpha[2],
+                                     rng=rng)[0]  # proppant compressibility modulus
         self.roughness = rock.f_roughness if type(rock.f_roughness) is float else \
-            np.random.uniform(rock.f_roughness[0], rock.f_roughness[2], (1))[0]  # open flow roughness
+            uniform_samp(1, rock.f_roughness[0], rock.f_roughness[2], rng)[0]  # open flow roughness
         self.kf = rock.kf  # proppant pack permeability
 
         # scaling
@@ -604,21 +1551,23 @@ class Surface:
 
         # *** stochastic sampled parameters *** #!!!
         self.u_gamma = \
-            lognorm_trunc(1, np.log10(rock.gamma[1]), 0.45, np.log10(rock.gamma[0]), np.log10(rock.gamma[2]))[0]
-        self.u_n1 = np.random.uniform(rock.n1[0], rock.n1[2], (1))[0]
-        self.u_a = norm_trunc(1, rock.a[1], 0.150, rock.a[0], rock.a[2])[0]
-        self.u_b = np.random.uniform(rock.b[0], rock.b[2], (1))[0]
+            lognorm_trunc(1, np.log10(rock.gamma[1]), 0.45, np.log10(rock.gamma[0]), np.log10(rock.gamma[2]),
+                          rng=rng)[0]
+        self.u_n1 = uniform_samp(1, rock.n1[0], rock.n1[2], rng)[0]
+        self.u_a = norm_trunc(1, rock.a[1], 0.150, rock.a[0], rock.a[2], rng=rng)[0]
+        self.u_b = uniform_samp(1, rock.b[0], rock.b[2], rng)[0]
         self.u_N = \
-            contact_trunc(1, 0.15, rock.N[1], 0.5 * rock.N[1], 0.5, 0.5 * rock.N[1] / np.pi, rock.N[0], rock.N[2])[0]
-        self.u_alpha = norm_trunc(1, rock.alpha[1], rock.alpha[1], rock.alpha[0], rock.alpha[2])[0]
-        self.bh = norm_trunc(1, rock.bh[1], rock.bh[1], rock.bh[0], rock.bh[2])[
+            contact_trunc(1, 0.15, rock.N[1], 0.5 * rock.N[1], 0.5, 0.5 * rock.N[1] / np.pi, rock.N[0], rock.N[2],
+                          rng=rng)[0]
+        self.u_alpha = norm_trunc(1, rock.alpha[1], rock.alpha[1], rock.alpha[0], rock.alpha[2], rng=rng)[0]
+        self.bh = norm_trunc(1, rock.bh[1], rock.bh[1], rock.bh[0], rock.bh[2], rng=rng)[
             0]  # !!! would be nice to replace this with a physics based estimate
         if phi < 0:
-            self.phi = np.random.uniform(rock.phi[0], rock.phi[2], (1))[0]
+            self.phi = uniform_samp(1, rock.phi[0], rock.phi[2], rng)[0]
         else:
             self.phi = phi
         if mcc < 0:
-            self.mcc = np.random.uniform(rock.mcc[0], rock.mcc[2], (1))[0]
+            self.mcc = uniform_samp(1, rock.mcc[0], rock.mcc[2], rng)[0]
         else:
             self.mcc = mcc
 
@@ -882,12 +1831,60 @@ class Pipes:
                 exit()
 
 
+class Recorder:
+    """
+    preallocated history of per-iteration values
+    - cols: dict of value name to row width (shorter rows are padded with nan)
+    - rows are written on every stride-th call to add
+    """
+
+    def __init__(self, rows, cols, stride=1):
+        self.stride = int(np.max([1, stride]))
+        self.calls = 0  # calls to add
+        self.num = 0  # rows written
+        self.data = {}
+        for key in cols.keys():
+            self.data[key] = np.full((int(np.ceil(rows / self.stride)) + 1, cols[key]), np.nan)
+
+    def add(self, **vals):
+        """
+        record a row of each named value, returning True if the row was kept
+        """
+        keep = (self.calls % self.stride) == 0
+        self.calls += 1
+        if not (keep):
+            return False
+        for key in vals.keys():
+            # grow if more rows are written than allocated (e.g., resumed runs)
+            if self.num >= self.data[key].shape[0]:
+                self.data[key] = np.concatenate((self.data[key], np.full_like(self.data[key], np.nan)), axis=0)
+            row = np.asarray(vals[key], dtype=float)
+            # widen if a row is longer than allocated
+            if len(row) > self.data[key].shape[1]:
+                pad = np.full((self.data[key].shape[0], len(row) - self.data[key].shape[1]), np.nan)
+                self.data[key] = np.concatenate((self.data[key], pad), axis=1)
+            self.data[key][self.num, :len(row)] = row
+        self.num += 1
+        return True
+
+    def get(self, key, cols=None):
+        """
+        recorded rows of a value (optionally only the first cols columns)
+        """
+        return self.data[key][:self.num, :cols]
+
+
 class Mesh:
     """
     model object, functions, and data as object
     """
 
-    def __init__(self):  # ,node=[],pipe=[],fracs=[],wells=[],hydfs=[],bound=[],geo3D=[]): #@@@ are these still used?
+    def __init__(self, seed=None):  # ,node=[],pipe=[],fracs=[],wells=[],hydfs=[],bound=[],geo3D=[]): #@@@ are these still used?
+        # random number generator (seed, e.g., with the realization pin)
+        self.ss = None
+        self.rng = None
+        self.reseed(seed)
+
         # domain information
         self.rock = Reservoir()
         self.nodes = Nodes()
@@ -923,7 +1920,17 @@ class Mesh:
         self.Tt = []  # heat flow from rock over time
         self.ht = []  # enthalpy over time
         self.ts = []  # time stamps
+        self.h_its = []  # heat solver iterations per time step
+        self.h_kerr = []  # heat solver final temperature residual per time step, K
+        self.h_eerr = []  # heat solver final relative energy change per time step
+        self.h_conv = []  # heat solver convergence flag per time step
+        self.h_ts = []  # heat solver step start times
+        self.h_state = {}  # heat solver state for restarts
+        self.s_state = {}  # stimulation state after the last dyn_stim iteration
+        self.h_plot = {}  # heat solver summary plot data
+        self.h_tf = []  # time stamps of the stored node and pipe histories
         self.w_h = []  # wellhead enthalpy
+        self.w_T = []  # wellhead temperature
         self.w_m = []  # wellhead mass flow
         self.p_E = []  # production energy
         self.b_h = []  # boundary enthalpy
@@ -948,9 +1955,27 @@ class Mesh:
         self.v_ws = []
         self.v_Vs = []
         self.v_Pn = []
+        self.v_frames = []  # deferred vtk files (see export_vtk)
+        self.v_series = {}  # vtk time series by file name (see build_vtk)
         # economics
         self.NPV = 0.0
 
+    def reseed(self, seed=None):
+        """
+        reset the random number generator from an integer seed (e.g., pin) or a SeedSequence
+        """
+        if isinstance(seed, np.random.SeedSequence):
+            self.ss = seed
+        else:
+            self.ss = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.ss)
+
+    def spawn(self, num):
+        """
+        independent child seeds for parallel workers (reproducible from the parent seed)
+        """
+        return self.ss.spawn(num)
+
     #    # Static per-fracture hydraulic resistance terms using method of Luke P. Frash; [lower,nominal,upper]
     #    # .... also calculates the stress states on the fractutres
     #    def static_KQn(self,
@@ -1020,7 +2045,7 @@ class Mesh:
             M0max = self.faces[f_id].tau * self.faces[f_id].arup ** (3.0 / 2.0)
             Mwmax = (np.log10(M0max) - 9.1) / 1.5
             # mw sample from G-R
-            mw = exponential_trunc(1, bval=self.rock.bval, Mmax=Mwmax, Mwin=1.0, prob=0.1)[0]
+            mw = exponential_trunc(1, bval=self.rock.bval, Mmax=Mwmax, Mwin=1.0, prob=0.1, rng=self.rng)[0]
             # convert to moment magnitude (Mo)
             mo = 10.0 ** (mw * 1.5 + 9.1)
             # rupture length
@@ -1427,8 +2452,7 @@ class Mesh:
         if pinj > 100.0:
             pinj = 100.0
         try:
-            state = therm(T=T5, P=pinj)
-            hinj = state.h
+            hinj = therm_TP(T5, pinj)[0]
         except:
             hinj = 0.0
         out += [['hinj', hinj]]
@@ -1525,9 +2549,9 @@ class Mesh:
                 # find index of duplicate
                 ck, i = self.nodes.add(source)
                 # record temperature
-                w_T += [self.Tt[:, i]]
+                w_T += [self.w_T[w]]
                 # record enthalpy
-                w_h += [self.ht[:, i]]
+                w_h += [self.w_h[w]]
                 # record mass flow rate
                 i_pipe = np.where(np.asarray(self.pipes.n0) == i)[0][0]
                 w_m += [self.q[i_pipe] / self.v5]
@@ -1615,10 +2639,29 @@ class Mesh:
     #
     #        return out
 
-    def build_vtk(self, fname='default', vtype=[1, 1, 1, 1, 1, 1]):
+    def build_vtk(self, fname='default', vtype=[1, 1, 1, 1, 1, 1], fmt='vtk', encoding='raw', compress=False,
+                  lines=False, series=None, t=None):
+        """
+        Write wells, fractures, flowing fractures, nodes, pipes and boundaries (toggled by vtype) as vtk files
+        - fmt is legacy ascii 'vtk' or binary xml 'vtu'/'vtp' with 'raw' or 'base64' encoding and optional zlib
+        - lines writes pipes as line cells and nodes as vertex cells instead of solid cylinders (use tube and
+          glyph filters in ParaView to thicken them)
+        - series: dict of sg.VtkSeries by file name, filled as needed, to add the files as a step at time t of
+          ParaView time series (fname_wells.pvd, etc.) instead of writing separate files (fmt is ignored)
+        """
         # ******   scaling       ******
         r = 0.002 * self.rock.size
 
+        # ******   output        ******
+        def write(suffix, points, cells, cols, labs):
+            # a file per call or a step in the time series of this layer
+            if series is None:
+                sg.writeArrays(points, cells, cols, labs, fname + suffix, fmt, encoding, compress)
+            else:
+                if (fname + suffix) not in series:
+                    series[fname + suffix] = sg.VtkSeries(fname + suffix, encoding, compress)
+                series[fname + suffix].add(points, cells, cols, labs, t)
+
         # ******   paint wells   ******
         if vtype[0]:
             w_obj = []  # fractures
@@ -1630,6 +2673,8 @@ class Mesh:
             w_2 = []
             w_3 = []
             w_4 = []
+            c0s = []
+            c1s = []
             # nodex = np.asarray(self.nodes)
             for i in range(0, len(self.wells)):  # skip boundary node at np.inf
                 # add colors
@@ -1645,10 +2690,12 @@ class Mesh:
                 vAxi = np.asarray([math.sin(azn) * math.cos(-dip), math.cos(azn) * math.cos(-dip), math.sin(-dip)])
                 c0 = self.wells[i].c0
                 c1 = c0 + vAxi * leg
-                w_obj += [sg.cylObj(x0=c0, x1=c1, r=1.5 * r)]
+                c0s += [c0]
+                c1s += [c1]
+            w_obj = sg.instanceObjs(*sg.cylObjs(c0s, c1s, r=1.5 * r))
             # vtk file
             w_col = [w_0, w_1, w_2, w_3, w_4]
-            sg.writeVtk(w_obj, w_col, w_lab, vtkFile=(fname + '_wells.vtk'))
+            write('_wells', *sg.objectArrays(w_obj, w_col), w_lab)
 
         # ******   paint fractures   ******
         if vtype[1] and len(self.faces) > 6:
@@ -1671,12 +2718,10 @@ class Mesh:
                 f_3 += [self.faces[i].sn / MPa]
                 f_4 += [self.faces[i].Pc / MPa]
                 f_5 += [self.faces[i].tau / MPa]
-                # add geometry
-                f_obj += [HF(r=0.5 * self.faces[i].dia, x0=self.faces[i].c0, strikeRad=self.faces[i].str,
-                             dipRad=self.faces[i].dip, h=0.01 * r)]
+            f_obj = HFs([self.faces[i] for i in f_0], h=0.01 * r)
             # vtk file
             f_col = [f_0, f_1, f_2, f_3, f_4, f_5]
-            sg.writeVtk(f_obj, f_col, f_lab, vtkFile=(f'{fname}_fracs.vtk'))
+            write('_fracs', *sg.objectArrays(f_obj, f_col), f_lab)
 
         # ******   paint flowing fractures   ******
         if vtype[2] and len(self.faces) > 6:
@@ -1717,12 +2762,10 @@ class Mesh:
                     q_11 += [np.max(self.faces[i].Mws)]
                     q_12 += [self.faces[i].bd0p * 1000]
                     q_13 += [self.faces[i].prop_load]
-                    # add geometry
-                    q_obj += [HF(r=0.5 * self.faces[i].dia, x0=self.faces[i].c0, strikeRad=self.faces[i].str,
-                                 dipRad=self.faces[i].dip, h=0.02 * r)]
+            q_obj = HFs([self.faces[i] for i in q_0], h=0.02 * r)
             # vtk file
             q_col = [q_0, q_1, q_2, q_3, q_4, q_5, q_6, q_7, q_8, q_9, q_10, q_11, q_12, q_13]
-            sg.writeVtk(q_obj, q_col, q_lab, vtkFile=(fname + '_fnets.vtk'))
+            write('_fnets', *sg.objectArrays(q_obj, q_col), q_lab)
 
         # ******   paint nodes   ******
         if vtype[3]:
@@ -1741,12 +2784,17 @@ class Mesh:
                 n_1 += [self.nodes.p[i] / MPa]
                 n_2 += [self.nodes.T[i]]
                 n_3 += [self.nodes.h[i]]
-                # add geometry
-                n_obj += [sg.cylObj(x0=self.nodes.all[i] + np.asarray([0.0, 0.0, -r]),
-                                    x1=self.nodes.all[i] + np.asarray([0.0, 0.0, r]), r=r)]
-            # vtk file
+            # add geometry
+            x0s = np.asarray(self.nodes.all[1:self.nodes.num], dtype=float).reshape(-1, 3)
             n_col = [n_0, n_1, n_2, n_3]
-            sg.writeVtk(n_obj, n_col, n_lab, vtkFile=(fname + '_nodes.vtk'))
+            if lines:
+                # vtk file
+                write('_nodes', x0s, np.arange(len(x0s)), n_col, n_lab)
+            else:
+                n_obj = sg.instanceObjs(*sg.cylObjs(x0s + np.asarray([0.0, 0.0, -r]),
+                                                    x0s + np.asarray([0.0, 0.0, r]), r=r))
+                # vtk file
+                write('_nodes', *sg.objectArrays(n_obj, n_col), n_lab)
 
         # ******   paint pipes   ******
         if vtype[4]:
@@ -1767,13 +2815,18 @@ class Mesh:
             if not qs.any():
                 qs = np.zeros(self.pipes.num)
             qs = np.abs(qs)
+            x0s = []
+            x1s = []
+            ends = []
             for i in range(0, self.pipes.num):
                 # add geometry
                 x0 = self.nodes.all[self.pipes.n0[i]]
                 x1 = self.nodes.all[self.pipes.n1[i]]
                 # don't include boundary node
                 if not (np.isinf(x0[0]) or np.isinf(x1[0])):
-                    p_obj += [sg.cylObj(x0=x0, x1=x1, r=0.666 * r)]
+                    x0s += [x0]
+                    x1s += [x1]
+                    ends += [[self.pipes.n0[i] - 1, self.pipes.n1[i] - 1]]
                     # add colors
                     p_0 += [i]
                     p_1 += [self.pipes.typ[i]]
@@ -1783,9 +2836,14 @@ class Mesh:
                     p_5 += [self.pipes.Dh[i] * 1000]
                     p_6 += [self.pipes.Dh_max[i] * 1000]
                     p_7 += [self.pipes.frict[i]]
-            # vtk file
             p_col = [p_0, p_1, p_2, p_3, p_4, p_5, p_6, p_7]
-            sg.writeVtk(p_obj, p_col, p_lab, vtkFile=(fname + '_flow.vtk'))
+            if lines:
+                # vtk file, line cells between the nodes (less the boundary node)
+                write('_flow', self.nodes.all[1:self.nodes.num], np.reshape(ends, (-1, 2)), p_col, p_lab)
+            else:
+                p_obj = sg.instanceObjs(*sg.cylObjs(x0s, x1s, r=0.666 * r))
+                # vtk file
+                write('_flow', *sg.objectArrays(p_obj, p_col), p_lab)
 
         # ******   paint boundaries   ******
         if vtype[5]:
@@ -1808,17 +2866,24 @@ class Mesh:
                 f_3 += [self.faces[i].sn / MPa]
                 f_4 += [self.faces[i].Pc / MPa]
                 f_5 += [self.faces[i].tau / MPa]
-                # add geometry
-                f_obj += [HF(r=0.5 * self.faces[i].dia, x0=self.faces[i].c0, strikeRad=self.faces[i].str,
-                             dipRad=self.faces[i].dip, h=0.01 * r)]
+            f_obj = HFs([self.faces[i] for i in f_0], h=0.01 * r)
             # vtk file
             f_col = [f_0, f_1, f_2, f_3, f_4, f_5]
-            sg.writeVtk(f_obj, f_col, f_lab, vtkFile=(fname + '_bounds.vtk'))
+            write('_bounds', *sg.objectArrays(f_obj, f_col), f_lab)
 
-    def build_pts(self, spacing=25.0, fname='test_gridx'):
+    def build_pts(self, spacing=25.0, fname='test_gridx', coarsen=1, binary=False):
+        """
+        Rock temperature on a structured grid around the fracture pipes (fname_therm.vtk)
+        - each fracture pipe only visits the grid block inside its bounding box, in slabs of bounded size
+        - coarsen: solve on a grid coarsen times wider and linearly upsample to spacing
+        - binary: write the values as big-endian float32 instead of ascii
+        """
         print('*** constructing temperature grid ***')
         # structured grid of datapoints
         fname = fname + '_therm.vtk'
+        if os.path.isfile(fname) and (os.path.getsize(fname) > 0):
+            print('file already exists')
+            return
         size = self.rock.size
         num = int(2.0 * size / spacing) + 1
         label = 'temp_K'
@@ -1826,12 +2891,21 @@ class Mesh:
         o0 = [-size, -size, -size]
         ss = [spacing, spacing, spacing]
 
+        # solution grid, covering the output grid when coarsened
+        coarsen = max(int(coarsen), 1)
+        step = spacing * coarsen
+        n_s = int(np.ceil((num - 1) / coarsen)) + 1
+        xs = o0[0] + np.arange(n_s) * step
+
         # initialize data to initial rock temperature
-        data = np.ones((num, num, num), dtype=float) * self.rock.BH_T
+        data = np.ones((n_s, n_s, n_s), dtype=float) * self.rock.BH_T
 
         # seek temperature drawdown
+        n_frac = 0
         for i in range(0, self.pipes.num):
-            print(f'pipe {i}')
+            # fractures and planes (pipes and wells are skipped)
+            if not (int(self.pipes.typ[i]) in [typ('fracture'), typ('propped'), typ('choke')]):
+                continue
             # collect fracture parameters
             x0 = self.nodes.all[self.pipes.n0[i]]
             x1 = self.nodes.all[self.pipes.n1[i]]
@@ -1840,43 +2914,50 @@ class Mesh:
             c0 = 0.5 * (x0 + x1)
             r0 = 0.5 * np.linalg.norm(x1 - x0)
             R0 = self.R0[i]
-            # pipes and wells
-            if (int(self.pipes.typ[i]) in [typ('injector'), typ('producer'),
-                                           typ('pipe')]):  # ((Y[i][2] == 0): #pipe, Hazen-Williams
-                pass
-            # fractures and planes
-            elif (int(self.pipes.typ[i]) in [typ('fracture'), typ('propped'),
-                                             typ('choke')]):  # (int())Y[i][2] == 1: #fracture, effective cubic law
-                # fracture info
-                dip = self.faces[self.pipes.fID[i]].dip
-                azn = self.faces[self.pipes.fID[i]].str
-                vNor = np.asarray(
-                    [math.sin(azn + 90.0 * deg) * math.sin(dip), math.cos(azn + 90.0 * deg) * math.sin(dip),
-                     math.cos(dip)])
-                vLeg = (x1 - c0) / np.linalg.norm(x1 - c0)
-                vWid = np.cross(vNor, vLeg)
-                # cycle thruogh all points
-                for x in range(0, len(data)):
-                    for y in range(0, len(data[0])):
-                        for z in range(0, len(data[0, 0])):
-                            # point coordinates
-                            xPt = np.asarray([o0[0] + x * spacing, o0[1] + y * spacing, o0[2] + z * spacing])
-                            # spherical radius vector
-                            pi = xPt - c0
-                            # normal distance from fracture
-                            ni = np.linalg.norm(np.dot(pi, vNor))
-                            # lengthwise distance from fracture
-                            li = np.linalg.norm(np.dot(pi, vLeg))
-                            # widthwise distance from fracture
-                            wi = np.linalg.norm(np.dot(pi, vWid))
-                            # if within length, width, normal
-                            if (ni <= R0) and (li <= r0) and (wi <= (0.5 * self.pipes.W[i])):
-                                # subtract delta T at point based on distance of point versus thermal radius
-                                data[x, y, z] = data[x, y, z] + (0.5 * (T1 + T0) - self.rock.BH_T) * (1.0 - ni / R0)
+            w0 = 0.5 * self.pipes.W[i]
+            # fracture info
+            dip = self.faces[self.pipes.fID[i]].dip
+            azn = self.faces[self.pipes.fID[i]].str
+            vNor = np.asarray(
+                [math.sin(azn + 90.0 * deg) * math.sin(dip), math.cos(azn + 90.0 * deg) * math.sin(dip),
+                 math.cos(dip)])
+            vLeg = (x1 - c0) / np.linalg.norm(x1 - c0)
+            vWid = np.cross(vNor, vLeg)
+            # bounding box of the painted block, padded by a grid point against round-off
+            half = R0 * np.abs(vNor) + r0 * np.abs(vLeg) + w0 * np.abs(vWid)
+            if not np.all(np.isfinite(half)) or not np.all(np.isfinite(c0)):
+                continue
+            lo = np.clip(np.floor((c0 - half - o0) / step).astype(int) - 1, 0, n_s)
+            hi = np.clip(np.ceil((c0 + half - o0) / step).astype(int) + 2, 0, n_s)
+            if np.any(hi <= lo):
+                continue
+            n_frac += 1
+            dT = 0.5 * (T1 + T0) - self.rock.BH_T
+            # slabs along x of about a million points
+            n_x = max(1, int(2 ** 20 / ((hi[1] - lo[1]) * (hi[2] - lo[2]))))
+            py = (xs[lo[1]:hi[1]] - c0[1])[None, :, None]
+            pz = (xs[lo[2]:hi[2]] - c0[2])[None, None, :]
+            for x in range(lo[0], hi[0], n_x):
+                px = (xs[x:min(x + n_x, hi[0])] - c0[0])[:, None, None]
+                # normal, lengthwise, and widthwise distance from fracture
+                ni = np.abs(px * vNor[0] + py * vNor[1] + pz * vNor[2])
+                li = np.abs(px * vLeg[0] + py * vLeg[1] + pz * vLeg[2])
+                wi = np.abs(px * vWid[0] + py * vWid[1] + pz * vWid[2])
+                # if within length, width, normal subtract delta T based on distance versus thermal radius
+                hit = (ni <= R0) & (li <= r0) & (wi <= w0)
+                block = data[x:min(x + n_x, hi[0]), lo[1]:hi[1], lo[2]:hi[2]]
+                block[hit] = block[hit] + dT * (1.0 - ni[hit] / R0)
+        print('-> %i fracture pipes painted on a %i^3 grid' % (n_frac, n_s))
+
+        # output grid points bracketed by the solution grid (linear upsampling along each axis)
+        f = np.arange(num) / coarsen
+        k0 = np.clip(np.floor(f).astype(int), 0, np.max([n_s - 2, 0]))
+        k1 = np.minimum(k0 + 1, n_s - 1)
+        w = f - k0
 
         head = '# vtk DataFile Version 2.0\n'
         head += 'pointcloud\n'
-        head += 'ASCII\n'
+        head += 'BINARY\n' if binary else 'ASCII\n'
         head += 'DATASET STRUCTURED_POINTS\n'
         head += 'DIMENSIONS %i %i %i\n' % (ns[0], ns[1], ns[2])
         head += 'ORIGIN %f %f %f\n' % (o0[0], o0[1], o0[2])
@@ -1887,33 +2968,22 @@ class Mesh:
 
         print(head)
 
-        try:
-            with open(fname, 'r') as f:
-                test = f.readline()
-            f.close()
-            if test != '':
-                print('file already exists')
-                f.close()
-            else:
-                with open(fname, 'a') as f:
-                    f.write(head + '\n')
-                    out = ''
-                    for k in range(0, len(data[0, 0, :])):
-                        for j in range(0, len(data[0, :, 0])):
-                            for i in range(0, len(data[:, 0, 0])):
-                                out += '%e' % (data[i, j, k]) + '\n'
-                    f.write(out)
-                f.close()
-        except:
-            with open(fname, 'a') as f:
-                f.write(head + '\n')
-                out = ''
-                for k in range(0, len(data[0, 0, :])):
-                    for j in range(0, len(data[0, :, 0])):
-                        for i in range(0, len(data[:, 0, 0])):
-                            out += '%e' % (data[i, j, k]) + '\n'
-                f.write(out)
-            f.close()
+        # x varies fastest, written one z slab at a time
+        with open(fname, 'ab') as f:
+            f.write((head + '\n').encode())
+            for k in range(0, num):
+                if coarsen > 1:
+                    # upsample from the two bracketing solution slabs
+                    sz = data[:, :, k0[k]] * (1.0 - w[k]) + data[:, :, k1[k]] * w[k]
+                    sz = sz[k0, :] * (1.0 - w)[:, None] + sz[k1, :] * w[:, None]
+                    sz = sz[:, k0] * (1.0 - w)[None, :] + sz[:, k1] * w[None, :]
+                else:
+                    sz = data[:, :, k]
+                slab = np.ravel(sz, order='F')
+                if binary:
+                    f.write(slab.astype('>f4').tobytes())
+                else:
+                    f.write((('%e\n' * len(slab)) % tuple(slab.tolist())).encode())
 
     def re_init(self):
         # clear prior data
@@ -2390,12 +3460,12 @@ class Mesh:
         size = self.rock.size
         # create boundary faces for analysis
         domb3D = []
-        domb3D += [Surface(-size, 0.0, 0.0, 4.0 * size, 00.0 * deg, 90.0 * deg, 'boundary', self.rock)]
-        domb3D += [Surface(size, 0.0, 0.0, 4.0 * size, 00.0 * deg, 90.0 * deg, 'boundary', self.rock)]
-        domb3D += [Surface(0.0, -size, 0.0, 4.0 * size, 90.0 * deg, 90.0 * deg, 'boundary', self.rock)]
-        domb3D += [Surface(0.0, size, 0.0, 4.0 * size, 90.0 * deg, 90.0 * deg, 'boundary', self.rock)]
-        domb3D += [Surface(0.0, 0.0, -size, 4.0 * size, 00.0 * deg, 00.0 * deg, 'boundary', self.rock)]
-        domb3D += [Surface(0.0, 0.0, size, 4.0 * size, 00.0 * deg, 00.0 * deg, 'boundary', self.rock)]
+        domb3D += [Surface(-size, 0.0, 0.0, 4.0 * size, 00.0 * deg, 90.0 * deg, 'boundary', self.rock, rng=self.rng)]
+        domb3D += [Surface(size, 0.0, 0.0, 4.0 * size, 00.0 * deg, 90.0 * deg, 'boundary', self.rock, rng=self.rng)]
+        domb3D += [Surface(0.0, -size, 0.0, 4.0 * size, 90.0 * deg, 90.0 * deg, 'boundary', self.rock, rng=self.rng)]
+        domb3D += [Surface(0.0, size, 0.0, 4.0 * size, 90.0 * deg, 90.0 * deg, 'boundary', self.rock, rng=self.rng)]
+        domb3D += [Surface(0.0, 0.0, -size, 4.0 * size, 00.0 * deg, 00.0 * deg, 'boundary', self.rock, rng=self.rng)]
+        domb3D += [Surface(0.0, 0.0, size, 4.0 * size, 00.0 * deg, 00.0 * deg, 'boundary', self.rock, rng=self.rng)]
         # add to model domain
         self.bound = domb3D
 
@@ -2417,7 +3487,7 @@ class Mesh:
         c0 = np.asarray(c0)
 
         # compile list of fractures
-        frac3D = [Surface(c0[0], c0[1], c0[2], dia, azn, dip, 'fracture', self.rock)]
+        frac3D = [Surface(c0[0], c0[1], c0[2], dia, azn, dip, 'fracture', self.rock, rng=self.rng)]
 
         # print( 'dia = %.1f, azn = %.1f, dip = %.1f' %(dia, azn, dip))
 
@@ -2445,16 +3515,16 @@ class Mesh:
             # Fracture parameters
             # dia = np.random.uniform(f_dia[0],f_dia[1])
             logmu = 0.5 * (np.log10(f_dia[0]) + np.log10(f_dia[1]))
-            dia = lognorm_trunc(1, logmu, logmu, np.log10(f_dia[0]), np.log10(f_dia[1]))[0]  # !!!
-            azn = np.random.uniform(f_azn[0], f_azn[1])
-            dip = np.random.uniform(f_dip[0], f_dip[1])
+            dia = lognorm_trunc(1, logmu, logmu, np.log10(f_dia[0]), np.log10(f_dia[1]), rng=self.rng)[0]  # !!!
+            azn = uniform_samp(None, f_azn[0], f_azn[1], self.rng)
+            dip = uniform_samp(None, f_dip[0], f_dip[1], self.rng)
             # Build geometry
-            x = np.random.uniform(-size, size)
-            y = np.random.uniform(-size, size)
-            z = np.random.uniform(-size, size)
+            x = uniform_samp(None, -size, size, self.rng)
+            y = uniform_samp(None, -size, size, self.rng)
+            z = uniform_samp(None, -size, size, self.rng)
             c0 = np.asarray([x, y, z])
             # compile list of fractures
-            frac3D += [Surface(c0[0], c0[1], c0[2], dia, azn, dip, 'fracture', self.rock)]
+            frac3D += [Surface(c0[0], c0[1], c0[2], dia, azn, dip, 'fracture', self.rock, rng=self.rng)]
 
         # add to model domain
         self.fracs += frac3D
@@ -2499,14 +3569,14 @@ class Mesh:
         vAxi = np.asarray([math.sin(azn) * math.cos(-dip), math.cos(azn) * math.cos(-dip), math.sin(-dip)])
         for n in range(0, num):
             # Fracture parameters
-            leg = np.random.normal(f_dia[0], f_dia[1])
-            azn = np.random.normal(f_azn[0], f_azn[1])
-            dip = np.random.normal(f_dip[0], f_dip[1])
+            leg = self.rng.normal(f_dia[0], f_dia[1])
+            azn = self.rng.normal(f_azn[0], f_azn[1])
+            dip = self.rng.normal(f_dip[0], f_dip[1])
             c0 = c0 + spa * vAxi
 
             # add to model domain
             self.hydfs += [Surface(c0[0], c0[1], c0[2], leg, azn, dip, 'propped', self.rock, mcc=self.rock.hfmcc,
-                                   phi=self.rock.hfphi)]
+                                   phi=self.rock.hfphi, rng=self.rng)]
             self.hydfs[-1].bd0 = 0.0
 
     # ************************************************************************
@@ -2590,10 +3660,10 @@ class Mesh:
                  dip=[57.5 * deg, 3.75 * deg]):
         """stimulation - add frac"""
         print('   + placing new frac')
-        fleg = np.random.normal(dia[0], dia[1])
-        fazn = np.random.normal(azn[0], azn[1])
-        fdip = np.random.normal(dip[0], dip[1])
-        self.hydfs += [Surface(c0[0], c0[1], c0[2], fleg, fazn, fdip, typ, self.rock)]
+        fleg = self.rng.normal(dia[0], dia[1])
+        fazn = self.rng.normal(azn[0], azn[1])
+        fdip = self.rng.normal(dip[0], dip[1])
+        self.hydfs += [Surface(c0[0], c0[1], c0[2], fleg, fazn, fdip, typ, self.rock, rng=self.rng)]
 
     # ************************************************************************
     #
@@ -2664,186 +3734,30 @@ class Mesh:
 
     def get_power(self, detail=False):
         """energy generation - single flash steam rankine cycle"""
-
-        # initialization
-        self.Fout = []
-        self.Bout = []
-        self.Qout = []
-        self.Pout = []
-        Flash_Power = []
-        Binary_Power = []
-        Pump_Power = []
-        Net_Power = []
         # truncate pressures when superciritical
         i_p = np.max([list(self.i_p) + list(self.p_p)]) / MPa
         if i_p > 100.0:
             i_p = 100.0
-        # for each moment in time
-        for t in range(0, len(self.p_hm) - 1):
-            # Surface Injection Well (5)
-            T5 = self.rock.Tinj + 273.15  # K
-            P5 = i_p  # MPa
-            state = therm(T=T5, P=P5)
-            h5 = state.h  # kJ/kg
-            s5 = state.s  # kJ/kg-K
-            x5 = state.x  # steam quality
-            v5 = state.v  # m3/kg
-
-            # Undisturbed Reservoir (r)
+
+        # Undisturbed Reservoir (r)
+        if detail:
             Tr = self.rock.BH_T  # K
             Pr = self.rock.BH_P / MPa  # MPa
-            state = therm(T=Tr, P=Pr)
-            hr = state.h  # kJ/kg
-            sr = state.s  # kJ/kg-K
-            xr = state.x  # steam quality
-            vr = state.v  # m3/kg
-
-            # Surface Production Well (2)
-            P2 = self.rock.p_whp / MPa  # MPa
-            h2 = self.p_hm[t]  # kJ/kg
-            state = therm(P=P2, h=h2)
-            T2 = state.T  # K
-            s2 = state.s  # kJ/kg-K
-            x2 = state.x  # steam quality
-            v2 = state.v  # m3/kg
-
-            # Brine Flow Stream (2l)
-            state = therm(P=P2, x=0)
-            P2l = state.P  # MPa
-            h2l = state.h  # kJ/kg
-            T2l = state.T  # K
-            s2l = state.s  # kJ/kg-K
-            x2l = state.x  # steam quality
-            v2l = state.v  # m3/kg
-
-            # turbine with error handling
-            P3s = self.rock.AmbPres / MPa
-            if x2 > 0.0:
-                # Turbine Flow Stream (2s)
-                state = therm(P=P2, x=1)
-                P2s = state.P  # MPa
-                h2s = state.h  # kJ/kg
-                T2s = state.T  # K
-                s2s = state.s  # kJ/kg-K
-                x2s = state.x  # steam quality
-                v2s = state.v  # m3/kg
-
-                # Turbine Outflow (3s)
-                s3s = s2s
-                try:
-                    state = therm(P=P3s, s=s3s)
-                except NotImplementedError as nie:
-                    if P3s < iapws.iapws97.Pmin:
-                        # TODO verify that skipping when P3s < iapws97.Pmin is OK/correct
-                        print(
-                            f'[WARN] Failed to recalculate state for Turbine Outflow (3s) because pressure ({P3s}) '
-                            + f'is below IAPWS minimum pressure ({iapws.iapws97.Pmin}). '
-                            + 'Skipping recalculation and using existing state.'
-                        )
-                    else:
-                        # Re-raise since we don't know the cause
-                        raise nie
-
-                P3s = state.P  # MPa
-                h3s = state.h  # kJ/kg
-                T3s = state.T  # K
-                s3s = state.s  # kJ/kg-K
-                x3s = state.x  # steam quality
-                v3s = state.v  # m3/kg
-            else:
-                P2s = state.P  # MPa
-                h2s = state.h  # kJ/kg
-                T2s = state.T  # K
-                s2s = state.s  # kJ/kg-K
-                x2s = state.x  # steam quality
-                v2s = state.v  # m3/kg
-
-                # Turbine Outflow (3s)
-                P3s = state.P  # MPa
-                h3s = state.h  # kJ/kg
-                T3s = state.T  # K
-                s3s = state.s  # kJ/kg-K
-                x3s = state.x  # steam quality
-                v3s = state.v  # m3/kg
-
-            # Condenser Outflow (4s)
-            P4s = P3s
-            T4s = T5
-            state = therm(T=T4s, P=P4s)
-            P4s = state.P  # MPa
-            h4s = state.h  # kJ/kg
-            T4s = state.T  # K
-            s4s = state.s  # kJ/kg-K
-            x4s = state.x  # steam quality
-            v4s = state.v  # m3/kg
-
-            # Turbine Work
-            w3s = h2s - h3s  # kJ/kg
-
-            # Pump Work
-            w5s = v5 * (P5 - P4s) * 10 ** 3  # kJ/kg
-            w5l = v5 * (P5 - P2l) * 10 ** 3  # kJ/kg
-
-            # efficiency shorthand
-            effic = self.rock.GenEfficiency
-
-            # Mass flow rates
-            mt = -self.p_mm
-            ms = mt * x2
-            ml = mt * (1.0 - x2)
-            mi = self.i_mm
-            Vt = (v5 * mt) * (1000 * 60)  # L/min
-
-            # Pumping power
-            Pump = 0.0
-            if mi > mt:
-                Pump = -1.0 * (ms * w5s + ml * w5l) / effic + -1.0 * (mi - mt) * w5s / effic  # kW
-            elif mi < ml:
-                Pump = -1.0 * (mi * w5l) / effic  # kW
-            else:
-                Pump = -1.0 * ((mi - ml) * w5s + ml * w5l) / effic  # kW
-
-            # Flash cycle power
-            Flash = 0.0  # kW
-            Flash = ms * np.max([0.0, w3s]) * effic  # kW
-
-            # Binary cycle power
-            Binary = 0.0
-
-            # Outlet thermal state
-            TBo = np.max([T5, 51.85 + 273.15])
-            PBo = np.min([P3s, P2])
-            state = therm(T=TBo, P=PBo)
-            PBo = state.P  # MPa
-            hBo = state.h  # kJ/kg
-            TBo = state.T  # K
-
-            # Binary Cycle Inlet from Turbine
-            TBis = T3s
-            PBis = P3s
-            hBis = h3s
-
-            # Binary Cycle Inlet from Brine
-            TBil = np.min([T2l, T2])
-            PBil = P2l
-            hBil = np.min([h2l, h2])
-
-            # Binary thermal-electric efficiency
-            # (estimated from Heberle and Bruggermann, 2010 - Fig. 4 - doi:10.1016/j.applthermaleng.2010.02.012)
-            nBs = np.max([0.0, 0.0899 * TBis - 25.95]) / 100.0
-            nBl = np.max([0.0, 0.0899 * TBil - 25.95]) / 100.0
-            Binary = (ms * nBs * np.max([0.0, hBis - hBo]) + ml * nBl * np.max(
-                [0.0, hBil - hBo])) * effic  # kW, power produced from binary cycle
-
-            # Net power
-            Net = 0.0
-            Net = Flash + Binary + Pump
-
-            # Record results
-            Flash_Power += [Flash]
-            Binary_Power += [Binary]
-            Pump_Power += [Pump]
-            Net_Power += [Net]
+            state = prop(T=Tr, P=Pr)
+            print(("\nReserv (r,1): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f"
+                   % (Tr, Pr, state.h, state.s, state.x, state.v)))
+
+        # cycle for each moment in time
+        Flash_Power, Binary_Power, Pump_Power, Net_Power = flash_binary_power(
+            np.asarray(self.p_hm[:-1], dtype=float),  # kJ/kg
+            -self.p_mm,  # kg/s
+            self.i_mm,  # kg/s
+            self.rock.Tinj + 273.15,  # K
+            i_p,  # MPa
+            self.rock.p_whp / MPa,  # MPa
+            self.rock.AmbPres / MPa,  # MPa
+            self.rock.GenEfficiency,
+            detail=detail)
 
         # record results
         self.Fout = np.asarray(Flash_Power)
@@ -2851,99 +3765,6 @@ class Mesh:
         self.Qout = np.asarray(Pump_Power)
         self.Pout = np.asarray(Net_Power)
 
-        # print(details)
-        if detail:
-            print('\n*** Rankine Cycle Thermal State Values ***')
-            print(("Inject (5): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (T5, P5, h5, s5, x5, v5)))
-            print(("Reserv (r,1): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (Tr, Pr, hr, sr, xr, vr)))
-            print(("Produc (2): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (T2, P2, h2, s2, x2, v2)))
-            print(("Turbi (2s): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (T2s, P2s, h2s, s2s, x2s, v2s)))
-            print(("Brine (2l): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (T2l, P2l, h2l, s2l, x2l, v2l)))
-            print(("Exhau (3s): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (T3s, P3s, h3s, s3s, x3s, v3s)))
-            print(("Conde (4s): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (T4s, P4s, h4s, s4s, x4s, v4s)))
-            print('*** Binary Cycle Thermal State Values ***')
-            print(("Steam: Ti= %.2f; Pi= %.2f; hi= %.2f -> To= %.2f, Po= %.2f, ho= %.2f, n =%.3f" % (
-                TBis, PBis, hBis, TBo, PBo, hBo, nBs)))
-            print(("Brine: Ti= %.2f; Pi= %.2f; hi= %.2f -> To= %.2f, Po= %.2f, ho= %.2f, n =%.3f" % (
-                TBil, PBil, hBil, TBo, PBo, hBo, nBl)))
-            print('*** Power Output Estimation ***')
-            print("Turbine Flow Rate = %.2f kg/s" % (ms))
-            print("Bypass Flow Rate = %.2f kg/s" % (ml))
-            print("Well Flow Rate = %.2f kg/s = %.2f L/min" % (mt, Vt))
-            print("Flash Power at %.2f kW" % (Flash))
-            print("Binary Power at %.2f kW" % (Binary))
-            print("Pumping Power at %.2f kW" % (Pump))
-            print("Net Power at %.2f kW" % (Net))
-
-        #     # Energy production
-        #     Pout = 0.0 #kW
-        #     # If sufficient steam quality
-        #     # if x2 > 0:
-        #     #     mt = -self.p_mm
-        #     #     ms = mt*x2
-        #     #     ml = mt*(1.0-x2)
-        #     #     Vt = (v5*mt)*(1000*60) # L/min
-        #     #     Pout = ms*wNs*self.rock.GenEfficiency #kW
-        #     mt = -self.p_mm
-        #     ms = mt*x2
-        #     ml = mt*(1.0-x2)
-        #     mi = self.i_mm
-        #     Vt = (v5*mt)*(1000*60) # L/min
-        #     Pout = ms*np.max([0.0, w3s])*self.rock.GenEfficiency #kW, power from flash turbine
-        #     Pout += -1.0*(ms*w5s + ml*w5l)/self.rock.GenEfficiency #kW, power consumed by recirculation pumps
-        #     Pout += -1.0*(mi-mt)*w5s/self.rock.GenEfficiency #kW, power consumed by makeup water pumps
-        #     self.Pout += [Pout]
-
-        #     # Binary Cycle Outlet
-        #     TBo = np.max([T5,51.85+273.15])
-        #     PBo = np.min([P3s,P2])
-        #     state = therm(T=TBo,P=PBo)
-        #     PBo = state.P # MPa
-        #     hBo = state.h #kJ/kg
-        #     TBo = state.T # K
-        #     # Binary Cycle Inlet from Turbine
-        #     TBis = T3s
-        #     PBis = P3s
-        #     hBis = h3s
-        #     # Binary Cycle Inlet from Brine
-        #     TBil = T2l
-        #     PBil = P2l
-        #     hBil = h2l
-        #     # Binary thermal-electric efficiency
-        #     nBs = np.max([0.0, 0.0899*TBis - 25.95])/100.0
-        #     nBl = np.max([0.0, 0.0899*TBil - 25.95])/100.0
-        #     Bout = 0.0 #kW
-        #     Bout = ms*np.max([0.0, w3s])*self.rock.GenEfficiency #kW, power from flash turbine
-        #     Bout += (ms*nBs*np.max([0.0, hBis-hBo]) + ml*nBl*np.max([0.0, hBil-hBo]))*self.rock.GenEfficiency #kW, power produced from binary cycle
-        #     Bout += -1.0*(ms*w5s + ml*w5l)/self.rock.GenEfficiency #kW, power consumed by recirculation pumps
-        #     Bout += -1.0*(mi-mt)*w5s/self.rock.GenEfficiency #kW, power consumed by makeup water pumps
-        #     self.Bout += [Bout]
-
-        # #print( details)
-        # if detail:
-        #     print( '\n*** Rankine Cycle Thermal State Values ***')
-        #     print( ("Inject (5): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" %(T5,P5,h5,s5,x5,v5)))
-        #     print( ("Reserv (r,1): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" %(Tr,Pr,hr,sr,xr,vr)))
-        #     print( ("Produc (2): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" %(T2,P2,h2,s2,x2,v2)))
-        #     print( ("Turbi (2s): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" %(T2s,P2s,h2s,s2s,x2s,v2s)))
-        #     print( ("Brine (2l): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" %(T2l,P2l,h2l,s2l,x2l,v2l)))
-        #     print( ("Exhau (3s): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" %(T3s,P3s,h3s,s3s,x3s,v3s)))
-        #     print( ("Conde (4s): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" %(T4s,P4s,h4s,s4s,x4s,v4s)))
-        #     print( '*** Binary Cycle Thermal State Values ***')
-        #     print( ("Steam: Ti= %.2f; Pi= %.2f; hi= %.2f -> To= %.2f, Po= %.2f, ho= %.2f, n =%.3f" %(TBis,PBis,hBis,TBo,PBo,hBo,nBs)))
-        #     print( ("Brine: Ti= %.2f; Pi= %.2f; hi= %.2f -> To= %.2f, Po= %.2f, ho= %.2f, n =%.3f" %(TBil,PBil,hBil,TBo,PBo,hBo,nBl)))
-        #     print( '*** Power Output Estimation ***')
-        #     print( ("Turbine Specific Work = %.2f kJ/kg" %(w3s)))
-        #     print( ("Turbine Pump Work = %.2f kJ/kg \nBrine Pump Work = %.2f kJ/kg" %(w5s,w5l)))
-        #     # print( ("Net Specifc Work Turbine = %.2f kJ/kg" %(wNs)))
-        #     print( "Turbine Flow Rate = %.2f kg/s" %(ms))
-        #     print( "Bypass Flow Rate = %.2f kg/s" %(ml))
-        #     print( "Well Flow Rate = %.2f kg/s" %(mt))
-        #     print( "Well Flow Rate = %.2f L/min" %(Vt))
-        #     print( "Flash Power at %.2f yr = %.2f kW" %(self.ts[-1]/yr,Pout))
-        #     print( "Binary Power at %.2f yr = %.2f kW" %(self.ts[-1]/yr,Bout))
-
-
     def get_flow(self, p_bound=0.0 * MPa, q_well=[], p_well=[], reinit=True, useprior=False, Qnom=1.0):
         """flow network model"""
         # reinitialize if the mesh has changed
@@ -2971,7 +3792,7 @@ class Mesh:
             h = self.nodes.p / (rho * g)
         else:
             # h = 1.0*np.random.rand(N) + p_bound/(rho*g) #!!! older than 2/11/23
-            h = (1.0 * MPa / (rho * g)) * np.random.rand(N) + p_bound / (rho * g)
+            h = (1.0 * MPa / (rho * g)) * self.rng.random(N) + p_bound / (rho * g)
         q = np.zeros(N)
 
         # install boundary condition
@@ -3151,18 +3972,166 @@ class Mesh:
         self.b_p = b_p
         self.b_q = b_q
 
-    def get_heat(self, plot=True,
-                 t_n=-1,  # steps
-                 t_f=-1.0 * yr,  # s
-                 H=-1.0,  # kW/m2-K
-                 dT0=-666.6,  # K
-                 dE0=-666.6,  # kJ/m2
-                 detail=False,
-                 lapse=False):
+    def flow_order(self, ms, fixed=[]):
+        """
+        group nodes into levels in upwind order of the pipe mass flows (ms)
+        - returns [nodes, pipes flowing into the nodes] for each level
+        - nodes in the same strongly connected component (recirculation loop) share a level
+        - fixed nodes (e.g., boundary conditions) are left out and do not form loops
+        """
+        # flowing pipes by direction
+        N = self.nodes.num
+        n0 = np.asarray(self.pipes.n0, dtype=int)
+        n1 = np.asarray(self.pipes.n1, dtype=int)
+        up = np.where(ms > 0, n0, n1)
+        dn = np.where(ms > 0, n1, n0)
+        live = np.where((np.abs(ms) > 0) & np.invert(np.isin(dn, fixed)))[0]
+
+        # strongly connected components
+        A = coo_matrix((np.ones(len(live)), (up[live], dn[live])), shape=(N, N)).tocsr()
+        num, lab = connected_components(A, directed=True, connection='strong')
+        cu = lab[up[live]]
+        cd = lab[dn[live]]
+
+        # longest path level of each component in the condensed graph
+        cross = cu != cd
+        kids = [[] for c in range(0, num)]
+        for c, d in zip(cu[cross], cd[cross]):
+            kids[c] += [d]
+        indeg = np.bincount(cd[cross], minlength=num)
+        lvl = np.zeros(num, dtype=int)
+        front = list(np.where(indeg == 0)[0])
+        while front:
+            nxt = []
+            for c in front:
+                for d in kids[c]:
+                    lvl[d] = max(lvl[d], lvl[c] + 1)
+                    indeg[d] -= 1
+                    if indeg[d] == 0:
+                        nxt += [d]
+            front = nxt
+
+        # nodes and inflow pipes per level
+        free = np.invert(np.isin(np.arange(N), fixed))
+        lvn = lvl[lab]
+        lvp = lvn[dn[live]]
+        groups = []
+        for L in range(0, np.max(lvl) + 1):
+            nodes = np.where(free & (lvn == L))[0]
+            if len(nodes) > 0:
+                groups += [[nodes, live[lvp == L]]]
+        return groups
+
+    def heat_resume(self, restart, t_f, t_n, tstep='uniform', thermal='radius'):
+        """
+        thermal state to restart the heat solver from (self.h_state, a checkpoint file, or None)
+        - returns the state (None to solve from zero) with the end time and step count to continue to
+        - uniform steps keep the checkpoint step size so t_n follows from t_f
+        """
+        hck = restart
+        if isinstance(restart, str):
+            with open(restart, 'rb') as f:
+                hck = pickle.load(f)
+        if hck is None:
+            return None, t_f, t_n
+        if tstep != hck['tstep']:
+            print('note: restart continues with %s time steps from the checkpoint' % (hck['tstep']))
+        if thermal != hck['thermal']:
+            print('note: restart continues with the %s thermal model from the checkpoint' % (hck['thermal']))
+        if hck['tstep'] == 'uniform':
+            t_n = int(np.round(t_f / hck['dt']))
+            if np.abs(t_n * hck['dt'] - t_f) > 1.0e-6 * t_f:
+                print('warning: restart end time rounded to %.3f yr for the checkpoint time step'
+                      % (t_n * hck['dt'] / yr))
+            t_f = t_n * hck['dt']
+        if t_f < hck['t'] * (1.0 - 1.0e-9):
+            print('error: restart end time %.3f yr is before the checkpoint at %.3f yr so solving from zero'
+                  % (t_f / yr, hck['t'] / yr))
+            return None, t_f, t_n
+        return hck, t_f, t_n
+
+    def save_heat_state(self, fname):
+        """
+        pickle the thermal state of the last heat solve (self.h_state) for later restarts
+        """
+        with open(fname + '.tmp', 'wb') as f:
+            pickle.dump(self.h_state, f)
+        os.replace(fname + '.tmp', fname)
+
+    def lapse_vtk(self, lapse, step, t, series):
+        """
+        timelapse vtk output of a heat solver step (at time t)
+        - lapse: True to write vtk files (t00_nodes.vtk, etc.), or 'series' to add the step to binary ParaView time
+          series (lapse_nodes.pvd, etc.) kept in series
+        """
+        if lapse == 'series':
+            self.build_vtk(fname='lapse', compress=True, series=series, t=t)
+        elif lapse:
+            self.build_vtk(fname='t%02d' % (step))
+
+    def get_heat(self, plot=True, **kwargs):
+        """
+        heat transfer model, solved to t_f (or until the stop condition of iter_heat)
+        - plot: True to draw the summary figure now, False or 'defer' to keep only its data (self.h_plot) for
+          plot_heat or plot_heat_batch
+        - keyword parameters as for iter_heat
+        """
+        for rec in self.iter_heat(plot=plot, **kwargs):
+            pass
+
+    def iter_heat(self, plot=False,
+                  t_n=-1,  # steps
+                  t_f=-1.0 * yr,  # s
+                  H=-1.0,  # kW/m2-K
+                  dT0=-666.6,  # K
+                  dE0=-666.6,  # kJ/m2
+                  detail=False,
+                  lapse=False,
+                  solver='iterate',
+                  accel=None,
+                  accel_depth=5,
+                  tstep='uniform',
+                  h_tol=20.0,  # kJ/kg
+                  dt_min=-1.0,  # s
+                  dt_grow=1.25,
+                  dt_max=-1.0,  # s
+                  restart=None,
+                  checkpoint='',
+                  history='full',
+                  h_stride=5,
+                  stream='',
+                  thermal='radius',
+                  convolve='direct',
+                  stop=None):
         """
-        heat transfer model
+        heat transfer model, yielding a record per solver step (see get_heat to run to completion)
         - mod 1-28-2021: correct errors
         - mod 9-13-2022: reduce overshoot in initial timesteps
+        - solver: 'iterate' for fixed-point sweeps over all nodes, 'march' for upwind marching in flow order
+        - accel: None or 'anderson' to accelerate the 'iterate' sweeps using accel_depth prior sweeps
+        - tstep: 'uniform' steps of t_f/t_n, 'geometric' steps growing by dt_grow from dt_min (default t_f/t_n/100),
+          or 'adaptive' steps that are repeated with a smaller dt when the produced enthalpy departs from its linear
+          extrapolation through the prior two steps by more than h_tol (see HeatSteps)
+        - dt_max: largest geometric or adaptive step (default and at most t_f/t_n)
+        - geometric and adaptive well series are averaged over each interval of the uniform reporting grid of t_n
+          steps (as a uniform step represents its interval), node and pipe histories are interpolated onto it
+        - restart: thermal state (self.h_state or a checkpoint file) to continue from its time to t_f; uniform steps
+          keep the checkpoint step size so t_n follows from t_f
+        - checkpoint: file name to pickle the final thermal state (self.h_state) for later restarts
+        - history: node and pipe histories (ht, Tt, Rt, Et, Qt) to keep, 'full', 'float32', 'decimated' (every h_stride
+          reporting steps, times in self.h_tf), or 'wells' (none); well and boundary node series are always kept
+        - stream: file name to append a pickled record of every solver step (read back with load_heat_stream)
+        - thermal: 'radius' to step the rock energy and thermal radius of each pipe, or 'response' to superpose
+          unit-step conduction kernels (response_kernels) over the history of rock-fluid temperature differences
+          (uniform time steps only)
+        - convolve: 'direct' sums of the response history each step, or 'fft' to add completed blocks of the
+          history to all later steps by FFT convolution (same result, fewer operations for long series)
+        - yields dicts of step, t (s), dt (s), well enthalpy h (kJ/kg), temperature T (K), mass flow m (kg/s, negative
+          for producers), mixed produced enthalpy p_h (kJ/kg) and conv
+        - stop: function of the step record that ends the solve early when True, leaving results (ts, p_hm, etc.)
+          truncated at the end of that step
+        - lapse: True to write vtk files every step (t00_nodes.vtk, etc.), or 'series' to stream them as binary
+          ParaView time series (lapse_nodes.pvd, etc.) with the unchanged geometry encoded once
         """
         print('*** heat flow module ***')
         # ****** default parameters ******
@@ -3177,6 +4146,14 @@ class Mesh:
         if dE0 < -666.0:
             dE0 = self.rock.dE0
 
+        # ****** restart from a saved thermal state ******
+        hck, t_f, t_n = self.heat_resume(restart, t_f, t_n, tstep, thermal)
+        if hck is not None:
+            tstep = hck['tstep']
+            thermal = hck['thermal']
+            history = hck['history']
+            h_stride = hck['h_stride']
+
         # ****** boundary parameters ******
         # truncate pressures when supercritical
         i_p = np.max([list(self.i_p) + list(self.p_p)]) / MPa
@@ -3185,32 +4162,19 @@ class Mesh:
             # Surface Injection Well (5)
         T5 = self.rock.Tinj + 273.15  # K
         P5 = i_p  # MPa
-        state = therm(T=T5, P=P5)
-        h5 = state.h  # kJ/kg
-        s5 = state.s  # kJ/kg-K
-        x5 = state.x  # steam quality
-        v5 = state.v  # m3/kg
+        h5, s5, x5, v5 = therm_TP(T5, P5)  # kJ/kg, kJ/kg-K, steam quality, m3/kg
         self.v5 = v5
         print(("Inject (5): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (T5, P5, h5, s5, x5, v5)))
         # Undisturbed Reservoir (r)
         Tr = self.rock.BH_T  # K
         Pr = self.rock.BH_P / MPa  # MPa
-        state = therm(T=Tr, P=Pr)
-        hr = state.h  # kJ/kg
-        sr = state.s  # kJ/kg-K
-        xr = state.x  # steam quality
-        vr = state.v  # m3/kg
+        hr, sr, xr, vr = therm_TP(Tr, Pr)  # kJ/kg, kJ/kg-K, steam quality, m3/kg
         print(("Reserv (r): T= %.2f; P= %.2f; h= %.2f, s= %.4f, x= %.4f, v= %.6f" % (Tr, Pr, hr, sr, xr, vr)))
 
         # ****** enthalpy function linearization *******
         if xr > 0.0001:
             print('warning: reservoir water is mixed phase (x = %.3f) so solver will be unreliable' % (xr))
-        x = np.linspace(T5, Tr, 100, dtype=float)
-        y = np.zeros(100, dtype=float)
-        for i in range(0, len(x)):
-            y[i] = therm(T=x[i], P=Pr).h  # kJ/kg
-        hTP = np.polyfit(x, y, 3)
-        ThP = np.polyfit(y, x, 3)
+        hTP, ThP = enthalpy_fit(T5, Tr, Pr, 100)
         ##error checking
         # y2 = hTP[0]*x**3.0 + hTP[1]*x**2.0 + hTP[2]*x**1.0 + hTP[3]
         # x2 = ThP[0]*y**3.0 + ThP[1]*y**2.0 + ThP[2]*y**1.0 + ThP[3]
@@ -3224,9 +4188,16 @@ class Mesh:
         # ax1.legend(loc='upper left', prop={'size':8}, ncol=2, numpoints=1)
 
         # ****** explicit solver setup ******
-        # working variables
-        ts = np.linspace(0.0, t_f, t_n + 1)
-        dt = ts[1] - ts[0]
+        if thermal not in ['radius', 'response']:
+            print('error: heat solver thermal model %s not recognized' % (thermal))
+            thermal = 'radius'
+        if (thermal == 'response') and (tstep != 'uniform'):
+            print('warning: response thermal model uses uniform time steps')
+            tstep = 'uniform'
+        # solver time steps and the uniform reporting grid
+        steps = HeatSteps(tstep, t_f, t_n, dt_min, dt_grow, h_tol, dt_max)
+        tstep = steps.tstep
+        ts = steps.ts
         # set boundary conditions #K
         self.therm_bcs(T_bound=Tr,
                        T_inlet=[T5])
@@ -3255,12 +4226,9 @@ class Mesh:
         ResKt = self.rock.ResKt
         CemKt = self.rock.CemKt
 
-        # memory working variables
-        ht = np.zeros((t_n + 1, N), dtype=float)
-        Tt = np.zeros((t_n + 1, N), dtype=float)
-        Rt = np.zeros((t_n + 1, Np), dtype=float)
-        Et = np.zeros((t_n + 1, Np), dtype=float)
-        Qt = np.zeros((t_n + 1, Np), dtype=float)
+        # rock energy and energy transfer rates at the current time step
+        Ec = np.zeros(Np, dtype=float)
+        Qc = np.zeros(Np, dtype=float)
         Er = np.zeros(Np, dtype=float)
 
         # well geometry #@@@@@@@ need to update for a per-borehole basis
@@ -3291,20 +4259,296 @@ class Mesh:
         goal = 0.5
         goalE = 0.03
 
+        # pipe arrays for vectorized kernels
+        n0 = np.asarray(self.pipes.n0, dtype=int)
+        n1 = np.asarray(self.pipes.n1, dtype=int)
+        Wp = np.asarray(self.pipes.W, dtype=float)
+        ptyp = np.asarray(self.pipes.typ, dtype=int)
+        # pipe, radial heat flow
+        rad = np.isin(ptyp, [typ('injector'), typ('producer'), typ('pipe')])
+        # fracture, plate heat flow
+        pla = np.isin(ptyp, [typ('boundary'), typ('fracture'), typ('propped'), typ('darcy'), typ('choke')])
+        for p in np.where(~(rad | pla))[0]:
+            print('error: segment type %s not identified' % (typ(int(ptyp[p]))))
+        # upstream and downstream nodes by flow direction
+        up = np.where(ms > 0, n0, n1)
+        dn = np.where(ms > 0, n1, n0)
+        am = np.abs(ms)
+        # equilibrium enthalpy
+        heq = hTP[0] * Tr ** 3.0 + hTP[1] * Tr ** 2.0 + hTP[2] * Tr ** 1.0 + hTP[3]
+        # boundary condition nodes and temperatures
+        iTb = np.asarray([e[0] for e in Tb], dtype=int)
+        vTb = np.asarray([e[1] for e in Tb], dtype=float)
+
+        def kernel(Tn, hn, qt, qh, P):
+            """
+            heat gain (Ep) and downstream inflow enthalpy for the pipes P
+            - qt: conductance (kJ/K-s), qh: heating carried over from the temperature history (kJ/s)
+            """
+            # non-equilibrium conduction limited heating
+            Ap = qt[P] * (Tr - 0.5 * (Tn[n1[P]] + Tn[n0[P]])) + qh[P]
+            # equilibrium conduction limited heating
+            Bp = qt[P] * (Tr - 0.5 * (Tr + Tn[up[P]])) + qh[P]
+            # flow limited cooling to equilibrium
+            Cp = am[P] * (heq - hn[up[P]])
+            # take maximum of conduction terms because this will drive conduction heat deliverability
+            Kp = np.where(np.abs(Bp) > np.abs(Ap), Bp, Ap)
+            if thermal == 'response':
+                # superposition of responses applies to the non-equilibrium temperature difference
+                Kp = Ap
+            # if flow limits heat extraction from rock, it will go to equilibrium
+            Qp = Cp
+            # get the limiting term
+            KorQ = np.abs(Qp) < np.abs(Kp)
+            if thermal == 'response':
+                # (history heating can reverse the conduction term)
+                KorQ = KorQ & (Qp * Kp > 0.0)
+            Ep = np.where(KorQ, Qp, Kp)
+            # inflow enthalpy (conduction limited or flow limited)
+            return Ep, np.where(KorQ, am[P] * heq, Ep + am[P] * hn[up[P]])
+
+        def node_h(T):
+            """
+            fluid enthalpy at temperatures T #@@@ requires consideration of sensible heating (0<X<1) if not supercritical
+            """
+            return hTP[0] * T ** 3.0 + hTP[1] * T ** 2.0 + hTP[2] * T ** 1.0 + hTP[3]
+
+        def node_T(hu, T, w):
+            """
+            temperatures for mixed inflow enthalpies hu, relaxed from T by w (Newton step) for the response model
+            """
+            z = ThP[0] * hu ** 3.0 + ThP[1] * hu ** 2.0 + ThP[2] * hu ** 1.0 + ThP[3]
+            if thermal == 'response':
+                z = np.clip(T + w * (z - T), Tlo, Thi)
+            return z
+
+        def mix(Tn, hn, qt, qh):
+            """
+            heat gain (Ep) of every pipe and mixed inflow enthalpy (hu) at every node
+            """
+            Ep, dh = kernel(Tn, hn, qt, qh, slice(None))
+            hm = np.zeros(N, dtype=float)
+            mi = np.zeros(N, dtype=float)
+            np.add.at(mi, dn, am)
+            np.add.at(hm, dn, dh)
+            hu = np.full(N, hr, dtype=float)
+            np.divide(hm, mi, out=hu, where=mi > 0)
+            return Ep, hu
+
+        def conductance(R0, Qc):
+            """
+            rock energy transfer rates (kJ/K-s) for the thermal radii R0, set in Qc
+            """
+            # radial # Note converted Kt in W/m-K to kW/m-K
+            Qc[rad] = Lp[rad] / (1.0 / (2.0 * pi * Ris * H) + np.log(R0[rad] / Rir) / (
+                    2.0 * pi * ResKt * 10 ** -3) + np.log(Rir / Ric) / (2.0 * pi * CemKt * 10 ** -3))
+            # plate
+            Qc[pla] = (2.0 * Wp[pla] * Lp[pla]) / (1.0 / (H) + R0[pla] / (ResKt * 10 ** -3))
+
+        def limits(Tn, Ec, R0, Qc, dt):
+            """
+            overshoot limit of the rock energy withdrawal (kJ) over the time step dt for each pipe
+            - sets the thermal radii (R0) and energy transfer rates (Qc) for the limit
+            - mod 9-13-2022: reduce overshoot in initial timesteps
+            """
+            dT = np.maximum(np.abs(dT0), np.abs(0.5 * (Tn[n1] + Tn[n0]) - Tr))
+            a = 1.0 / (self.rock.ResSv * dT * self.rock.ResKt * 10 ** -3)
+            b = 1.0 / self.rock.H_ConvCoef
+            c = -2.0 * dT * dt
+            dE0p = (-b + (b ** 2.0 - 4.0 * a * c) ** 0.5) / (2.0 * a)
+            # energy withdraw
+            E0p = np.where(rad, dE0p * 2.0 * pi * Rir * Lp, dE0p * Wp * Lp)  # kJ
+            Etp = np.maximum(E0p, Ec)
+            # initial rock thermal radius, radial
+            R0[rad] = np.exp(ERm * (np.log(np.abs(Etp[rad] / (Lp[rad] * dT[rad])))) + ERb) + Rir  # m
+            # rock thermal radius, plate
+            R0[pla] = Etp[pla] / (ResSv * Wp[pla] * Lp[pla] * dT[pla])  # m
+            conductance(R0, Qc)
+            return Etp
+
+        def sweep(Tn, hn, qt, qh, aG, aF):
+            """
+            fixed-point update of all node temperatures from their mixed inflows
+            - returns the new temperatures, pipe heat gains, node enthalpies, and temperature change
+            - aG, aF: prior sweep results and residuals for Anderson acceleration (appended to)
+            """
+            Ep, hu = mix(Tn, hn, qt, qh)
+            z = node_T(hu, Tn, wn)
+            # install boundary condition
+            z[iTb] = vTb
+            hu[iTb] = node_h(z[iTb])
+            err = Tn - z
+            # Anderson acceleration: mix prior sweeps to minimize the residual
+            if accel == 'anderson':
+                aG += [z]
+                aF += [z - Tn]
+                if len(aG) > accel_depth + 1:
+                    aG.pop(0)
+                    aF.pop(0)
+                if len(aG) > 1:
+                    dG = np.diff(np.asarray(aG), axis=0).T
+                    dF = np.diff(np.asarray(aF), axis=0).T
+                    gam = np.linalg.lstsq(dF, aF[-1], rcond=None)[0]
+                    z = np.clip(z - np.dot(dG, gam), Tlo, Thi)
+                    z[iTb] = vTb
+            return z, Ep, hu, err
+
+        def march(Tn, hn, qt, qh):
+            """
+            upwind march through the node groups, settling each group before moving on (pipe heating depends on
+            downstream temperature, and groups with loops feed back on themselves)
+            - returns the new temperatures and temperature change, with node enthalpies updated in hn
+            """
+            Tm = np.copy(Tn)
+            for G, P, loc, mi in groups:
+                for k in range(0, max_iters):
+                    Ep, dh = kernel(Tm, hn, qt, qh, P)
+                    hu = np.full(len(G), hr, dtype=float)
+                    np.divide(np.bincount(loc, weights=dh, minlength=len(G)), mi, out=hu, where=mi > 0)
+                    z = node_T(hu, Tm[G], wn[G])
+                    kerr = np.max(np.abs(Tm[G] - z))
+                    Tm[G] = z
+                    hn[G] = node_h(z)
+                    if kerr < goal:
+                        break
+            Tm[iTb] = vTb
+            return Tm, Tn - Tm
+
+        # upwind marching order
+        if solver == 'march':
+            groups = []
+            for G, P in self.flow_order(ms, fixed=iTb):
+                # downstream node positions within the group and total inflow
+                loc = np.searchsorted(G, dn[P])
+                groups += [[G, P, loc, np.bincount(loc, weights=am[P], minlength=len(G))]]
+            print('-> heat solver marching through %i node groups' % (len(groups)))
+        elif solver != 'iterate':
+            print('error: heat solver %s not recognized' % (solver))
+        if (accel is not None) and (accel != 'anderson'):
+            print('error: heat solver acceleration %s not recognized' % (accel))
+        # physical temperature range for accelerated updates
+        Tlo = np.min([T5, Tr] + list(vTb))
+        Thi = np.max([T5, Tr] + list(vTb))
+
+        # well nodes, and producer well nodes for step size control
+        w_i = []
+        pro = []
+        for w in range(0, len(self.wells)):
+            ck, i = self.nodes.add(self.wells[w].c0)
+            w_i += [i]
+            if self.q[np.where(n0 == i)[0][0]] <= 0.0:
+                pro += [i]
+        if not pro:
+            pro = list(range(0, N))
+        # well mass flow rates and producers for step records
+        w_i = np.asarray(w_i, dtype=int)
+        wm = np.zeros(len(w_i), dtype=float)
+        for w in range(0, len(w_i)):
+            wm[w] = ms[np.where(n0 == w_i[w])[0][0]]
+        wp = wm <= 0.0
+        t = -1
+
+        # history policy
+        if history not in ['full', 'float32', 'decimated', 'wells']:
+            print('error: heat history policy %s not recognized' % (history))
+            history = 'full'
+        stride = 1
+        if history == 'decimated':
+            stride = int(np.max([1, h_stride]))
+        fdt = float
+        if history == 'float32':
+            fdt = np.float32
+        # well and boundary node series (always kept)
+        keep = np.unique(list(w_i) + [0])
+        kpos = {}
+        for j in range(0, len(keep)):
+            kpos[keep[j]] = j
+        # solver step histories, keyed as in the thermal state: node and pipe histories by the history policy (ht, Tt,
+        # Rt, Et, Qt at solver times fa), well and boundary node series (hw, Tw), produced enthalpies (h_pro), and
+        # convergence diagnostics
+        hist = {}
+        for k in ['ht', 'Tt', 'Rt', 'Et', 'Qt', 'fa', 'hw', 'Tw', 'h_pro', 'h_its', 'h_kerr', 'h_eerr', 'h_conv']:
+            hist[k] = []
+
+        # resume from the checkpoint (same network and flow field only)
+        Dp = None
+        if hck is not None:
+            if (len(hck['Tn']) != N) or (len(hck['R0']) != Np) or (not np.allclose(hck['ms'], ms)):
+                print('error: checkpoint does not match this network or flow solution so solving from zero')
+            else:
+                for k in hist.keys():
+                    hist[k] = list(hck[k])
+                Ec = np.copy(hck['Ec'])
+                Qc = np.copy(hck['Qc'])
+                R0 = np.copy(hck['R0'])
+                Tn = np.copy(hck['Tn'])
+                hn = np.copy(hck['hn'])
+                Er = np.copy(hck['Er'])
+                Dp = hck['Dp']
+                steps.ta = list(hck['ta'])
+                steps.dt = hck['dt']
+                t = len(hist['h_its']) - 1
+                print('-> heat solver resuming from %.3f yr' % (steps.ta[-1] / yr))
+
+        # ****** conduction response kernels ******
+        Qh = np.zeros(Np, dtype=float)
+        wn = np.ones(N, dtype=float)
+        resp = None
+        if thermal == 'response':
+            # step-averaged heating rates for a unit temperature difference (kJ/K-s) at lags of 0..t_n-1 steps
+            dt = steps.dt
+            Ek, Rk = response_kernels(dt * np.arange(0, t_n + 1), Lp, Wp, rad, ResSv, ResKt, CemKt, H, Ris, Ric, Rir,
+                                      ERm, ERb)
+            Gk = np.diff(Ek, axis=1) / dt
+            resp = ResponseHistory(Gk, t_n, convolve, Dp)
+            Qc = np.copy(Gk[:, 0])
+            # node temperature relaxation (Newton step for the conductance to the downstream node)
+            cp = (heq - h5) / (Tr - T5)
+            mi = np.bincount(dn, weights=am, minlength=N)
+            wn = 1.0 / (1.0 + np.bincount(dn, weights=0.5 * Qc, minlength=N) / (cp * mi + 1.0e-9))
+            print('-> heat solver superposing conduction responses over %i steps (%s)' % (t_n, convolve))
+
+        # per-step records on disk (appended when resuming)
+        stopped = False
+        fs = None
+        if stream:
+            fs = HeatStream(stream, resume=t >= 0)
+        # timelapse vtk time series by file name
+        l_series = {}
+
         # iterate over time
-        for t in range(0, len(ts) - 1):  # !!! add self-estimation of dE0 for stabilization
+        ta = steps.ta
+        while 1:  # !!! add self-estimation of dE0 for stabilization
+            t += 1
+            if steps.done(t):
+                break
+            dt = steps.dt
+            # state at the start of the step (for a repeat with a smaller dt)
+            Tn0 = np.copy(Tn)
+            hn0 = np.copy(hn)
+            R00 = np.copy(R0)
+            Qc0 = np.copy(Qc)
+            conv = False
             # calculate nodal temperatures by pipe flow and nodal mixing
             iters = 0
             err = np.ones(N) * goal * 10
             E0_update_intervals = 5
             max_iters = 30 * E0_update_intervals
-            E0e = np.zeros(Np) + Et[0, :]
+            if solver == 'march':
+                max_iters = 30
+            E0e = np.zeros(Np)
             dE0e = np.zeros(Np)
+            # heating from the temperature history
+            if resp is not None:
+                Qh = resp.heating(t)
+            # acceleration history of sweep results and residuals
+            aG = []
+            aF = []
 
             # iterate for temperature stability
             while 1:
-                # calculate nodal fluid enthalpy #@@@ requires consideration of sensible heating (0<X<1) if not supercritical
-                hn = hTP[0] * Tn ** 3.0 + hTP[1] * Tn ** 2.0 + hTP[2] * Tn ** 1.0 + hTP[3]
+                # calculate nodal fluid enthalpy
+                hn = node_h(Tn)
                 # temperature convergence
                 kerr = np.max(np.abs(err))
                 # energy convergence
@@ -3312,197 +4556,194 @@ class Mesh:
                 # loop breaker
                 iters += 1
                 if iters > max_iters:
-                    print('Heat solver halted after %i iterations' % (iters - 1))
+                    print('Heat solver halted after %i iterations (%.2e Kelvin, %.2e energy)' % (iters - 1, kerr, eerr))
                     break
                 elif (kerr < goal) and (eerr < goalE):  # np.max(np.abs(err)) < goal:
                     print('Heat solver converged to %e Kelvin after %i iterations' % (goal, iters - 1))
+                    conv = True
                     break
-                # follow the flow to estimate heating/cooling of fluid per pipe
-                Ap = np.zeros(Np, dtype=float)
-                Bp = np.zeros(Np, dtype=float)
-                Cp = np.zeros(Np, dtype=float)
-                Dp = np.zeros(Np, dtype=float)
-                Ep = np.zeros(Np, dtype=float)
-                hm = np.zeros(N, dtype=float)
-                mi = np.zeros(N, dtype=float)
-                for p in range(0, Np):
-                    # working variables
-                    n0 = self.pipes.n0[p]
-                    n1 = self.pipes.n1[p]
-                    # get overshoot limit for timestep for each pipe #!!! edit 9-13-2022 start
-                    if (iters - 1) % E0_update_intervals == 0:
-                        dT = 0.5 * (Tn[n1] + Tn[n0]) - Tr
-                        dT = np.max([np.abs(dT0), np.abs(dT)])
-                        a = 1.0 / (self.rock.ResSv * np.abs(dT) * self.rock.ResKt * 10 ** -3)
-                        b = 1.0 / self.rock.H_ConvCoef
-                        c = -2.0 * np.abs(dT) * dt
-                        dE0 = (-b + (b ** 2.0 - 4.0 * a * c) ** 0.5) / (2.0 * a)
-                        # get extracted energy - Et, thermal radius - R0, heat flow rate - Qt
-                        if (int(self.pipes.typ[p]) in [typ('injector'), typ('producer'),
-                                                       typ('pipe')]):  # pipe, radial heat flow
-                            # energy withdraw
-                            E0p = dE0 * 2.0 * pi * Rir * Lp[p]  # kJ
-                            Esp = Et[t, p]
-                            Etp = np.max([E0p, Esp])
-                            dE0e[p] = Etp - E0e[p]
-                            E0e[p] = Etp
-                            # initial rock thermal radius
-                            R0[p] = np.exp(ERm * (np.log(np.abs(Etp / (Lp[p] * dT)))) + ERb) + Rir  # m
-                            # initial rock energy transfer rates
-                            Qt[t, p] = Lp[p] / (1.0 / (2.0 * pi * Ris * H) + np.log(R0[p] / Rir) / (
-                                    2.0 * pi * ResKt * 10 ** -3) + np.log(Rir / Ric) / (
-                                                        2.0 * pi * CemKt * 10 ** -3))  # kJ/K-s
-                        elif (int(self.pipes.typ[p]) in [typ('boundary'), typ('fracture'), typ('propped'), typ('darcy'),
-                                                         typ('choke')]):  # fracture, plate heat flow
-                            # rock energy withdraw
-                            E0p = dE0 * self.pipes.W[p] * Lp[p]  # kJ
-                            Esp = Et[t, p]
-                            Etp = np.max([E0p, Esp])
-                            dE0e[p] = Etp - E0e[p]
-                            E0e[p] = Etp
-                            # rock thermal radius
-                            R0[p] = Etp / (ResSv * self.pipes.W[p] * Lp[p] * dT)  # m
-                            # rock energy transfer rates
-                            Qt[t, p] = (2.0 * self.pipes.W[p] * Lp[p]) / (
-                                    1.0 / (H) + R0[p] / (ResKt * 10 ** -3))  # kJ/K-s
-                        else:
-                            print('error: segment type %s not identified' % (
-                                typ(int(self.pipes.typ[p]))))  # !!! edit 9-13-2022 end
-
-                    # equilibrium enthalpy
-                    heq0 = hTP[0] * Tr ** 3.0 + hTP[1] * Tr ** 2.0 + hTP[2] * Tr ** 1.0 + hTP[3]
-                    heq1 = heq0
-
-                    # working variables
-                    Kp = 0.0
-                    Qp = 0.0
-
-                    # positive flow
-                    if ms[p] > 0:
-                        # non-equilibrium conduction limited heating
-                        Ap[p] = Qt[t, p] * (Tr - 0.5 * (Tn[n1] + Tn[n0]))
-                        # equilibrium conduction limited heating
-                        Bp[p] = Qt[t, p] * (Tr - 0.5 * (Tr + Tn[n0]))
-                        # flow limited cooling to equilibrium
-                        Cp[p] = ms[p] * (heq1 - hn[n0])
-                        # flow limited cooling to non-equilibrium
-                        Dp[p] = ms[p] * (hn[n1] - hn[n0])
-
-                    # negative flow
-                    else:
-                        # non-equilibrium conduction limited heating
-                        Ap[p] = Qt[t, p] * (Tr - 0.5 * (Tn[n0] + Tn[n1]))
-                        # equilibrium conduction limited heating
-                        Bp[p] = Qt[t, p] * (Tr - 0.5 * (Tr + Tn[n1]))
-                        # flow limited cooling to equilibrium
-                        Cp[p] = -ms[p] * (heq0 - hn[n1])
-                        # flow limited cooling to non-equilibrium
-                        Dp[p] = -ms[p] * (hn[n0] - hn[n1])
-
-                    # take maximum of conduction terms because this will drive conduction heat deliverability
-                    Kp = np.asarray([Ap[p], Bp[p]])[np.argmax(np.abs([Ap[p], Bp[p]]))]
-                    # if flow limits heat extraction from rock, it will go to equilibrium
-                    Qp = Cp[p]
-                    # get the limiting term
-                    KorQ = np.argmin(np.abs([Kp, Qp]))
-                    Ep[p] = np.asarray([Kp, Qp])[np.argmin(np.abs([Kp, Qp]))]
-
-                    # conduction limited
-                    if KorQ == 0:
-                        # positive flow
-                        if ms[p] > 0:
-                            mi[n1] += ms[p]
-                            hm[n1] += Ep[p] + ms[p] * hn[n0]
-                        # negative flow
-                        else:
-                            mi[n0] += -ms[p]
-                            hm[n0] += Ep[p] + -ms[p] * hn[n1]
-                    # flow limited
-                    else:
-                        # positive flow
-                        if ms[p] > 0:
-                            mi[n1] += ms[p]
-                            hm[n1] += ms[p] * heq1
-                        # negative flow
-                        else:
-                            mi[n0] += -ms[p]
-                            hm[n0] += -ms[p] * heq0
-
-                # calculate nodal temperatures
-                z = []
-                z = np.zeros(N, dtype=float)  # -0.0001*np.random.rand(N) + Tr #K
-                hu = np.zeros(N, dtype=float)
-                for n in range(0, N):
-                    # mixed inflow enthalpy
-                    if mi[n] > 0:
-                        hu[n] = hm[n] / mi[n]
-                    else:
-                        hu[n] = hr
-                    # calculate temperature at new enthalpy
-                    #                    z[n] = therm(h=hu[n],P=Pn[n]).T
-                    z[n] = ThP[0] * hu[n] ** 3.0 + ThP[1] * hu[n] ** 2.0 + ThP[2] * hu[n] ** 1.0 + ThP[3]
-
-                # install boundary condition
-                for j in range(0, len(Tb)):
-                    z[Tb[j][0]] = Tb[j][1]
-                    #                    hu[Tb[j][0]] = therm(T=z[Tb[j][0]],P=Pn[Tb[j][0]]).h
-                    hu[Tb[j][0]] = hTP[0] * z[Tb[j][0]] ** 3.0 + hTP[1] * z[Tb[j][0]] ** 2.0 + hTP[2] * z[
-                        Tb[j][0]] ** 1.0 + hTP[3]
-
-                # calculate error
-                err = []  # np.zeros(N,dtype=float)
-                err = Tn - z
-
-                # update Tn
-                Tn = z
-
-            # store ht
-            ht[t] = hu
-            # store temperatures
-            Tt[t, :] = Tn
-            # store thermal radii
-            Rt[t, :] = R0
+
+                # get overshoot limit for timestep for each pipe (every pass when marching) #!!! edit 9-13-2022 start
+                if (thermal == 'radius') and ((solver == 'march') or ((iters - 1) % E0_update_intervals == 0)):
+                    Etp = limits(Tn, Ec, R0, Qc, dt)
+                    dE0e = Etp - E0e
+                    E0e = Etp
+                    # !!! edit 9-13-2022 end
+                    # sweep results from the prior limits no longer apply
+                    aG = []
+                    aF = []
+
+                # march downstream through the node groups, or sweep all nodes
+                if solver == 'march':
+                    Tn, err = march(Tn, hn, Qc, Qh)
+                else:
+                    Tn, Ep, hu, err = sweep(Tn, hn, Qc, Qh, aG, aF)
+
+            # heat flows and nodal enthalpies for the marched temperatures
+            if solver == 'march':
+                Ep, hu = mix(Tn, hn, Qc, Qh)
+                hu[iTb] = hn[iTb]
+
+            # repeat the step with a smaller dt when the produced enthalpy is out of tolerance
+            if not steps.accept(hu[pro], hist['h_pro']):
+                Tn = Tn0
+                hn = hn0
+                R0 = R00
+                Qc = Qc0
+                t -= 1
+                continue
+
+            # store convergence diagnostics
+            hist['h_its'] += [iters - 1]
+            hist['h_kerr'] += [kerr]
+            hist['h_eerr'] += [eerr]
+            hist['h_conv'] += [conv]
+
+            # store well and boundary node series
+            hist['hw'] += [hu[keep]]
+            hist['Tw'] += [Tn[keep]]
+            # store node and pipe histories by the history policy
+            if (history != 'wells') and (t % stride == 0):
+                hist['fa'] += [ta[-1]]
+                # store ht
+                hist['ht'] += [np.array(hu, dtype=fdt)]
+                # store temperatures
+                hist['Tt'] += [np.array(Tn, dtype=fdt)]
+                # store thermal radii
+                hist['Rt'] += [np.array(R0, dtype=fdt)]
+                # store rock energy and energy transfer rates
+                hist['Et'] += [np.array(Ec, dtype=fdt)]
+                hist['Qt'] += [np.array(Qc, dtype=fdt)]
+            # stream the step record
+            if fs is not None:
+                fs.add(t=ta[-1], dt=dt, ht=np.array(hu, dtype=fdt), Tt=np.array(Tn, dtype=fdt),
+                       Rt=np.array(R0, dtype=fdt), Et=np.array(Ec, dtype=fdt), Qt=np.array(Qc, dtype=fdt), conv=conv)
 
             # timelapse 3D
             if lapse:
                 self.nodes.T = Tn
                 self.nodes.h = hn
-                self.build_vtk(fname='t%02d' % (t))
+                self.lapse_vtk(lapse, t, ta[-1], l_series)
 
             # extracted energy during this time step
-            Et[t + 1] = Et[t] + np.abs(Ep) * dt
+            Ec = Ec + np.abs(Ep) * dt
             # rock energy tracker (added or lost)
             Er += Ep * dt
-            for i in range(0, Np):
-                # working variables
-                n0 = self.pipes.n0[i]
-                n1 = self.pipes.n1[i]
-                dT = abs(Tr - 0.5 * (Tn[n1] + Tn[n0]))
-
-                # @@@@ stabilizer
-                dT = np.max([dT, dT0])
-
-                # thermal radius for next time step
-                if (int(self.pipes.typ[i]) in [typ('injector'), typ('producer'),
-                                               typ('pipe')]):  # pipe, radial heat flow
-                    if (dT > 0) and (Et[t + 1, i] > 0):
-                        R0[i] = np.exp(ERm * (np.log(np.abs(Et[t + 1, i] / (Lp[i] * dT)))) + ERb) + Rir  # +2.0*Rir # m
-                    # Et[0,i] = np.exp((np.log(R0[i])-ERb)/ERm)*Lp[i]*(Tr-0.5*(Tn[Y[i][1]]+Tn[Y[i][0]])) # kJ
-                    Qt[t + 1, i] = Lp[i] / (1.0 / (2.0 * pi * Ris * H) + np.log(R0[i] / Rir) / (
-                            2.0 * pi * ResKt * 10 ** -3) + np.log(Rir / Ric) / (
-                                                    2.0 * pi * CemKt * 10 ** -3))  # kJ/K-s # Note converted Kt in W/m-K to kW/m-K
-
-                elif (int(self.pipes.typ[i]) in [typ('boundary'), typ('fracture'), typ('propped'), typ('darcy'),
-                                                 typ('choke')]):  # fracture, plate heat flow
-                    if (dT > 0) and (Et[t + 1, i] > 0):
-                        R0[i] = Et[t + 1, i] / (ResSv * self.pipes.W[i] * Lp[i] * dT)
-                    # Et[0,i] = ResSv*R0[i]*Y[i][4]*Lp[i]*(Tr-0.5*(Tn[Y[i][1]]+Tn[Y[i][0]])) # kJ
-                    Qt[t + 1, i] = (2.0 * self.pipes.W[i] * Lp[i]) / (
-                            1.0 / (H) + R0[i] / (ResKt * 10 ** -3))  # kJ/K-s # Note converted Kt in W/m-K to kW/m-K
-                else:
-                    print('error: segment type %s not identified' % (typ(int(self.pipes.typ[i]))))
+            # @@@@ stabilizer
+            dT = np.maximum(np.abs(Tr - 0.5 * (Tn[n1] + Tn[n0])), dT0)
+            grow = (dT > 0) & (Ec > 0)
+            if resp is not None:
+                grow[:] = False
+                # effective temperature difference of the realized (possibly flow limited) heating
+                resp.add(t, Ep - Qh, Qc)
+                R0 = np.copy(Rk[:, t + 1])
+
+            # thermal radius for next time step, radial
+            i = rad & grow
+            R0[i] = np.exp(ERm * (np.log(np.abs(Ec[i] / (Lp[i] * dT[i])))) + ERb) + Rir  # +2.0*Rir # m
+            # thermal radius for next time step, plate
+            i = pla & grow
+            R0[i] = Ec[i] / (ResSv * Wp[i] * Lp[i] * dT[i])
+            if thermal == 'radius':
+                conductance(R0, Qc)
+
+            # next time step
+            hist['h_pro'] += [hu[pro]]
+            steps.advance()
+
+            # step record
+            rec = {'step': t, 't': ta[-2], 'dt': ta[-1] - ta[-2], 'h': hu[w_i], 'T': Tn[w_i], 'm': wm,
+                   'p_h': hr, 'conv': conv}
+            if np.sum(wm[wp]) < 0.0:
+                rec['p_h'] = np.sum(hu[w_i[wp]] * wm[wp]) / np.sum(wm[wp])
+            yield rec
+            if (stop is not None) and stop(rec):
+                print('-> heat solver stopped at %.3f yr' % (ta[-1] / yr))
+                stopped = True
+                break
+
+        if fs is not None:
+            fs.close()
+
+        # truncate the reporting grid at an early stop
+        if stopped:
+            t_f = ta[-1]
+            ts = ts[:np.max([2, np.sum(ts <= t_f * (1.0 + 1.0e-9))])]
+
+        # well and boundary node series
+        hw = np.asarray(hist['hw'] + [np.zeros(len(keep), dtype=float)])
+        Tw = np.asarray(hist['Tw'] + [np.zeros(len(keep), dtype=float)])
+        # node and pipe histories with the final rock energy and energy transfer rates
+        ht = np.asarray(hist['ht'] + [np.zeros(N, dtype=fdt)], dtype=fdt)
+        Tt = np.asarray(hist['Tt'] + [np.zeros(N, dtype=fdt)], dtype=fdt)
+        Rt = np.asarray(hist['Rt'] + [np.zeros(Np, dtype=fdt)], dtype=fdt)
+        Et = np.asarray(hist['Et'] + [Ec], dtype=fdt)
+        Qt = np.asarray(hist['Qt'] + [Qc], dtype=fdt)
+        h_its = np.asarray(hist['h_its'], dtype=int)
+        h_kerr = np.asarray(hist['h_kerr'], dtype=float)
+        h_eerr = np.asarray(hist['h_eerr'], dtype=float)
+        h_conv = np.asarray(hist['h_conv'], dtype=bool)
+        ta = np.asarray(ta)
+        fa = np.asarray(hist['fa'] + [ta[-1]])
+        dt = steps.dt
+
+        # thermal state for restarts (solver step histories before interpolation)
+        self.h_state = {'t': ta[-1], 'dt': dt, 'tstep': tstep, 'ta': ta, 'ms': ms,
+                        'history': history, 'h_stride': h_stride, 'fa': fa[:-1], 'thermal': thermal, 'Dp': None,
+                        'R0': np.copy(R0), 'Tn': np.copy(Tn), 'hn': np.copy(hn), 'Er': np.copy(Er),
+                        'Ec': np.copy(Ec), 'Qc': np.copy(Qc), 'hw': hw[:-1], 'Tw': Tw[:-1],
+                        'ht': ht[:-1], 'Tt': Tt[:-1], 'Rt': Rt[:-1], 'Et': Et[:-1], 'Qt': Qt[:-1],
+                        'h_its': h_its, 'h_kerr': h_kerr, 'h_eerr': h_eerr, 'h_conv': h_conv,
+                        'h_pro': np.asarray(hist['h_pro'])}
+        if resp is not None:
+            self.h_state['Dp'] = np.copy(resp.Dt[:, :len(h_its)])
+        if checkpoint:
+            self.save_heat_state(checkpoint)
+
+        # reporting times of the stored node and pipe histories
+        tf = np.append(ts[:-1][::stride], ts[-1])
+
+        # average or interpolate onto the reporting grid
+        if tstep != 'uniform':
+            print('-> heat solver used %i %s time steps (%i repeated) for %i reporting steps'
+                  % (len(ta) - 1, tstep, steps.rejects, t_n))
+
+            def regrid(A, tA, tB):
+                # linear interpolation of the rows of A at times tA onto times tB
+                if len(tA) < 2:
+                    return np.repeat(A[:1], len(tB), axis=0)
+                j = np.clip(np.searchsorted(tA, tB, side='right') - 1, 0, len(tA) - 2)
+                w = np.clip((tB - tA[j]) / (tA[j + 1] - tA[j]), 0.0, 1.0)[:, None]
+                return A[j] * (1.0 - w) + A[j + 1] * w
+
+            hw = np.concatenate((step_mean(hw[:-1], ta, ts), hw[-1:]), axis=0)
+            Tw = np.concatenate((step_mean(Tw[:-1], ta, ts), Tw[-1:]), axis=0)
+            if history != 'wells':
+                ht = np.concatenate((regrid(ht[:-1], fa[:-1], tf[:-1]), ht[-1:]), axis=0).astype(fdt)
+                Tt = np.concatenate((regrid(Tt[:-1], fa[:-1], tf[:-1]), Tt[-1:]), axis=0).astype(fdt)
+                Rt = np.concatenate((regrid(Rt[:-1], fa[:-1], tf[:-1]), Rt[-1:]), axis=0).astype(fdt)
+                Et = regrid(Et, fa, tf).astype(fdt)
+                Qt = regrid(Qt, fa, tf).astype(fdt)
+            dt = ts[1] - ts[0]
+        if history == 'wells':
+            ht = []
+            Tt = []
+            Rt = []
+            Et = []
+            Qt = []
+
+        # convergence summary
+        if np.sum(np.invert(h_conv)) > 0:
+            print('warning: heat solver did not converge in %i of %i time steps'
+                  % (np.sum(np.invert(h_conv)), len(h_conv)))
 
         # store results
+        self.h_its = h_its
+        self.h_kerr = h_kerr
+        self.h_eerr = h_eerr
+        self.h_conv = h_conv
+        self.h_ts = ta[:-1]
+        self.h_tf = tf
         self.Et = Et
         self.Qt = Qt
         self.nodes.T = Tn
@@ -3525,9 +4766,9 @@ class Mesh:
             # find index of duplicate
             ck, i = self.nodes.add(source)
             # record temperature
-            w_T += [Tt[:, i]]
+            w_T += [Tw[:, kpos[i]]]
             # record enthalpy
-            w_h += [ht[:, i]]
+            w_h += [hw[:, kpos[i]]]
             # record mass flow rate
             i_pipe = np.where(np.asarray(self.pipes.n0) == i)[0][0]
             w_m += [self.q[i_pipe] / v5]
@@ -3547,8 +4788,8 @@ class Mesh:
         b_m = []
         w = b_nodes[0]
         b_pipes = np.where(np.asarray(self.pipes.n1) == w)[0]
-        b_h += [ht[:, w]]
-        b_T += [Tt[:, w]]
+        b_h += [hw[:, kpos[w]]]
+        b_T += [Tw[:, kpos[w]]]
         if len(b_pipes) > 0:
             for w in b_pipes:
                 b_m += [self.q[w] / v5]
@@ -3626,6 +4867,7 @@ class Mesh:
         # save key values
         self.ts = ts
         self.w_h = w_h
+        self.w_T = w_T
         self.w_m = w_m
         self.b_h = b_h
         self.b_m = b_m
@@ -3639,42 +4881,223 @@ class Mesh:
             dht += -w_m[i] * w_h[i]
         self.dhout = dht
 
-        if plot:  # plots
-            fig = pylab.figure(figsize=(11.0, 8.5), dpi=96, facecolor='w', edgecolor='k',
-                               tight_layout=True)  # Medium resolution
-            font = {'family': 'serif', 'size': 16}
-            pylab.rc('font', serif='Arial')
-            pylab.rc('font', **font)
-            ax1 = fig.add_subplot(221)
-            for i in iPro:
-                i = int(i)
-                ax1.plot(ts[:-1] / yr, w_h[i][:-1], linewidth=1.5)
-            ax1.set_xlabel('Time (yr)')
-            ax1.set_ylabel('Production Enthalpy (kJ/kg)')
-            # ax1.set_ylim(bottom=0.0)
-            ax2 = fig.add_subplot(222)
-            ax2.plot(ts[:-1] / yr, self.Fout[:], linewidth=1.0, color='red')
-            ax2.plot(ts[:-1] / yr, self.Bout[:], linewidth=1.0, color='blue')
-            ax2.plot(ts[:-1] / yr, self.Qout[:], linewidth=1.0, color='cyan')
-            ax2.plot(ts[:-1] / yr, self.Pout[:], linewidth=1.5, color='black')
-            ax2.set_xlabel('Time (yr)')
-            ax2.set_ylabel('Fla-R, Bin-B, Pum-C, Net-K (kWe)')
-            # ax2.set_ylim(bottom=0.0)
-            ax3 = fig.add_subplot(223)
-            for i in iPro:
-                i = int(i)
-                ax3.plot(ts[:-1] / yr, w_T[i][:-1], linewidth=1.5)
-            ax3.set_xlabel('Time (yr)')
-            ax3.set_ylabel('Production Temperature (K)')
-            # ax3.set_ylim(bottom=273.0)
-            #            ax3.plot(ts/yr,np.sum(Et,axis=1),linewidth=0.5,color='black')
-            #            ax3.set_xlabel('Time (yr)')
-            #            ax3.set_ylabel('Rock Energy (kJ)')
-            ax4 = fig.add_subplot(224)
-            ax4.plot(ts[:-1] / yr, dht[:-1], linewidth=1.5, color='green')
-            ax4.set_xlabel('Time (yr)')
-            ax4.set_ylabel('Thermal Extraction (kJ/s)')
-            # ax4.set_ylim(bottom=0.0)
+        # plot data (drawn now, or later with plot_heat)
+        self.h_plot = {'ts': ts, 'w_h': w_h[iPro], 'w_T': w_T[iPro],
+                       'Fout': self.Fout, 'Bout': self.Bout, 'Qout': self.Qout, 'Pout': self.Pout, 'dht': dht}
+        if plot is True:  # plots
+            plot_heat(self.h_plot)
+
+    def stim_vtk(self, fname, vtype, vtk='now', series='stim'):
+        """
+        Write stimulation vtk files now, keep a snapshot of the network to write later with export_vtk, add a step
+        to the time series named series (in self.v_series), or skip
+        - deferred snapshots (nodes, pipes, flows, faces, and wells) are pickled to fname_frame.pkl so memory does not
+          grow with the iteration count; each costs about as much disk as a pickled model until export_vtk
+        """
+        if vtk == 'now':
+            self.build_vtk(fname, vtype=vtype)
+        elif vtk == 'series':
+            self.build_vtk(series, vtype=vtype, compress=True, series=self.v_series)
+        elif vtk == 'defer':
+            frame = fname + '_frame.pkl'
+            with open(frame, 'wb') as f:
+                pickle.dump({'nodes': self.nodes, 'pipes': self.pipes, 'q': self.q,
+                             'faces': self.faces, 'wells': self.wells}, f)
+            self.v_frames += [(fname, vtype, frame)]
+
+    def export_vtk(self, clear=True):
+        """
+        Write the vtk files deferred by dyn_stim(vtk='defer')
+        - clear: forget the deferred snapshots and delete their files once written
+        """
+        for fname, vtype, frame in self.v_frames:
+            geom = Mesh()
+            geom.rock = self.rock
+            with open(frame, 'rb') as f:
+                geom.__dict__.update(pickle.load(f))
+            geom.build_vtk(fname, vtype=vtype)
+            if clear:
+                os.remove(frame)
+        print('-> %i deferred vtk sets written' % (len(self.v_frames)))
+        if clear:
+            self.v_frames = []
+
+    def get_pmax(self, p_floor):
+        """
+        Maximum node pressure on each fracture from the pipes built on it
+        - faces without fracture pipes (e.g., outside the network) are set to p_floor
+        """
+        face_pmax = np.ones(len(self.faces), dtype=float) * p_floor
+        if self.pipes.num == 0:
+            return face_pmax
+        # fracture-type pipes only (don't confuse well ID with face ID)
+        ptyp = np.asarray(self.pipes.typ, dtype=float).astype(int)
+        frac = np.isin(ptyp, [typ('boundary'), typ('fracture'), typ('propped'), typ('choke')])
+        fID = np.asarray(self.pipes.fID, dtype=int)[frac]
+        p0 = self.nodes.p[np.asarray(self.pipes.n0, dtype=int)[frac]]
+        p1 = self.nodes.p[np.asarray(self.pipes.n1, dtype=int)[frac]]
+        np.maximum.at(face_pmax, fID, np.maximum(p0, p1))
+        return face_pmax
+
+    def net_volume(self):
+        """
+        Fracture network volume (m3) excluding boundary planes, with the per-face radii, apertures, and volumes
+        """
+        dia = np.asarray([f.dia for f in self.faces], dtype=float)
+        bd = np.asarray([f.bd for f in self.faces], dtype=float)
+        bnd = np.asarray([int(f.typ) in [typ('boundary')] for f in self.faces], dtype=bool)
+        V = (4.0 / 3.0) * pi * 0.25 * dia ** 2.0 * 0.5 * bd
+        return np.sum(V[~bnd]), 0.5 * dia, bd, V
+
+    def stim_probe(self, p_bound, p_well, q_well, Qnom, i_key):
+        """
+        Trial flow solve on the current network without stimulating anything
+        - reuses the existing pipes and warm starts from the prior pressure solution
+        - returns True if any fracture reaches its critical pressure or any injector exceeds Qnom
+        """
+        # solve flow without remeshing
+        self.get_flow(p_bound=p_bound, p_well=p_well, q_well=q_well, reinit=False, useprior=True, Qnom=Qnom)
+
+        # injection rate criteria
+        for i in i_key:
+            if self.p_q[i] > Qnom:
+                return True
+
+        # get max pressure on each fracture from all the nodes associated with that fracture
+        face_pmax = self.get_pmax(p_bound)
+
+        # stimulation criteria (same test as hydromech)
+        Pc = np.asarray([f.Pc for f in self.faces], dtype=float)
+        return bool(np.any(face_pmax >= Pc))
+
+    def injector_groups(self, target=[]):
+        """
+        Injectors that share no flow path except through fixed-pressure nodes (far field and producers)
+        - returns a list of injector well index arrays, one per hydraulically isolated group
+        - target limits the injectors considered (default all)
+        """
+        # current network
+        self.re_init()
+        self.gen_pipes()
+
+        # fixed-pressure nodes
+        fixed = [0]
+        i_key = []
+        for w in range(0, len(self.wells)):
+            if int(self.wells[w].typ) in [typ('producer')]:
+                fixed += [self.nodes.add(self.wells[w].c0)[1]]
+            if int(self.wells[w].typ) in [typ('injector')] and ((len(target) == 0) or (w in list(target))):
+                i_key += [w]
+
+        # connected components of the network without the fixed nodes
+        N = self.nodes.num
+        n0 = np.asarray(self.pipes.n0, dtype=int)
+        n1 = np.asarray(self.pipes.n1, dtype=int)
+        keep = np.invert(np.isin(n0, fixed) | np.isin(n1, fixed))
+        A = coo_matrix((np.ones(np.sum(keep)), (n0[keep], n1[keep])), shape=(N, N)).tocsr()
+        num, lab = connected_components(A, directed=False)
+
+        # group injectors by the component of their wellhead node
+        i_lab = np.asarray([lab[self.nodes.add(self.wells[w].c0)[1]] for w in i_key], dtype=int)
+        i_key = np.asarray(i_key, dtype=int)
+        groups = []
+        for c in np.unique(i_lab):
+            groups += [i_key[i_lab == c]]
+        return groups
+
+    def par_stim(self,
+                 Vinj=-1.0,
+                 Qinj=-1.0,
+                 target=[],
+                 visuals=True,
+                 fname='stim',
+                 psearch='step',
+                 workers=None,
+                 **kwargs):
+        """
+        dyn_stim with hydraulically isolated injector groups (injector_groups) stimulated independently
+        - each group is solved by dyn_stim on its own copy of the model with a spawned seed in a process pool of
+          workers (default one per group up to the cpu count; 1 solves the groups in turn without a pool)
+        - fractures are merged by taking each one from the group that stimulated or loaded it the most, new hydraulic
+          fractures are appended in group order, then the final flow solve runs on the merged model
+        - groups are found before stimulation, so a warning is given if fracture growth made them interact
+        - other keyword arguments are passed to dyn_stim
+        """
+        print('*** parallel stim module ***')
+        if Vinj < 0:
+            Vinj = self.rock.Vinj
+        if Qinj < 0:
+            Qinj = self.rock.Qinj
+        groups = self.injector_groups(target)
+        print('-> %i hydraulically isolated injector groups: %s' % (len(groups), [list(g) for g in groups]))
+
+        # nothing to split
+        if len(groups) < 2:
+            self.dyn_stim(Vinj=Vinj, Qinj=Qinj, target=target, visuals=visuals, fname=fname, psearch=psearch,
+                          **kwargs)
+            return groups
+
+        # stimulate each group on its own copy of the model
+        blob = pickle.dumps(self)
+        seeds = self.spawn(len(groups))
+        jobs = []
+        for n in range(0, len(groups)):
+            job = dict(kwargs, Vinj=Vinj, Qinj=Qinj, target=groups[n], visuals=False, fname='%s_g%i' % (fname, n),
+                       psearch=psearch)
+            if kwargs.get('checkpoint', ''):
+                job['checkpoint'] = '%s_g%i' % (kwargs['checkpoint'], n)
+            jobs += [(blob, seeds[n], job)]
+        if workers == 1:
+            outs = [stim_group(job) for job in jobs]
+        else:
+            if workers is None:
+                workers = int(np.min([len(groups), os.cpu_count()]))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                outs = list(pool.map(stim_group, jobs))
+        states = [pickle.loads(out) for out in outs]
+
+        # merge fractures by the group that changed each one the most
+        i_key = np.asarray([w for w in range(0, len(self.wells)) if int(self.wells[w].typ) in [typ('injector')]],
+                           dtype=int)
+        merged = {}
+        for key in ['bound', 'fracs', 'hydfs']:
+            base = getattr(self, key)
+            faces = []
+            for f in range(0, len(base)):
+                stims = np.asarray([st[key][f].stim for st in states])
+                loads = np.asarray([st[key][f].prop_load for st in states])
+                moved = (stims > base[f].stim) | (loads != base[f].prop_load)
+                if (np.sum(moved) > 1) and (int(base[f].typ) not in [typ('boundary')]):
+                    print('warning: %s fracture %i was changed by %i injector groups' % (key, f, np.sum(moved)))
+                faces += [states[np.lexsort((loads, stims))[-1]][key][f]]
+            merged[key] = faces
+        for st in states:
+            merged['hydfs'] += st['hydfs'][len(self.hydfs):]
+
+        # wells and stimulation state of each injector from its group
+        dpi = np.ones(len(i_key), dtype=float) * -self.rock.dPi
+        tip = np.ones(len(i_key), dtype=float) * self.rock.BH_P
+        vol_rem = np.ones(len(i_key), dtype=float) * Vinj
+        for n in range(0, len(groups)):
+            for i in range(0, len(i_key)):
+                if i_key[i] in list(groups[n]):
+                    self.wells[i_key[i]].hydrofrac = states[n]['wells'][i_key[i]].hydrofrac
+                    dpi[i] = states[n]['dpi'][i]
+                    tip[i] = states[n]['tip'][i]
+                    vol_rem[i] = states[n]['vol_rem'][i]
+
+        # final flow solve on the merged model
+        iters = int(np.sum([st['iters'] for st in states]))
+        state = {'fname': fname, 'Vinj': Vinj, 'Qinj': Qinj, 'psearch': psearch,
+                 'bound': merged['bound'], 'fracs': merged['fracs'], 'hydfs': merged['hydfs'], 'wells': self.wells,
+                 'rng': self.rng.bit_generator.state, 'iters': iters, 'quiet': 0,
+                 'probes': int(np.sum([st['probes'] for st in states])), 'vol_old': 0.0, 'vol_rem': vol_rem,
+                 'completed': np.ones(len(i_key), dtype=bool), 'tip': tip, 'dpi': dpi, 'Pis': [], 'Qis': [],
+                 'visuals': None, 'frames': []}
+        kwargs['maxit'] = 0
+        self.dyn_stim(Vinj=Vinj, Qinj=Qinj, target=target, visuals=visuals, fname=fname, psearch=psearch,
+                      restart=state, **kwargs)
+        return groups
 
     def dyn_stim(
             self,
@@ -3688,13 +5111,33 @@ class Mesh:
             r_perf=-1.0,
             visuals=True,
             fname='stim',
-            pfinal_max=999.9 * MPa):
+            pfinal_max=999.9 * MPa,
+            psearch='step',
+            v_stride=1,
+            vtk='now',
+            maxit=40,
+            checkpoint='',
+            restart=None):
         """
         stimulation - add frac
 
         Parameters
         ----------
         Vinj -- total volume per stage, sand ratio to frac slurry by volume
+        psearch -- injection pressure schedule while nothing stimulates
+            - 'step': raise trial pressure by rock.dPi each iteration
+            - 'bisect': after a quiet step, bracket the next stimulation (or full flow) pressure with
+              growing trial solves, then bisect to rock.dPi resolution before remeshing
+        checkpoint -- file name to pickle the stimulation state (self.s_state) after every iteration
+        restart -- stimulation state (self.s_state or a checkpoint file) to resume from its last iteration; the state
+            holds fractures, wells, and loop variables but not the visuals histories or deferred vtk frames, which
+            start over from the resumed iteration
+        visuals -- record fracture radius, aperture, volume, and center pressure histories (self.v_Rs, etc.)
+        v_stride -- record visuals (and iteration vtk files) every v_stride iterations
+        vtk -- visuals vtk files, 'now' (written as solved), 'defer' (network snapshots pickled to disk for
+            export_vtk, see stim_vtk), 'series' (steps of ParaView time series fname_nodes.pvd, etc., with
+            geometry encoded once), or 'off'
+        maxit -- maximum stimulation iterations (pressure steps)
         """
 
         print('*** dynamic stim module ***')
@@ -3742,11 +5185,10 @@ class Mesh:
         i_key = np.asarray(i_key, dtype=int)
         p_key = np.asarray(p_key, dtype=int)
 
-        # initialize targets for stimulation
-        if not target:
+        # initialize targets for stimulation (0 or empty for all injectors; well 0 can be listed explicitly)
+        if (np.size(target) == 0) or ((np.ndim(target) == 0) and (target == 0)):
             target = i_key
-        else:
-            pass
+        target = np.atleast_1d(np.asarray(target, dtype=int))
 
         # looping variables
         vol_ini = 0.0  # m3
@@ -3766,37 +5208,87 @@ class Mesh:
         #     hydrofrac[i] = self.wells[i_key[i]].hydrofrac
 
         # if target is specified
-        if target.any():
+        if len(target) > 0:
             for i in range(0, i_div):
                 # match targets to i_key
                 if not (i_key[i] in list(target)):
                     completed[i] = True
 
-        # initial fracture parameters and network volume
-        self.re_init()
-        for i in range(0, len(self.faces)):
-            # correct for critically weak fractures
-            self.faces[i].check_integrity(rock=self.rock, pres=(self.rock.BH_P + 0.5 * self.rock.dPi))
-            # time variable properties
-            self.faces[i].Pmax = bhp
-            self.faces[i].Pcen = bhp
-            # self.GR_bh(i)
-            self.hydromech(i)
-            if typ(self.faces[i].typ) != 'boundary':
-                vol_ini += (4.0 / 3.0) * pi * 0.25 * self.faces[i].dia ** 2.0 * 0.5 * self.faces[i].bd
-        vol_old = vol_ini
-
         # stimulation loop
-        if visuals:
-            Rs = []
-            ts = []
-            Ps = []
-            ws = []
-            Vs = []
-            Pn = []
+        if vtk not in ['now', 'defer', 'series', 'off']:
+            print('warning: vtk = %s not recognized, using now' % (vtk))
+            vtk = 'now'
+        if not (visuals):
+            vtk = 'off'
+        # pressure schedule
+        if psearch not in ['step', 'bisect']:
+            print('warning: psearch = %s not recognized, using step' % (psearch))
+            psearch = 'step'
+        quiet = 0  # consecutive pressure increases without stimulation
+        probes = 0  # trial flow solves used by the pressure search
 
         iters = 0
-        maxit = 40
+        s_state = None
+
+        # ****** resume from a saved stimulation state ******
+        sck = restart
+        if isinstance(restart, str):
+            with open(restart, 'rb') as f:
+                sck = pickle.load(f)
+        elif restart is not None:
+            # work on a copy so the same state can be resumed again
+            sck = pickle.loads(pickle.dumps(restart))
+        if (sck is not None) and (len(sck['dpi']) != i_div):
+            print('error: checkpoint has %i injectors but the model has %i so stimulating from the start'
+                  % (len(sck['dpi']), i_div))
+            sck = None
+        if sck is not None:
+            if (sck['Vinj'] != Vinj) or (sck['Qinj'] != Qinj):
+                print('note: resuming with Vinj = %.1e m3 and Qinj = %.3e m3/s from the checkpoint'
+                      % (sck['Vinj'], sck['Qinj']))
+            Vinj = sck['Vinj']
+            Qinj = sck['Qinj']
+            psearch = sck['psearch']
+            # fractures (with apertures, proppant, rupture area, and magnitudes) and wells (with hydrofrac flags)
+            self.bound = sck['bound']
+            self.fracs = sck['fracs']
+            self.hydfs = sck['hydfs']
+            self.wells = sck['wells']
+            self.re_init()
+            self.rng.bit_generator.state = sck['rng']
+            # looping variables
+            iters = sck['iters']
+            quiet = sck['quiet']
+            probes = sck['probes']
+            vol_old = sck['vol_old']
+            vol_rem = np.copy(sck['vol_rem'])
+            completed = np.copy(sck['completed'])
+            tip = np.copy(sck['tip'])
+            dpi = np.copy(sck['dpi'])
+            Pis = list(sck['Pis'])
+            Qis = list(sck['Qis'])
+            self.v_series = sck.get('series', {})
+            print('-> resuming stimulation after iteration %i' % (iters))
+        else:
+            # initial fracture parameters and network volume
+            self.re_init()
+            for i in range(0, len(self.faces)):
+                # correct for critically weak fractures
+                self.faces[i].check_integrity(rock=self.rock, pres=(self.rock.BH_P + 0.5 * self.rock.dPi))
+                # time variable properties
+                self.faces[i].Pmax = bhp
+                self.faces[i].Pcen = bhp
+                # self.GR_bh(i)
+                self.hydromech(i)
+            vol_ini = self.net_volume()[0]
+            vol_old = vol_ini
+
+        # history of fracture radius, aperture, volume, center pressure, and injector time steps and pressures
+        # ... sized from the (restored) fractures, and hydraulic fractures can add perfs faces per injector
+        nf = len(self.bound) + len(self.fracs) + len(self.hydfs) + i_div * perfs
+        rec = Recorder(np.max([maxit - iters, 0]), {'R': nf, 'w': nf, 'V': nf, 'P': nf, 't': i_div, 'Pi': i_div},
+                       stride=v_stride)
+
         while 1:
             # loop breaker
             if iters >= maxit:
@@ -3837,9 +5329,8 @@ class Mesh:
             Qis += [Qi]
 
             # create vtk
-            if visuals:
-                fname2 = f'{fname}_A_{iters}'
-                self.build_vtk(fname2, vtype=[0, 0, 1, 1, 1, 0])
+            if (rec.calls % rec.stride) == 0:
+                self.stim_vtk(f'{fname}_A_{iters}', [0, 0, 1, 1, 1, 0], vtk, fname)
 
             # stimulation complete if pressure driven injection rate exceeds stimulation injection rate in all wells
             # i_q, p_q, b_q are + for flow into the frac network
@@ -3854,61 +5345,25 @@ class Mesh:
                 break
 
             # get max pressure on each fracture from all the nodes associated with that fracture
-            face_pmax = np.ones(len(self.faces), dtype=float) * bhp
-            for i in range(0, self.pipes.num):
-                if (int(self.pipes.typ[i]) in [typ('boundary'), typ('fracture'), typ('propped'),
-                                               typ('choke')]):  # don't confuse well ID with face ID
-                    face_pmax[self.pipes.fID[i]] = np.max(
-                        [face_pmax[self.pipes.fID[i]], self.nodes.p[self.pipes.n0[i]], self.nodes.p[self.pipes.n1[i]]])
-            # update fracture properties; stimulate fractures; grow fractures; calculate new fracture volume
-            if visuals:
-                R = []
-                w = []
-                V = []
-                P = []
+            face_pmax = self.get_pmax(bhp)
+            # update fracture properties; stimulate fractures; grow fractures
+            face_pcen = self.nodes.p[np.asarray([f.ci for f in self.faces], dtype=int)]
             nat_stim = False
-            vol_new = 0.0
-            num_stim = 0
             for i in range(0, len(self.faces)):
                 # record maximum and center node pressures
                 self.faces[i].Pmax = face_pmax[i]
-                self.faces[i].Pcen = self.nodes.p[self.faces[i].ci]
+                self.faces[i].Pcen = face_pcen[i]
                 # compute fracture properties, if stimulated acknowledge it
                 # nat_stim += self.GR_bh(i)
                 nat_stim += self.hydromech(i)
-                # calculate new fracture volume
-                if typ(self.faces[i].typ) != 'boundary':
-                    vol_new += (4.0 / 3.0) * pi * 0.25 * self.faces[i].dia ** 2.0 * 0.5 * self.faces[i].bd
-                # get maximum number of stimulations
-                num_stim = np.max([self.faces[i].stim, num_stim])
-
-                # #identify if fracture is hydroprop
-                # if self.faces[i].hydroprop:
-                #     #hydrofrac = True
-                #     for j in range(0,i_div):
-                #         #only record for intervals that are hydropropped
-                #         if not(completed[j]):
-                #             hydrofrac[j] = True
-                #             self.wells[i_key[j]].hydrofrac = True
-
-                # variable tracking for visuals
-                if visuals:
-                    R += [0.5 * self.faces[i].dia]
-                    w += [self.faces[i].bd]
-                    V += [(4.0 / 3.0) * pi * 0.25 * self.faces[i].dia ** 2.0 * 0.5 * self.faces[i].bd]
-                    P += [self.faces[i].Pcen]
 
-            if visuals:
-                Rs += [R]
-                ws += [w]
-                Vs += [V]
-                Pn += [P]
+            # calculate new fracture volume and maximum number of stimulations
+            vol_new, R, w, V = self.net_volume()
+            num_stim = np.max([f.stim for f in self.faces] + [0])
 
             # remaining injection volume for stimulation accounting for leakoff volume
-            if visuals:
-                t = []
-                P = []
-
+            t = np.full(i_div, np.nan)
+            rise = np.zeros(i_div, dtype=bool)
             for i in range(0, i_div):
                 # only modify stimulations if stage is not yet completed
                 if not (completed[i]):
@@ -3945,23 +5400,102 @@ class Mesh:
                     # increase pressure
                     elif ((nat_stim == False) or (((int(num_stim) + 1) % int(self.rock.stim_limit)) == 0)):
                         dpi[i] += self.rock.dPi
+                        rise[i] = True
                         print('   + (%i) pressure increased to %.3f, %.3f absolute' % (
                             i, self.rock.s3 + dpi[i], tip[i] + dpi[i]))
-                    if visuals:
-                        t += [time_step]
-                        P += [tip[i]]
+                    t[i] = time_step
+
+            # count quiet pressure increases
+            if rise.any() and not (nat_stim):
+                quiet += 1
+            else:
+                quiet = 0
+
+            # search ahead for the next stimulation pressure once the network has gone quiet
+            # ... k counts dPi steps beyond the current trial pressure (k = 1 is the pressure just set)
+            # ... skipped steps count against maxit so the pressure ceiling matches the step schedule
+            kmax = maxit - iters
+            if (psearch == 'bisect') and (quiet >= 2) and (kmax > 1) and (np.sum(rise) == np.sum(~completed)):
+
+                # test for stimulation, full flow, or hydraulic fracturing at step k
+                def stim_event(k):
+                    p_well = np.full(len(self.wells), None)
+                    for i in range(0, i_div):
+                        if completed[i]:
+                            p_well[i_key[i]] = bhp
+                        else:
+                            p_well[i_key[i]] = self.rock.s3 + dpi[i] + (k - 1) * self.rock.dPi
+                            # hydraulic fractures are seeded at this pressure
+                            if (self.wells[i_key[i]].hydrofrac == False) and (
+                                    p_well[i_key[i]] > (self.rock.s3 + self.rock.hfmcc)):
+                                return True
+                    for i in range(0, p_div):
+                        p_well[p_key[i]] = pwp
+                    return self.stim_probe(bhp, p_well, np.full(len(self.wells), None), Qinj, i_key)
+
+                # bracket with growing steps
+                lo = 0
+                hi = -1
+                step = 2
+                while hi < 0:
+                    if lo >= kmax:
+                        hi = kmax
+                        break
+                    k = np.min([lo + step, kmax])
+                    probes += 1
+                    if stim_event(k):
+                        hi = k
+                    else:
+                        lo = k
+                        step = 2 * step
+                # bisect down to dPi resolution
+                while (hi - lo) > 1:
+                    k = (lo + hi) // 2
+                    probes += 1
+                    if stim_event(k):
+                        hi = k
+                    else:
+                        lo = k
+
+                # jump to the first step that stimulates (or the last quiet step if none was found)
+                if hi > 1:
+                    dpi[~completed] += (hi - 1) * self.rock.dPi
+                    iters += hi - 1
+                    print('   >> pressure search jumped %i steps to %.3f (%i trial solves)' % (
+                        hi - 1, self.rock.s3 + np.max(dpi[~completed]), probes))
 
             # update fracture network volume
             vol_old = vol_new
 
             # visuals
             if visuals:
-                ts += [t]
-                Ps += [P]
+                rec.add(R=R, w=w, V=V, P=face_pcen, t=t, Pi=np.where(np.isnan(t), np.nan, tip))
+
+            # stimulation state for resuming, live fractures and wells (not changed by a partial iteration) with
+            # copies of the loop variables, serialized only for a checkpoint file and otherwise once at exit
+            s_state = {'fname': fname, 'Vinj': Vinj, 'Qinj': Qinj, 'psearch': psearch,
+                       'bound': self.bound, 'fracs': self.fracs, 'hydfs': self.hydfs, 'wells': self.wells,
+                       'rng': self.rng.bit_generator.state, 'iters': iters, 'quiet': quiet, 'probes': probes,
+                       'vol_old': vol_old, 'vol_rem': np.copy(vol_rem), 'completed': np.copy(completed),
+                       'tip': np.copy(tip), 'dpi': np.copy(dpi), 'Pis': list(Pis), 'Qis': list(Qis),
+                       'series': self.v_series}
+            if checkpoint:
+                # write then rename so an interrupted save keeps the previous checkpoint
+                with open(checkpoint + '.tmp', 'wb') as f:
+                    pickle.dump(s_state, f)
+                os.replace(checkpoint + '.tmp', checkpoint)
+
+        # detached copy of the state after the last completed iteration
+        if s_state is not None:
+            self.s_state = pickle.loads(pickle.dumps(s_state))
 
         # @@@
         print('\n[B] Final flow solve')
 
+        # ***** network from the current fractures if resumed without a stimulation flow solve (e.g., par_stim)
+        if self.pipes.num == 0:
+            self.gen_pipes()
+
         # ***** reset pressures and fracture geometry
         for i in range(0, len(self.faces)):
             self.faces[i].Pmax = bhp
@@ -3987,17 +5521,10 @@ class Mesh:
 
         # solve flow
         self.get_flow(p_bound=bhp, p_well=p_well, q_well=q_well, reinit=False, Qnom=Qinj)
-        if visuals:
-            fname2 = fname + '_B1'
-            self.build_vtk(fname2, vtype=[0, 0, 1, 1, 1, 0])
+        self.stim_vtk(fname + '_B1', [0, 0, 1, 1, 1, 0], vtk, fname)
 
-            # get max pressure on each fracture from all the nodes associated with that fracture
-        face_pmax = np.ones(len(self.faces), dtype=float) * bhp
-        for i in range(0, self.pipes.num):
-            if (int(self.pipes.typ[i]) in [typ('boundary'), typ('fracture'), typ('propped'),
-                                           typ('choke')]):  # don't confuse well ID with face ID
-                face_pmax[self.pipes.fID[i]] = np.max(
-                    [face_pmax[self.pipes.fID[i]], self.nodes.p[self.pipes.n0[i]], self.nodes.p[self.pipes.n1[i]]])
+        # get max pressure on each fracture from all the nodes associated with that fracture
+        face_pmax = self.get_pmax(bhp)
         # update fracture properties without stimualtion
         for i in range(0, len(self.faces)):
             # record maximum and center node pressures
@@ -4011,8 +5538,9 @@ class Mesh:
         # ... if any fractures connected to the injector are hydropropped, stabilization is required
         # search by pipes (chokes give fracture id, connectors give well id)
         for j in range(0, self.pipes.num):
-            # find the choke elements
-            if self.pipes.typ[j] == typ('choke'):
+            # find the choke elements (that follow a well segment)
+            if (self.pipes.typ[j] == typ('choke')) and (
+                    int(self.pipes.typ[j - 1]) in [typ('injector'), typ('producer')]):
                 # get the well information
                 fID = self.pipes.fID[j]
                 wID = self.pipes.fID[j - 1]
@@ -4061,16 +5589,17 @@ class Mesh:
         # final visualization
         # Qis = np.asarray(Qis)
         # Pis = np.asarray(Pis)
+        # create vtk with final flow data
+        self.stim_vtk(f'{fname}_B2', [1, 1, 1, 1, 1, 1], vtk, fname)
         if visuals:
-            # create vtk with final flow data
-            fname2 = f'{fname}_B2'
-            self.build_vtk(fname2)
-            self.v_Rs = Rs
-            self.v_ts = ts
-            self.v_Ps = Ps
-            self.v_ws = ws
-            self.v_Vs = Vs
-            self.v_Pn = Pn
+            # histories trimmed to the final fracture count
+            nf = len(self.faces)
+            self.v_Rs = rec.get('R', nf)
+            self.v_ts = rec.get('t')
+            self.v_Ps = rec.get('Pi')
+            self.v_ws = rec.get('w', nf)
+            self.v_Vs = rec.get('V', nf)
+            self.v_Pn = rec.get('P', nf)
 
     # ************************************************************************
     # stimulation & flow
@@ -4079,7 +5608,14 @@ class Mesh:
                       Vinj=-1.0, Qinj=-1.0, dpp=-666.6 * MPa,
                       sand=-1.0, leakoff=-1.0,
                       target=0, perfs=-1, r_perf=-1.0,
-                      clear=True, visuals=True, fname='stim'):
+                      clear=True, visuals=True, fname='stim', psearch='step',
+                      checkpoint='', restart=None):
+        """
+        stimulation followed by production with dyn_stim
+        - checkpoint: file name to pickle the stimulation state after every iteration of either phase
+        - restart: stimulation state (self.s_state or a checkpoint file) to resume from; production-phase states
+          skip the stimulation phase
+        """
         # fetch defaults
         if perfs < 0:
             perfs = self.rock.perf
@@ -4100,13 +5636,29 @@ class Mesh:
         if Qstim < 0:
             Qstim = self.rock.Qstim
 
+        # phase of the resumed state
+        sck = restart
+        if isinstance(restart, str):
+            with open(restart, 'rb') as f:
+                sck = pickle.load(f)
+        r_stim = None
+        r_prod = None
+        if sck is not None:
+            if sck['fname'] == (fname + '_prod'):
+                r_prod = sck
+            else:
+                r_stim = sck
+
         # Solve stimulation
-        self.dyn_stim(Vinj=Vstim, Qinj=Qstim, target=target,
-                      visuals=visuals, fname=(fname + '_stim'))
+        if r_prod is None:
+            self.dyn_stim(Vinj=Vstim, Qinj=Qstim, target=target,
+                          visuals=visuals, fname=(fname + '_stim'), psearch=psearch,
+                          checkpoint=checkpoint, restart=r_stim)
 
         # Solve production
         self.dyn_stim(Vinj=Vinj, Qinj=Qinj, target=target,
-                      visuals=visuals, fname=(fname + '_prod'))
+                      visuals=visuals, fname=(fname + '_prod'), psearch=psearch,
+                      checkpoint=checkpoint, restart=r_prod)
 
     # ************************************************************************
     # stimulation & flow
@@ -4141,6 +5693,7 @@ class Mesh:
     # ************************************************************************
     def detournay_visc(self, Q0=0.08):
         # plot initialization
+        import pylab
         fig = pylab.figure(figsize=(15.0, 8.5), dpi=96, facecolor='w', edgecolor='k',
                            tight_layout=True)  # Medium resolution
         font = {'family': 'serif', 'size': 16}
@@ -4269,13 +5822,14 @@ class Mesh:
                       # $/Mw for $300M Mw 5.5 quake Pohang (Westaway, 2021) & $17.2B Mw 6.3 quake Christchurch (Swiss Re)
                       detail=False,  # print cycle infomation
                       plots=False):  # plot results
-        # eliminate periods of negative net power production
-        Pout_NN = self.Pout + 0.0
-        Pout_NN[Pout_NN < 0.0] = 0.0
-        NPsum = np.sum(Pout_NN)
         # get system values
         dt = (self.ts[1] - self.ts[0]) / yr
         life = self.rock.LifeSpan / yr
+        # series truncated by an early stop are valued over their own span
+        if self.ts[-1] < self.rock.LifeSpan * (1.0 - 1.0e-9):
+            life = self.ts[-1] / yr
+            if detail:
+                print('note: economics over a truncated life of %.3f yr' % (life))
         depth = self.rock.ResDepth
         lateral = (self.rock.w_length * self.rock.w_count) + (self.rock.w_proportion * self.rock.w_length)
         drill_len = self.rock.ResDepth * (self.rock.w_count + 1) + lateral
@@ -4283,21 +5837,13 @@ class Mesh:
         for i in range(0, len(self.faces)):
             if self.faces[i].Mws:
                 Max_Quake = np.max([Max_Quake, np.max(self.faces[i].Mws)])
-        # NPsum = np.sum(self.Pout[:])
-        # power profit
-        P = (sales_kWh - oper_kWh) * NPsum * dt * 24.0 * 365.2425
-        # capital costs
-        C = 0.0
-        C += drill_m * drill_len
-        C += pad_fixed
-        C += plant_kWe * NPsum * dt / life
-        C += explore_m * depth
-        # quake cost
-        Q = quake_coef * np.exp(Max_Quake * quake_exp)
-        # net present value
-        NPV = P - C - Q
+        # shared objective function
+        NPV, P, C, Q = economics(self.Pout, dt, life, depth, drill_len, Max_Quake,
+                                 interest, sales_kWh, drill_m, pad_fixed, plant_kWe, explore_m, oper_kWh,
+                                 quake_coef, quake_exp)
         # detail
         if detail:
+            NPsum = np.sum(np.maximum(np.asarray(self.Pout), 0.0))
             print('\n*** economics module ***')
             print('   sales: $%.0f (%.2f kWh)' % (P, NPsum * dt * 24.0 * 365.2425))
             print('   capital: $%.0f (%.2f m drilled length)' % (C, drill_len))
@@ -4312,6 +5858,7 @@ class Mesh:
 #### main program
 # ****************************************************************************
 if __name__ == '__main__':  # main program
+    import pylab
     # create mesh object (the model)
     #    mnode = []
     #    mpipe = []
@@ -1,7 +1,11 @@
 """
 Classes and routines for generating 3D objects
 """
+import base64
 import math
+import os
+import sys
+import zlib
 import numpy as np
 from scipy.spatial import ConvexHull
 from copy import deepcopy
@@ -83,68 +87,239 @@ def writeObjectsStlFile(objects, stlFile, name="stlObject"):
     fd.write("endsolid\n");
 
 
+# VTK cell type by number of vertices per cell: vertex, line, triangle
+vtkCellTypes = {1: 1, 2: 3, 3: 5}
+
+
+def objectArrays(objectList, scalars):
+    """
+    Stack a list of (points, simplices) objects into contiguous arrays
+    - returns points (N, 3), cells (M, k) with shifted indices, and one (M,) array per object scalar
+    """
+    nPtsObj = np.asarray([len(pts) for pts, simps in objectList], dtype=int)
+    nTriObj = np.asarray([len(simps) for pts, simps in objectList], dtype=int)
+    if np.sum(nTriObj) == 0:
+        return np.zeros((int(np.sum(nPtsObj)), 3)), np.zeros((0, 3), dtype=np.int64), \
+            [np.zeros(0) for colorList in scalars]
+    points = np.concatenate([np.asarray(pts, dtype=float).reshape(-1, 3) for pts, simps in objectList])
+    cells = np.concatenate([np.asarray(simps, dtype=np.int64) for pts, simps in objectList if len(simps) > 0])
+    cells = cells.reshape(len(cells), -1) + np.repeat(np.cumsum(nPtsObj) - nPtsObj, nTriObj)[:, None]
+    owner = np.repeat(np.arange(len(objectList)), nTriObj)
+    return points, cells, [np.asarray(colorList, dtype=float)[owner] for colorList in scalars]
+
+
 def writeVtk(objectList, scalars, scalarNames, vtkFile, name="vtkObjects"):
-    fd = open(vtkFile, 'w')
+    points, cells, cellScalars = objectArrays(objectList, scalars)
+    writeVtkArrays(points, cells, cellScalars, scalarNames, vtkFile, name)
 
-    nPtsObj = []
-    nPts = 0
-    nTri = 0
-    nObj = len(objectList)
-    for pts, simps in (objectList):
-        nPtsObj.append(len(pts))
-        nPts += len(pts)
-        nTri += len(simps)
-    nShift = [0] * nObj
-    for iShift in range(nObj - 1):
-        nShift[iShift + 1] = nShift[iShift] + nPtsObj[iShift]
 
+def writeVtkArrays(points, cells, cellScalars, scalarNames, vtkFile, name="vtkObjects"):
+    """
+    Legacy ascii vtk unstructured grid from stacked arrays, formatted in bulk
+    """
+    nPts = len(points)
+    nTri, nVer = np.shape(cells)
+    fd = open(vtkFile, 'w')
     fd.write("# vtk DataFile Version 2.0\n")
     fd.write("%s\n" % (name))
     fd.write("ASCII\n")
     fd.write("DATASET UNSTRUCTURED_GRID\n")
     fd.write("POINTS %d float\n" % (nPts))
-    for pts, simps in (objectList):
-        for pt in (pts):
-            fd.write("%g %g %g\n" % (pt[0], pt[1], pt[2]))
-
-    fd.write("CELLS %d %d\n" % (nTri, (1 + 3) * nTri))
-    iObj = 0
-    # col=[]
-    for pts, simps in (objectList):
-        for tri in (simps):
-            fd.write("3 %d %d %d\n" % (tri[0] + nShift[iObj], tri[1] + nShift[iObj], tri[2] + nShift[iObj]))
-            # col.append(colorList[iObj])
-        iObj += 1
+    fd.write(("%g %g %g\n" * nPts) % tuple(np.ravel(points).tolist()))
+
+    fd.write("CELLS %d %d\n" % (nTri, (1 + nVer) * nTri))
+    fd.write(((("%d" % nVer) + " %d" * nVer + "\n") * nTri) % tuple(np.ravel(cells).tolist()))
 
+    # http://www.vtk.org/wp-content/uploads/2015/04/file-formats.pdf (see Fig. 2)
     fd.write("CELL_TYPES %d\n" % (nTri))
-    for i in range(nTri):
-        fd.write("5 ")  # http://www.vtk.org/wp-content/uploads/2015/04/file-formats.pdf (see Fig. 2)
-        if (i % 10 == 9):
-            fd.write("\n")
+    typ = "%d " % (vtkCellTypes[nVer])
+    fd.write((typ * 9 + typ + "\n") * (nTri // 10) + typ * (nTri % 10))
     fd.write("\n")
 
     fd.write("CELL_DATA %d\n" % (nTri))
 
     # Repeat as many of these as you want to define data on the tris
-    # for colorList, scalarName in scalars,scalarNames:
-    for iCol in range(len(scalars)):
-        colorList = scalars[iCol];
-        scalarName = scalarNames[iCol]
-        fd.write("SCALARS " + scalarName + " float 1\n")
+    for iCol in range(len(cellScalars)):
+        fd.write("SCALARS " + scalarNames[iCol] + " float 1\n")
         fd.write("LOOKUP_TABLE default\n")
-        iObj = 0
-        i = 0
-        for pts, simps in (objectList):
-            for tri in (simps):
-                fd.write("%g " % (colorList[iObj]));
-                i += 1
-                if (i % 10 == 9):
-                    fd.write("\n")
-            iObj += 1
+        # line break after the 9th, 19th, ... value
+        fmt = ["%g "] * nTri
+        fmt[8::10] = ["%g \n"] * len(fmt[8::10])
+        fd.write("".join(fmt) % tuple(cellScalars[iCol].tolist()))
     fd.write("\n")
     fd.close()
 
 
+# Uncompressed size of zlib blocks in vtk xml appended data
+xmlBlockSize = 2 ** 15
+
+
+def xmlBlock(array, encoding='raw', compress=False):
+    """
+    Appended data for one array: a UInt64 byte count (or zlib block table) followed by the bytes
+    """
+    data = np.ascontiguousarray(array).tobytes()
+    if compress:
+        blocks = [zlib.compress(data[i:i + xmlBlockSize]) for i in range(0, len(data), xmlBlockSize)]
+        last = len(data) - (len(blocks) - 1) * xmlBlockSize if blocks else 0
+        header = np.asarray([len(blocks), xmlBlockSize, last] + [len(b) for b in blocks], dtype=np.uint64).tobytes()
+        if encoding == 'base64':
+            # compressed header and blocks are encoded separately
+            return base64.b64encode(header) + base64.b64encode(b''.join(blocks))
+        return header + b''.join(blocks)
+    header = np.asarray([len(data)], dtype=np.uint64).tobytes()
+    if encoding == 'base64':
+        return base64.b64encode(header + data)
+    return header + data
+
+
+def xmlType(array):
+    """
+    VTK xml type name of a numpy array
+    """
+    kind = {'f': 'Float', 'i': 'Int', 'u': 'UInt'}[array.dtype.kind]
+    return '%s%d' % (kind, 8 * array.dtype.itemsize)
+
+
+def writeVtkXml(objectList, scalars, scalarNames, vtkFile, encoding='raw', compress=False):
+    """
+    VTK xml unstructured grid (.vtu) or polydata (.vtp, by extension) with binary appended data
+    - encoding is 'raw' or 'base64', compress applies zlib
+    """
+    points, cells, cellScalars = objectArrays(objectList, scalars)
+    writeXmlArrays(points, cells, cellScalars, scalarNames, vtkFile, encoding, compress)
+
+
+def writeXmlArrays(points, cells, cellScalars, scalarNames, vtkFile, encoding='raw', compress=False, cache=None):
+    """
+    VTK xml file from stacked arrays, see writeVtkXml
+    - cache: dict keeping the encoded geometry blocks to reuse while the points and cells are unchanged
+    """
+    nTri, nVer = np.shape(cells)
+    poly = vtkFile.endswith('.vtp')
+    arrays = []
+    offset = [0]
+
+    def dataArray(array, attrs, key=None):
+        # queue the appended block and return its xml tag
+        if (cache is not None) and (key in cache) and np.array_equal(cache[key][0], array):
+            block = cache[key][1]
+        else:
+            block = xmlBlock(array, encoding, compress)
+            if (cache is not None) and (key is not None):
+                cache[key] = (np.copy(array), block)
+        arrays.append(block)
+        tag = '<DataArray type="%s" %sformat="appended" offset="%d"/>' % (xmlType(array), attrs, offset[0])
+        offset[0] += len(block)
+        return tag
+
+    conn = dataArray(np.ravel(cells).astype(np.int64), 'Name="connectivity" ', 'connectivity')
+    offs = dataArray(nVer * np.arange(1, nTri + 1, dtype=np.int64), 'Name="offsets" ', 'offsets')
+    pts = dataArray(np.asarray(points, dtype=np.float64), 'NumberOfComponents="3" ', 'points')
+    cols = [dataArray(np.asarray(cellScalars[i], dtype=np.float64), 'Name="%s" ' % (scalarNames[i]))
+            for i in range(len(cellScalars))]
+    if poly:
+        kind = 'PolyData'
+        section = {1: 'Verts', 2: 'Lines'}.get(nVer, 'Polys')
+        counts = ''.join(' NumberOf%s="%d"' % (sec, nTri if sec == section else 0)
+                         for sec in ['Verts', 'Lines', 'Strips', 'Polys'])
+        topology = ['<%s>' % (section), conn, offs, '</%s>' % (section)]
+    else:
+        kind = 'UnstructuredGrid'
+        counts = ' NumberOfCells="%d"' % (nTri)
+        types = dataArray(np.full(nTri, vtkCellTypes[nVer], dtype=np.uint8), 'Name="types" ', 'types')
+        topology = ['<Cells>', conn, offs, types, '</Cells>']
+
+    order = 'LittleEndian' if sys.byteorder == 'little' else 'BigEndian'
+    comp = ' compressor="vtkZLibDataCompressor"' if compress else ''
+    lines = ['<?xml version="1.0"?>',
+             '<VTKFile type="%s" version="1.0" byte_order="%s" header_type="UInt64"%s>' % (kind, order, comp),
+             '<%s>' % (kind),
+             '<Piece NumberOfPoints="%d"%s>' % (len(points), counts),
+             '<Points>', pts, '</Points>'] + topology
+    if cols:
+        lines += ['<CellData Scalars="%s">' % (scalarNames[0])] + cols + ['</CellData>']
+    lines += ['</Piece>', '</%s>' % (kind), '<AppendedData encoding="%s">' % (encoding)]
+    fd = open(vtkFile, 'wb')
+    fd.write(('\n'.join(lines) + '\n_').encode())
+    for block in arrays:
+        fd.write(block)
+    fd.write(b'\n</AppendedData>\n</VTKFile>\n')
+    fd.close()
+
+
+def writeObjects(objectList, scalars, scalarNames, fname, fmt='vtk', encoding='raw', compress=False):
+    """
+    Write objects to fname with the extension of fmt: legacy ascii 'vtk' or xml 'vtu' and 'vtp'
+    """
+    points, cells, cellScalars = objectArrays(objectList, scalars)
+    return writeArrays(points, cells, cellScalars, scalarNames, fname, fmt, encoding, compress)
+
+
+def writeArrays(points, cells, scalars, scalarNames, fname, fmt='vtk', encoding='raw', compress=False, cache=None):
+    """
+    Write points (N, 3) and cells (M, k) with one scalar per cell, see writeObjects
+    - cells of one index are vertices, two are lines, and three are triangles
+    - cache: encoded geometry blocks to reuse between xml files (see writeXmlArrays)
+    """
+    vtkFile = '%s.%s' % (fname, fmt)
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    cells = np.asarray(cells, dtype=np.int64)
+    if cells.ndim == 1:
+        cells = cells[:, None]
+    cellScalars = [np.asarray(colorList, dtype=float) for colorList in scalars]
+    if fmt == 'vtk':
+        writeVtkArrays(points, cells, cellScalars, scalarNames, vtkFile)
+    elif fmt in ['vtu', 'vtp']:
+        writeXmlArrays(points, cells, cellScalars, scalarNames, vtkFile, encoding, compress, cache)
+    else:
+        print('error: vtk format %s not recognized' % (fmt))
+    return vtkFile
+
+
+class VtkSeries:
+    """
+    Time series of one vtk dataset for ParaView, streamed as it is solved
+    - each step is a binary .vtu piece listed in a .pvd collection that is rewritten after every step, so the
+      series can be opened while the solver is still running
+    - geometry blocks are encoded once and reused while the points and cells are unchanged
+    """
+
+    def __init__(self, fname, encoding='raw', compress=False):
+        self.fname = fname
+        self.encoding = encoding
+        self.compress = compress
+        self.steps = []  # (time, piece file name)
+        self.cache = {}
+
+    def __getstate__(self):
+        # pickles (checkpoints) keep the step list but not the encoded geometry
+        state = dict(self.__dict__)
+        state['cache'] = {}
+        return state
+
+    def add(self, points, cells, scalars, scalarNames, t=None):
+        """
+        Write one step (see writeArrays), at time t or the step number if None
+        """
+        if t is None:
+            t = len(self.steps)
+        piece = writeArrays(points, cells, scalars, scalarNames, '%s_%04d' % (self.fname, len(self.steps)), 'vtu',
+                            self.encoding, self.compress, self.cache)
+        self.steps += [(t, piece)]
+        order = 'LittleEndian' if sys.byteorder == 'little' else 'BigEndian'
+        lines = ['<?xml version="1.0"?>',
+                 '<VTKFile type="Collection" version="0.1" byte_order="%s">' % (order),
+                 '<Collection>']
+        lines += ['<DataSet timestep="%.12g" group="" part="0" file="%s"/>' % (ti, os.path.basename(pi))
+                  for ti, pi in self.steps]
+        lines += ['</Collection>', '</VTKFile>']
+        fd = open(self.fname + '.pvd', 'w')
+        fd.write('\n'.join(lines) + '\n')
+        fd.close()
+        return piece
+
+
 def simplicesFromPoints(points):
     hull = ConvexHull(points)
     return hull.simplices
@@ -206,15 +381,8 @@ unitWedge = convexFromPoints(unitWedgePts)
 
 
 def diskObj(r, h, n=50):
-    dTh = 2 * math.pi / n
-    pts = []
-    for i in range(n):
-        x = r * math.cos(i * dTh);
-        y = r * math.sin(i * dTh)
-        pts.append([x, y, -0.5 * h])
-        pts.append([x, y, 0.5 * h])
-    pts = np.asarray(pts)
-    return convexFromPoints(pts)
+    pts, simps = diskTemplate(n)
+    return (pts * np.asarray([r, r, h]), simps)
 
 
 # From: https://en.wikipedia.org/wiki/Regular_dodecahedron
@@ -230,15 +398,9 @@ radiusOneSphereObj = convexFromPoints(radiusOneSpherePts)
 
 
 def cylObj(x0, x1, r, n=10, lengthSum=None):
-    sphere0 = (r * radiusOneSpherePts)
-    sphere0[:, 0] += x0[0];
-    sphere0[:, 1] += x0[1];
-    sphere0[:, 2] += x0[2];
-    sphere1 = (r * radiusOneSpherePts)
-    sphere1[:, 0] += x1[0];
-    sphere1[:, 1] += x1[1];
-    sphere1[:, 2] += x1[2];
-    pts = np.vstack((sphere0, sphere1))
+    x0 = np.asarray(x0, dtype=float)
+    x1 = np.asarray(x1, dtype=float)
+    pts, simps = cylObjs([x0], [x1], r)
     # print lengthSum
     # if (lengthSum != None):
     try:
@@ -246,7 +408,130 @@ def cylObj(x0, x1, r, n=10, lengthSum=None):
     except:
         pass
     # print lengthSum
-    return convexFromPoints(pts)
+    return (pts[0], simps)
+
+
+# Instanced objects: the hull of a template is computed once and reused for every copy, which
+# is valid because the face structure of a convex hull is unchanged by affine maps
+unitTemplates = {}
+
+
+def diskTemplate(n=50):
+    """
+    Unit disk template (r = 1, h = 1) with n segments, hulled on first use
+    """
+    key = ('disk', n)
+    if key not in unitTemplates:
+        dTh = 2 * math.pi / n
+        th = dTh * np.arange(n)
+        pts = np.zeros((2 * n, 3))
+        pts[:, 0] = np.repeat(np.cos(th), 2)
+        pts[:, 1] = np.repeat(np.sin(th), 2)
+        pts[:, 2] = np.tile([-0.5, 0.5], n)
+        unitTemplates[key] = convexFromPoints(pts)
+    return unitTemplates[key]
+
+
+def cylTemplate():
+    """
+    Dodecahedron-capped cylinder template with radius one caps at z = 0 and z = 1
+    - the hull only depends on the axis direction, so one template serves any length
+    """
+    key = ('cyl',)
+    if key not in unitTemplates:
+        pts = np.vstack((radiusOneSpherePts, radiusOneSpherePts + np.asarray([0.0, 0.0, 1.0])))
+        unitTemplates[key] = convexFromPoints(pts)
+    return unitTemplates[key]
+
+
+def rotationMatrices(axis, thetas):
+    """
+    Stack of rotation matrices (K, 3, 3) about one axis, vectorized form of rotationMatrix
+    """
+    axis = np.asarray(axis, dtype=float)
+    axis = axis / math.sqrt(np.dot(axis, axis))
+    thetas = np.atleast_1d(np.asarray(thetas, dtype=float))
+    a = np.cos(thetas / 2.0)
+    b, c, d = -axis[:, None] * np.sin(thetas / 2.0)
+    aa, bb, cc, dd = a * a, b * b, c * c, d * d
+    bc, ad, ac, ab, bd, cd = b * c, a * d, a * c, a * b, b * d, c * d
+    rot = np.asarray([[aa + bb - cc - dd, 2 * (bc + ad), 2 * (bd - ac)],
+                      [2 * (bc - ad), aa + cc - bb - dd, 2 * (cd + ab)],
+                      [2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc]])
+    return np.moveaxis(rot, -1, 0)
+
+
+def alignMatrices(vecs):
+    """
+    Stack of rotation matrices (K, 3, 3) taking the z-axis onto each of the vectors in vecs
+    - zero length vectors get the identity
+    """
+    vecs = np.asarray(vecs, dtype=float).reshape(-1, 3)
+    mag = np.linalg.norm(vecs, axis=1)
+    u = np.zeros(np.shape(vecs))
+    u[:, 2] = 1.0
+    live = mag > 0.0
+    u[live] = vecs[live] / mag[live][:, None]
+    # Rodrigues form with k = z x u and cos = u_z
+    k = np.zeros(np.shape(u))
+    k[:, 0] = -u[:, 1]
+    k[:, 1] = u[:, 0]
+    c = u[:, 2]
+    kx = np.zeros((len(u), 3, 3))
+    kx[:, 0, 2] = k[:, 1]
+    kx[:, 1, 2] = -k[:, 0]
+    kx[:, 2, 0] = -k[:, 1]
+    kx[:, 2, 1] = k[:, 0]
+    flip = c < -1.0 + 1e-12
+    s = np.zeros(len(u))
+    s[~flip] = 1.0 / (1.0 + c[~flip])
+    rot = np.eye(3) + kx + np.matmul(kx, kx) * s[:, None, None]
+    # antiparallel to z: half turn about x
+    rot[flip] = np.diag([1.0, -1.0, -1.0])
+    return rot
+
+
+def instanceObjs(pts, simps):
+    """
+    Split instanced points (K, P, 3) into a list of (points, simplices) objects sharing simplices
+    """
+    return [(pts[k], simps) for k in range(len(pts))]
+
+
+def cylObjs(x0s, x1s, r):
+    """
+    Capped cylinders from x0s to x1s (K, 3) of radius r (scalar or K) from the cached template
+    - caps are rotated with the axis rather than kept in the global orientation as in a direct hull
+    - returns points (K, 40, 3) and the shared simplices
+    """
+    pts, simps = cylTemplate()
+    x0s = np.asarray(x0s, dtype=float).reshape(-1, 3)
+    x1s = np.asarray(x1s, dtype=float).reshape(-1, 3)
+    r = np.broadcast_to(np.asarray(r, dtype=float), (len(x0s),))
+    rot = alignMatrices(x1s - x0s)
+    num = len(radiusOneSpherePts)
+    # cap offsets, then the sphere points scaled and rotated
+    out = np.repeat(x0s[:, None, :], 2 * num, axis=1)
+    out[:, num:, :] = x1s[:, None, :]
+    out += r[:, None, None] * np.einsum('kij,pj->kpi', rot, radiusOneSpherePts)[:, np.tile(np.arange(num), 2), :]
+    return out, simps
+
+
+def HFs(r, x0, strikeRad, dipRad, h=0.5, n=50):
+    """
+    Place radial hydraulic fractures of radii r (K) at x0 (K, 3) from the cached disk template
+    - returns points (K, 2n, 3) and the shared simplices
+    """
+    pts, simps = diskTemplate(n)
+    x0 = np.asarray(x0, dtype=float).reshape(-1, 3)
+    num = len(x0)
+    r = np.broadcast_to(np.asarray(r, dtype=float), (num,))
+    h = np.broadcast_to(np.asarray(h, dtype=float), (num,))
+    scale = np.stack((r, r, h), axis=1)
+    rot = np.matmul(rotationMatrices([0.0, 0.0, 1.0], -np.broadcast_to(strikeRad, (num,))),
+                    rotationMatrices([0.0, 1.0, 0.0], np.broadcast_to(dipRad, (num,))))
+    out = np.einsum('kij,kpj->kpi', rot, pts[None, :, :] * scale[:, None, :])
+    return out + x0[:, None, :], simps
 
 
 # Set up a unit arrow pointing in y-direction
@@ -367,9 +652,5 @@ def HF(r, x0, strikeRad, dipRad, h=0.5):
     """
     Place a radial hydraulic fracture of radius r at x0
     """
-    # start with a disk
-    disk = diskObj(r, h)
-    disk = rotateObj(disk, [0.0, 1.0, 0.0], dipRad)
-    disk = rotateObj(disk, [0.0, 0.0, 1.0], -strikeRad)
-    disk = transObj(disk, x0)
-    return disk
+    pts, simps = HFs([r], [x0], [strikeRad], [dipRad], h)
+    return (pts[0], simps)
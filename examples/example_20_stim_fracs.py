@@ -184,8 +184,8 @@ for i in range(0, 1):
     wells = []
     geom.gen_wells(True, wells)
 
-    # stimulate
-    geom.dyn_stim(
+    # stimulate (isolated well intervals in parallel)
+    geom.par_stim(
         Vinj=geom.rock.Vstim,
         Qinj=geom.rock.Qstim,
         target=[],
@@ -20,6 +20,10 @@ mD = gt.mD
 # ****************************************************************************
 #### model setup
 # ****************************************************************************
+#deferred plot data and file names
+plots = []
+plot_names = []
+
 #full randomizer
 for i in range(0,2500):
     #create model object
@@ -186,10 +190,10 @@ for i in range(0,2500):
             base.dyn_stim(Vinj=base.rock.Vinj,Qinj=base.rock.Qinj,target=[],
                           visuals=False,fname='run_%i' %(pin))
             
-            #calculate heat transfer
-            base.get_heat(plot=True)
-            plt.savefig('plt_%i.png' %(pin), format='png')
-            plt.close()
+            #calculate heat transfer (plot data kept for rendering after the batch)
+            base.get_heat(plot='defer')
+            plots += [base.h_plot]
+            plot_names += ['plt_%i.png' %(pin)]
         except:
             print( 'solver failure!')
             
@@ -203,5 +207,8 @@ for i in range(0,2500):
         x = base.save('inputs_results_random.txt',pin)
 
 
+#render deferred plots
+gt.plot_heat_batch(plots,plot_names)
+
 #show plots
 pylab.show()
\ No newline at end of file
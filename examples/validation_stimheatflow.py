@@ -159,5 +159,31 @@ if True: #3D temperature visual
 #save primary inputs and outputs
 x = geom.save('inputs_results_valid.txt',pin)
 
+# ****************************************************************************
+#### thermal response superposition vs time marching
+# ****************************************************************************
+#time marching (thermal radius) with coarse and fine steps
+h_march = np.copy(geom.p_hm)
+geom.get_heat(plot=False,t_n=32*geom.rock.TimeSteps)
+h_fine = np.copy(geom.p_hm[::32])
+#response function superposition
+geom.get_heat(plot=False,thermal='response')
+h_resp = np.copy(geom.p_hm)
+geom.get_heat(plot=False,thermal='response',convolve='fft')
+h_fft = np.copy(geom.p_hm)
+print('\n*** production enthalpy vs fine time marching (mean abs error, kJ/kg) ***')
+print('   marching: %.2f' %(np.mean(np.abs(h_march[:-1]-h_fine[:-1]))))
+print('   response: %.2f' %(np.mean(np.abs(h_resp[:-1]-h_fine[:-1]))))
+print('   response (fft) vs direct: %.2e' %(np.max(np.abs(h_fft-h_resp))))
+fig = pylab.figure(figsize=(8.0, 4.0), dpi=96, facecolor='w', edgecolor='k',tight_layout=True)
+ax1 = fig.add_subplot(111)
+ax1.plot(geom.ts[:-1]/yr,h_fine[:-1],linewidth=2.0,color='black',label='marching (fine)')
+ax1.plot(geom.ts[:-1]/yr,h_march[:-1],linewidth=1.0,color='red',label='marching')
+ax1.plot(geom.ts[:-1]/yr,h_resp[:-1],linewidth=1.0,color='blue',linestyle='--',label='response')
+ax1.set_xlabel('Time (yr)')
+ax1.set_ylabel('Production Enthalpy (kJ/kg)')
+ax1.legend(loc='upper right', prop={'size':8}, ncol=1, numpoints=1)
+plt.savefig('plt_response_%i.png' %(pin), format='png')
+
 #show plots
 pylab.show()
\ No newline at end of file
@@ -1,10 +1,13 @@
+import copy
 import unittest
 from pathlib import Path
 
 import numpy as np
 import pylab
 
-from GeoDT import Mesh
+from GeoDT import (Mesh, PropCache, ThermTable, enthalpy_fit, load_heat_stream, plot_heat_batch, norm_trunc,
+                   lognorm_trunc, exponential_trunc, contact_trunc)
+import GeoDT
 
 
 class GeoDTTest(unittest.TestCase):
@@ -16,7 +19,9 @@ class GeoDTTest(unittest.TestCase):
         # ****************************************************************************
         #### test program (i.e. script development)
         # ****************************************************************************
-        geom = Mesh()
+        # random identifier (statistically should be unique) and realization seed
+        pin = np.random.randint(100000000, 999999999, 1)[0]
+        geom = Mesh(seed=pin)
         #    geom.rock.s3Azn = 0.0*deg
         #    geom.rock.s3Dip = 0.0*deg
         #    phi = 30.0*deg
@@ -66,8 +71,6 @@ class GeoDTTest(unittest.TestCase):
         #        if (int(geom.wells[i].typ) in [typ('injector')]):
         #            target = int(i)
         #            geom.stim_and_flow(target=i,visuals=False,fname='run')
-        # random identifier (statistically should be unique)
-        pin = np.random.randint(100000000, 999999999, 1)[0]
 
         geom.stim_and_flow(target=[], visuals=True, fname=self.output_path(f'run_{pin}'))
 
@@ -129,6 +132,513 @@ class GeoDTTest(unittest.TestCase):
         #    #geom.gen_domain()
         #    geom.build_vtk('test')
 
+    def test_seeded_realization(self):
+        # the same pin gives the same fracture network
+        fracs = []
+        for k in range(2):
+            geom = Mesh(seed=123456789)
+            geom.gen_domain()
+            geom.gen_joint_sets()
+            geom.gen_wells(True, [])
+            fracs += [np.asarray([[f.c0[0], f.c0[1], f.c0[2], f.dia, f.bh, f.mcc] for f in geom.bound + geom.fracs])]
+        np.testing.assert_array_equal(fracs[0], fracs[1])
+
+        # child seeds give independent streams
+        kids = Mesh(seed=123456789).spawn(2)
+        self.assertNotEqual(Mesh(seed=kids[0]).rng.random(), Mesh(seed=kids[1]).rng.random())
+
+    heat_geom = None
+
+    def heat_model(self):
+        # seeded doublet/triplet realization with its flow solution (solved once, copied for each test)
+        if GeoDTTest.heat_geom is None:
+            geom = Mesh(seed=5)
+            geom.gen_domain()
+            geom.gen_joint_sets()
+            geom.gen_wells(True, [])
+            geom.stim_and_flow(target=[], visuals=False, fname=self.output_path('solver'))
+            GeoDTTest.heat_geom = geom
+        geom = copy.deepcopy(GeoDTTest.heat_geom)
+        # default heat solve for reference
+        geom.get_heat(plot=False)
+        return geom, np.copy(geom.p_hm)
+
+    def test_heat_regression(self):
+        # produced enthalpies of the seeded model as solved by the original per-pipe loops (t_n = 10)
+        geom, full = self.heat_model()
+        geom.get_heat(plot=False, t_n=10)
+        p_hm = [802.5368414427, 800.7890141434, 682.4846976335, 642.356753145, 619.8030045542, 603.4712757894,
+                590.7270411089, 581.3344377711, 573.6576263666, 566.8287623164]
+        w_h = [[802.5045450673, 800.7806066644, 682.385423241, 642.4354772798, 619.6758193095, 603.4015612977,
+                590.9345857269, 581.4817199649, 573.7677361791, 566.9280139113],
+               [802.5046050991, 800.7806673857, 682.3855603636, 642.4356452497, 619.6760052528, 603.4017605145,
+                590.9347970375, 581.4819387401, 573.7679612103, 566.9282440621],
+               [802.6013732607, 800.8057681461, 682.6831065255, 642.1991391064, 620.0571855511, 603.610503612,
+                590.3117463612, 581.0396587244, 573.4371847886, 566.6300317507]]
+        np.testing.assert_allclose(geom.p_hm[:-1], p_hm, atol=1.0e-3)
+        np.testing.assert_allclose(geom.w_h[geom.w_m < 0.0][:, :-1], w_h, atol=1.0e-3)
+
+    def test_heat_solvers(self):
+        # accelerated sweeps and upwind marching track the fixed-point sweeps
+        geom, full = self.heat_model()
+        for solver, accel in [['iterate', 'anderson'], ['march', None]]:
+            geom.get_heat(plot=False, solver=solver, accel=accel)
+            self.assertEqual(len(geom.h_conv), geom.rock.TimeSteps)
+            np.testing.assert_allclose(geom.p_hm[:-1], full[:-1], atol=5.0)
+
+    def test_heat_time_steps(self):
+        # fine uniform reference, averaged over each reporting interval (as a uniform step represents its interval)
+        geom, full = self.heat_model()
+        n = geom.rock.TimeSteps
+        geom.get_heat(plot=False, t_n=8 * n)
+        ref = geom.p_hm[:-1].reshape(n, 8).mean(axis=1)
+        # geometric and adaptive steps (bounded by the reporting interval) track it at every reporting time
+        for tstep in ['adaptive', 'geometric']:
+            geom.get_heat(plot=False, tstep=tstep)
+            self.assertEqual(len(geom.p_hm), len(full))
+            self.assertEqual(len(geom.h_ts), len(geom.h_conv))
+            self.assertLessEqual(np.max(np.diff(geom.h_ts)), geom.rock.LifeSpan / n * (1.0 + 1.0e-9))
+            np.testing.assert_allclose(geom.p_hm[:-1], ref, atol=15.0)
+        # closer than uniform steps at the reporting interval, with fewer steps than uniform steps at half of it
+        geom.get_heat(plot=False, tstep='adaptive')
+        self.assertLess(len(geom.h_ts), 2 * n)
+        self.assertLess(np.max(np.abs(geom.p_hm[:-1] - ref)), np.max(np.abs(full[:-1] - ref)))
+
+    def test_heat_restart(self):
+        # a restart from the checkpoint of the default run extends it with the same time step
+        geom, full = self.heat_model()
+        fname = self.output_path('heat_state.pkl')
+        geom.save_heat_state(fname)
+        dt = geom.rock.LifeSpan / geom.rock.TimeSteps
+        geom.get_heat(plot=False, t_f=geom.rock.LifeSpan + 20 * dt, restart=fname)
+        self.assertEqual(len(geom.h_its), geom.rock.TimeSteps + 20)
+        np.testing.assert_allclose(geom.p_hm[:len(full) - 1], full[:-1], atol=1.0e-6)
+        # and matches the longer run solved from zero
+        ext = np.copy(geom.p_hm)
+        geom.get_heat(plot=False, t_n=geom.rock.TimeSteps + 20, t_f=geom.rock.LifeSpan + 20 * dt)
+        np.testing.assert_allclose(ext, geom.p_hm, atol=1.0e-6)
+
+    def test_heat_history(self):
+        # reduced history policies give the same well series with smaller node histories
+        geom, full = self.heat_model()
+        nbytes = geom.ht.nbytes
+        fname = self.output_path('heat_stream.pkl')
+        for history in ['float32', 'decimated', 'wells']:
+            geom.get_heat(plot=False, history=history, stream=fname)
+            np.testing.assert_allclose(geom.p_hm, full, atol=1.0e-9)
+            self.assertLess(np.asarray(geom.ht).nbytes, nbytes)
+            self.assertEqual(len(geom.ht), len(geom.Tt))
+        # streamed step records
+        rec = load_heat_stream(fname)
+        self.assertEqual(len(rec['t']), geom.rock.TimeSteps)
+        np.testing.assert_allclose(rec['t'], geom.h_ts)
+
+    def test_heat_response(self):
+        # conduction response superposition (direct or FFT history sums) tracks the thermal radius model
+        geom, full = self.heat_model()
+        hc = []
+        for convolve in ['direct', 'fft']:
+            geom.get_heat(plot=False, thermal='response', convolve=convolve)
+            hc += [np.copy(geom.p_hm[:-1])]
+        np.testing.assert_allclose(hc[0], hc[1], atol=1.0e-6)
+        self.assertLess(np.mean(np.abs(hc[0][1:] - full[1:-1])), 15.0)
+
+    def test_heat_stop(self):
+        # step records with an early stop, and power and economics of the truncated series
+        geom, full = self.heat_model()
+
+        def collapse(rec):
+            return rec['p_h'] < 700.0
+
+        recs = []
+        for rec in geom.iter_heat(stop=collapse):
+            recs += [rec]
+        self.assertLess(len(recs), geom.rock.TimeSteps)
+        self.assertEqual(len(geom.Pout), len(recs))
+        np.testing.assert_allclose([rec['p_h'] for rec in recs], full[:len(recs)], atol=1.0e-9)
+        np.testing.assert_allclose(geom.p_hm[:-1], full[:len(recs)], atol=1.0e-9)
+        NPV, P, C, Q = geom.get_economics()
+        self.assertTrue(np.isfinite(NPV))
+
+    def test_heat_plot_defer(self):
+        # deferred plot data rendered after the run
+        geom, full = self.heat_model()
+        geom.get_heat(plot='defer')
+        np.testing.assert_array_equal(geom.p_hm, full)
+        fname = self.output_path('heat_plot.png')
+        plot_heat_batch([geom.h_plot], [fname])
+        self.assertTrue(Path(fname).exists())
+
+    def test_temperature_grid(self):
+        # ascii and binary agree, and a coarse solve upsampled keeps the coarse grid values
+        geom, full = self.heat_model()
+
+        def therm(fname, **kwargs):
+            fname = self.output_path(fname)
+            if Path(fname + '_therm.vtk').exists():
+                Path(fname + '_therm.vtk').unlink()
+            geom.build_pts(fname=fname, **kwargs)
+            with open(fname + '_therm.vtk', 'rb') as fd:
+                raw = fd.read()
+            raw = raw[raw.index(b'LOOKUP_TABLE default\n') + 21:]
+            if kwargs.get('binary', False):
+                return np.frombuffer(raw, dtype='>f4')
+            return np.asarray(raw.split(), dtype=float)
+
+        num = int(2.0 * geom.rock.size / 100.0) + 1
+        fine = therm('therm', spacing=100.0).reshape(num, num, num)
+        np.testing.assert_allclose(therm('therm_bin', spacing=100.0, binary=True).reshape(num, num, num), fine,
+                                   rtol=1.0e-6)
+        self.assertLess(np.min(fine), geom.rock.BH_T)
+        coarse = therm('therm_coarse', spacing=200.0).reshape((num + 1) // 2, (num + 1) // 2, (num + 1) // 2)
+        up = therm('therm_up', spacing=100.0, coarsen=2).reshape(num, num, num)
+        np.testing.assert_allclose(up[::2, ::2, ::2], coarse, rtol=1.0e-6)
+
+    def test_property_cache(self):
+        fname = self.output_path('props.pkl')
+        if Path(fname).exists():
+            Path(fname).unlink()
+        cache = GeoDT.prop_cache
+        try:
+            # repeated (rounded) scenarios are served from memory
+            GeoDT.prop_cache = PropCache(size=2, fname=fname)
+            hTP, ThP = enthalpy_fit(323.15, 473.15, 30.0)
+            enthalpy_fit(323.15 + 0.001, 473.15, 30.0)
+            self.assertEqual(GeoDT.prop_cache.hits, 1)
+            self.assertEqual(GeoDT.prop_cache.miss, 1)
+            self.assertAlmostEqual(np.polyval(hTP, 400.0), 4.2 * 127.0, delta=30.0)
+
+            # least recently used entries are evicted
+            enthalpy_fit(323.15, 423.15, 30.0)
+            enthalpy_fit(323.15, 373.15, 30.0)
+            self.assertEqual(len(GeoDT.prop_cache.memo), 2)
+
+            # new entries are only written on save, then reloaded
+            self.assertFalse(Path(fname).exists())
+            GeoDT.prop_cache.save()
+            GeoDT.prop_cache = PropCache(size=2, fname=fname)
+            enthalpy_fit(323.15, 373.15, 30.0)
+            self.assertEqual(GeoDT.prop_cache.hits, 1)
+
+            # an unreadable file starts an empty cache
+            with open(fname, 'wb') as f:
+                f.write(b'not a pickle')
+            self.assertEqual(len(PropCache(size=2, fname=fname).memo), 0)
+        finally:
+            GeoDT.prop_cache = cache
+            Path(fname).unlink()
+
+    def test_property_table(self):
+        from iapws import IAPWS97
+        table = ThermTable(nP=24, nU=24)
+        # compressed liquid, wet steam, and entropy inversions near documented accuracy
+        for kw in [dict(T=368.15, P=30.0), dict(P=1.0, h=700.0), dict(P=0.101, s=3.0), dict(P=1.0, x=1)]:
+            ref = IAPWS97(**kw)
+            tab = table.state(**kw)
+            self.assertAlmostEqual(tab.T, ref.T, delta=0.05)
+            self.assertAlmostEqual(tab.h, ref.h, delta=0.5)
+            self.assertAlmostEqual(tab.x, ref.x, delta=1.0e-3)
+        # arrays, and superheated steam is outside the table
+        tab = table.state(P=np.asarray([1.0, 1.0]), h=np.asarray([700.0, 3000.0]))
+        self.assertTrue(np.isfinite(tab.T[0]) and np.isnan(tab.T[1]))
+
+        # exact fallback through the backend switch
+        default = GeoDT.prop_table
+        try:
+            GeoDT.set_prop_backend('table', table)
+            self.assertAlmostEqual(GeoDT.prop(P=1.0, h=3000.0).h, 3000.0, delta=1.0e-6)
+        finally:
+            GeoDT.set_prop_backend('exact', default)
+
+    def test_power_engine(self):
+        # subcooled, flashing, and low-flow production through one call
+        h_pro = np.asarray([500.0, 800.0, 1100.0])
+        m_pro = np.asarray([30.0, 30.0, 10.0])
+        F, B, P, N = GeoDT.flash_binary_power(h_pro, m_pro, 25.0, 346.0, 20.0, 1.0, 0.1)
+        self.assertEqual(np.shape(N), (3,))
+        self.assertTrue(F[0] == 0.0 and F[1] > 0.0 and F[2] > 0.0)
+        np.testing.assert_allclose(N, F + B + P)
+        # array evaluation matches point-by-point evaluation
+        for i in range(0, 3):
+            one = GeoDT.flash_binary_power(h_pro[i], m_pro[i], 25.0, 346.0, 20.0, 1.0, 0.1)
+            np.testing.assert_allclose([F[i], B[i], P[i], N[i]], one)
+        # broadcasts over runs x times
+        N2 = GeoDT.flash_binary_power(h_pro[None, :], m_pro[None, :], 25.0, 346.0,
+                                      np.asarray([[20.0], [10.0]]), 1.0, 0.1)[3]
+        self.assertEqual(np.shape(N2), (2, 3))
+        np.testing.assert_allclose(N2[0], N)
+
+    def test_reprice_results(self):
+        fname = self.output_path('reprice.txt')
+        if Path(fname).exists():
+            Path(fname).unlink()
+        geom = Mesh(seed=11)
+        geom.gen_domain()
+        geom.gen_joint_sets()
+        geom.gen_wells(True, [])
+        geom.stim_and_flow(target=[], visuals=False, fname=self.output_path('reprice'))
+        geom.get_heat(plot=False)
+        geom.get_power()
+        NPV = geom.get_economics()[0]
+        geom.save(fname, 11)
+
+        # saved results reproduce the run
+        data, series = GeoDT.load_results(fname)
+        Pout, NPVs, P, C, Q = GeoDT.reprice_results(data, series, backend='exact')
+        self.assertEqual(np.shape(Pout), (1, len(geom.Pout)))
+        np.testing.assert_allclose(Pout[0], geom.Pout, atol=0.5)
+        self.assertAlmostEqual(NPVs[0], NPV, delta=1.0e-4 * abs(NPV))
+
+        # new economic assumptions without rerunning
+        NPVs2, P2 = GeoDT.reprice_results(fname, sales_kWh=0.2, backend='exact')[1:3]
+        self.assertGreaterEqual(P2[0], P[0])
+
+    def test_pressure_search(self):
+        # quiet stretch before hydraulic fracturing: bisection should land on the same stimulation
+        Ps = []
+        Ns = []
+        Ks = []
+        for psearch in ['step', 'bisect']:
+            geom = Mesh(seed=5)
+            geom.rock.hfmcc = 2.0 * GeoDT.MPa
+            geom.rock.dPi = 0.1 * GeoDT.MPa
+            geom.gen_domain()
+            geom.gen_joint_sets()
+            geom.gen_wells(True, [])
+            geom.dyn_stim(Vinj=geom.rock.Vstim, Qinj=geom.rock.Qstim, target=[], visuals=True, vtk='off',
+                          psearch=psearch)
+            Ps += [geom.nodes.p[geom.nodes.add(geom.wells[1].c0)[1]]]
+            Ns += [len(geom.faces)]
+            # first stimulating step (its fractures change in the next recorded row), numbered from the last step
+            R = np.nan_to_num(geom.v_Rs, nan=-1.0)
+            k = np.flatnonzero(np.any(R[1:] != R[:-1], axis=1))[0]
+            Ks += [[geom.s_state['iters'] - (len(R) - 1 - k), len(R), geom.v_Ps[k:], geom.v_Rs[k:]]]
+        self.assertEqual(Ns[0], Ns[1])
+        self.assertLess(np.abs(Ps[1] - Ps[0]), geom.rock.dPi)
+        # the bracketed jump skips quiet steps and lands on the step (and pressure) that first stimulates in the
+        # stepped run, and the same fractures stimulate from there on
+        self.assertEqual(Ks[0][0], Ks[1][0])
+        self.assertLess(Ks[1][1], Ks[0][1])
+        np.testing.assert_allclose(Ks[1][2], Ks[0][2])
+        np.testing.assert_allclose(Ks[1][3], Ks[0][3])
+
+        # resume on a fresh model from the checkpoint of the last iteration
+        fname = self.output_path('stim_checkpoint.pkl')
+        geom.dyn_stim(Vinj=geom.rock.Vstim, Qinj=geom.rock.Qstim, target=[], visuals=False, checkpoint=fname)
+        geom2 = Mesh(seed=5)
+        geom2.gen_domain()
+        geom2.gen_wells(True, [])
+        geom2.dyn_stim(target=[], visuals=False, restart=fname)
+        self.assertEqual(len(geom2.faces), len(geom.faces))
+        np.testing.assert_allclose(geom2.p_q, geom.p_q)
+        # resumed with visuals on a model without the natural fractures of the checkpoint
+        geom3 = Mesh(seed=5)
+        geom3.gen_domain()
+        geom3.gen_wells(True, [])
+        geom3.dyn_stim(target=[], visuals=True, vtk='off', restart=fname)
+        self.assertEqual(len(geom3.faces), len(geom.faces))
+        self.assertEqual(np.shape(geom3.v_Rs)[1], len(geom3.faces))
+        self.assertTrue(np.all(np.isfinite(geom3.v_Rs[:, :len(geom3.faces)])))
+
+        # the resume state leaves out visuals and deferred vtk frames
+        self.assertNotIn('visuals', geom.s_state)
+        self.assertNotIn('frames', geom.s_state)
+
+        # strided visuals with deferred vtk files
+        fname = self.output_path('stim_defer')
+        geom2.dyn_stim(target=[], visuals=True, fname=fname, v_stride=2, vtk='defer')
+        self.assertEqual(np.shape(geom2.v_Vs)[1], len(geom2.faces))
+        self.assertTrue(len(geom2.v_frames) > 0)
+        frames = [frame for name, vtype, frame in geom2.v_frames]
+        self.assertTrue(all(Path(frame).exists() for frame in frames))
+        geom2.export_vtk()
+        self.assertFalse(any(Path(frame).exists() for frame in frames))
+        self.assertTrue(Path(fname + '_B2_fnets.vtk').exists())
+        self.assertEqual(len(geom2.v_frames), 0)
+
+    def test_face_bookkeeping(self):
+        # stimulated realization with propped hydraulic fractures and choke pipes
+        geom = Mesh(seed=5)
+        geom.gen_domain()
+        geom.gen_joint_sets()
+        geom.gen_wells(True, [])
+        geom.dyn_stim(Vinj=geom.rock.Vstim, Qinj=geom.rock.Qstim, target=[], visuals=False)
+        self.assertTrue(len(geom.hydfs) > 0)
+        self.assertTrue(any(f.hydroprop for f in geom.faces))
+        self.assertIn(GeoDT.typ('propped'), [int(t) for t in geom.pipes.typ])
+        self.assertIn(GeoDT.typ('choke'), [int(t) for t in geom.pipes.typ])
+
+        # maximum node pressure per face, face by face over the fracture-type pipes
+        frac = [GeoDT.typ('boundary'), GeoDT.typ('fracture'), GeoDT.typ('propped'), GeoDT.typ('choke')]
+        for p_floor in [geom.rock.BH_P, 0.0]:
+            pmax = np.ones(len(geom.faces), dtype=float) * p_floor
+            for i in range(0, geom.pipes.num):
+                if int(geom.pipes.typ[i]) in frac:
+                    f = geom.pipes.fID[i]
+                    pmax[f] = np.max([pmax[f], geom.nodes.p[geom.pipes.n0[i]], geom.nodes.p[geom.pipes.n1[i]]])
+            np.testing.assert_array_equal(geom.get_pmax(p_floor), pmax)
+
+        # network volume without boundary planes, face by face
+        vol = 0.0
+        V = []
+        for f in geom.faces:
+            V += [(4.0 / 3.0) * np.pi * 0.25 * f.dia ** 2.0 * 0.5 * f.bd]
+            if GeoDT.typ(f.typ) != 'boundary':
+                vol += V[-1]
+        vol_net, R, w, V_net = geom.net_volume()
+        self.assertAlmostEqual(vol_net, vol, delta=1.0e-12 * vol)
+        np.testing.assert_allclose(V_net, V, rtol=1.0e-12)
+        np.testing.assert_array_equal(R, [0.5 * f.dia for f in geom.faces])
+        np.testing.assert_array_equal(w, [f.bd for f in geom.faces])
+
+    def test_par_stim(self):
+        # well intervals without natural fractures only connect through the far field and producers
+        geom = Mesh(seed=11)
+        geom.rock.fNum = np.asarray([0, 0, 0], dtype=int)
+        geom.gen_domain()
+        geom.gen_joint_sets()
+        geom.gen_wells(True, [])
+        groups = geom.par_stim(Vinj=geom.rock.Vstim, Qinj=geom.rock.Qstim, target=[], visuals=False, workers=2)
+        self.assertEqual(len(groups), 5)
+        self.assertEqual(len(geom.faces), 6 + 5 * geom.rock.perf)
+        self.assertTrue(all(geom.wells[w].hydrofrac for w in np.concatenate(groups)))
+        self.assertTrue(np.all(geom.p_q[np.concatenate(groups)] > 0.0))
+
+    def test_instanced_geometry(self):
+        from scipy.spatial import ConvexHull
+        import SimpleGeometry as sg
+
+        # disks match the rotate-and-translate construction
+        disk = sg.rotateObj(sg.convexFromPoints(sg.diskTemplate()[0] * [20.0, 20.0, 0.5]), [0.0, 1.0, 0.0], 0.7)
+        disk = sg.transObj(sg.rotateObj(disk, [0.0, 0.0, 1.0], -2.1), [5.0, -3.0, 1.0])
+        pts, simps = sg.HFs([20.0], [[5.0, -3.0, 1.0]], [2.1], [0.7], h=0.5)
+        np.testing.assert_allclose(pts[0], disk[0], atol=1e-12)
+
+        # shared cylinder simplices close the hull of every instance
+        rng = np.random.default_rng(3)
+        x0s = rng.normal(size=(4, 3)) * 100.0
+        x1s = x0s + rng.normal(size=(4, 3)) * 50.0
+        x1s[3] = x0s[3] - [0.0, 0.0, 10.0]
+        pts, simps = sg.cylObjs(x0s, x1s, r=2.0)
+        self.assertEqual(pts.shape, (4, 40, 3))
+        for p in pts:
+            c = np.mean(p, axis=0)
+            vol = np.abs(np.einsum('ij,ij->i', p[simps[:, 0]] - c,
+                                   np.cross(p[simps[:, 1]] - c, p[simps[:, 2]] - c))).sum() / 6.0
+            self.assertAlmostEqual(vol, ConvexHull(p).volume, places=6)
+
+    def test_vtk_writers(self):
+        import base64
+        import re
+        import zlib
+        import SimpleGeometry as sg
+
+        objs = sg.instanceObjs(*sg.cylObjs([[0.0, 0.0, 0.0], [5.0, 1.0, 2.0]], [[1.0, 2.0, 3.0], [9.0, 9.0, 9.0]], 0.5))
+        objs += [sg.HF(3.0, [1.0, 1.0, 1.0], 0.3, 0.2)]
+        cols = [[1, 2, 3], [0.5, 1.5, 2.5]]
+        points, cells, cellScalars = sg.objectArrays(objs, cols)
+
+        def decode(raw, encoding, compress):
+            # read back the appended blocks by array name
+            head, data = raw.split(b'<AppendedData encoding="%s">\n_' % encoding.encode())
+            tags = re.findall(rb'<DataArray type="\w+" (?:Name="(\w+)" )?\S* ?format="appended" offset="(\d+)"', head)
+            names = [(name or b'points').decode() for name, off in tags]
+            offs = [int(off) for name, off in tags]
+            ends = sorted(offs) + [data.rindex(b'\n</AppendedData>')]
+            out = {}
+            for name, off in zip(names, offs):
+                blk = data[off:ends[ends.index(off) + 1]]
+                if encoding == 'base64' and compress:
+                    nb = int(np.frombuffer(base64.b64decode(blk[:32]), dtype=np.uint64)[0])
+                    n = 4 * int(np.ceil(8 * (3 + nb) / 3))
+                    sizes = np.frombuffer(base64.b64decode(blk[:n]), dtype=np.uint64)[3:]
+                    body = base64.b64decode(blk[n:])
+                elif encoding == 'base64':
+                    body = base64.b64decode(blk)
+                    body = body[8:8 + int(np.frombuffer(body[:8], dtype=np.uint64)[0])]
+                elif compress:
+                    nb = int(np.frombuffer(blk[:8], dtype=np.uint64)[0])
+                    sizes = np.frombuffer(blk[24:24 + 8 * nb], dtype=np.uint64)
+                    body = blk[24 + 8 * nb:]
+                else:
+                    body = blk[8:8 + int(np.frombuffer(blk[:8], dtype=np.uint64)[0])]
+                if compress:
+                    chunks, pos = [], 0
+                    for size in sizes:
+                        chunks += [zlib.decompress(body[pos:pos + int(size)])]
+                        pos += int(size)
+                    body = b''.join(chunks)
+                out[name] = body
+            return out
+
+        # legacy ascii keeps its layout
+        vtkFile = sg.writeObjects(objs, cols, ['a', 'b'], self.output_path('test_vtk_writers'))
+        with open(vtkFile) as fd:
+            text = fd.read()
+        self.assertIn('POINTS %d float' % len(points), text)
+        self.assertIn('CELLS %d %d' % (len(cells), 4 * len(cells)), text)
+
+        # pipes as lines and nodes as vertices
+        vtkFile = sg.writeArrays(points[:4], [[0, 1], [1, 3]], [[7.0, 8.0]], ['q'], self.output_path('test_vtk_lines'))
+        with open(vtkFile) as fd:
+            text = fd.read()
+        self.assertIn('CELLS 2 6\n2 0 1\n2 1 3\n', text)
+        self.assertIn('CELL_TYPES 2\n3 3 \n', text)
+        vtkFile = sg.writeArrays(points[:4], np.arange(4), [np.arange(4)], ['n'], self.output_path('test_vtk_verts'),
+                                 'vtp')
+        with open(vtkFile, 'rb') as fd:
+            self.assertIn(b'NumberOfVerts="4"', fd.read())
+
+        for fmt, encoding, compress in [('vtu', 'raw', False), ('vtu', 'base64', False),
+                                        ('vtu', 'raw', True), ('vtp', 'base64', True)]:
+            vtkFile = sg.writeObjects(objs, cols, ['a', 'b'], self.output_path('test_vtk_writers'),
+                                      fmt, encoding, compress)
+            with open(vtkFile, 'rb') as fd:
+                blocks = decode(fd.read(), encoding, compress)
+            np.testing.assert_array_equal(np.frombuffer(blocks['connectivity'], dtype=np.int64), cells.ravel())
+            np.testing.assert_array_equal(np.frombuffer(blocks['points'], dtype=np.float64), points.ravel())
+            np.testing.assert_array_equal(np.frombuffer(blocks['b'], dtype=np.float64), cellScalars[1])
+
+    def test_vtk_series(self):
+        import pickle
+        import SimpleGeometry as sg
+
+        points, cells, cellScalars = sg.objectArrays(sg.instanceObjs(*sg.cylObjs(np.zeros((3, 3)), np.eye(3), 0.1)),
+                                                     [[1.0, 2.0, 3.0]])
+        series = sg.VtkSeries(self.output_path('test_vtk_series'), compress=True)
+        series.add(points, cells, cellScalars, ['a'], t=0.0)
+        block = series.cache['points'][1]
+        series.add(points, cells, [2.0 * cellScalars[0]], ['a'], t=10.0)
+        # unchanged geometry is not encoded again
+        self.assertIs(series.cache['points'][1], block)
+        with open(self.output_path('test_vtk_series.pvd')) as fd:
+            text = fd.read()
+        self.assertIn('timestep="10" group="" part="0" file="test_vtk_series_0001.vtu"', text)
+        self.assertEqual(pickle.loads(pickle.dumps(series)).cache, {})
+
+    def test_truncated_samplers(self):
+        rng = np.random.default_rng(42)
+
+        # narrow window far in the tail
+        s = norm_trunc(1000, 0.0, 1.0, 6.0, 6.001, rng=rng)
+        self.assertEqual(s.shape, (1000,))
+        self.assertTrue(np.all((s >= 6.0) & (s <= 6.001)))
+
+        s = lognorm_trunc(500, 0.0, 0.45, -1.0, 1.0, rng=rng)
+        self.assertTrue(np.all((s >= 0.1) & (s <= 10.0)))
+
+        s = exponential_trunc(500, bval=1.0, Mmax=3.0, Mwin=1.0, prob=0.1, rng=rng)
+        self.assertTrue(np.all(s <= 3.0))
+
+        s = contact_trunc(500, 0.15, 0.002, 0.001, 0.5, 0.001 / np.pi, 0.0001, 0.006, rng=rng)
+        self.assertEqual(len(s), 500)
+        self.assertTrue(np.all((s >= 0.0001) & (s <= 0.006)))
+
+        # same generator state gives the same draws
+        a = norm_trunc(10, 1.0, 2.0, 0.0, 3.0, rng=np.random.default_rng(7))
+        b = norm_trunc(10, 1.0, 2.0, 0.0, 3.0, rng=np.random.default_rng(7))
+        np.testing.assert_array_equal(a, b)
+
 
 if __name__ == '__main__':
     unittest.main()